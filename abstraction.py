@@ -0,0 +1,370 @@
+import argparse
+import json
+import os
+from itertools import combinations, permutations
+from math import comb
+from multiprocessing import Pool
+import numpy as np
+from PokerAI.cards import n_cards, hand_to_ints
+from PokerAI.evaluator import evaluate_with_board
+from PokerAI.rank_index import binomials
+
+"""
+Card abstraction of the flop: every situation of 2 hole cards on a flop is put in one of n_buckets buckets of
+situations with similar distributions of equity at the river.
+
+A situation is indexed by flop_index * n_holes + hole_index, the colexicographic positions of the flop among
+the subsets of 3 cards and of the hole cards among the subsets of 2 cards (see rank_index.py). Situations equal
+up to a permutation of the suits are the same, the canonical one being the smallest index over the 24
+permutations: there are 1,286,792 of them out of the 25,989,600 situations (among 29,304,600 indices, the hole
+cards of the others overlapping the flop). The canonical situations sharing a
+flop are contiguous, their flop being the canonical flop (1,755 of them).
+
+The build has three steps:
+* for each canonical flop, in a pool of workers, the equity against a random hand of every canonical hole
+  cards on the flop is computed for n_runouts turn and river cards (all 1176 of them if None), and histogrammed
+  on bins equal parts of [0, 1]. The histograms are written to a memory mapped file, the flops done to a
+  progress file, so that an interrupted build resumes.
+* the histograms are clustered by weighted k-means (each canonical situation weighing its number of
+  situations) on their cumulative distributions, the euclidean distance between cumulative distributions
+  standing for the earth mover's distance. The buckets are numbered by increasing mean equity.
+* the bucket of every one of the 25,989,600 situations is written to a table, a lookup is then one read.
+"""
+
+n_holes = comb(n_cards, 2)
+n_flops = comb(n_cards, 3)
+n_situations = n_flops * n_holes
+n_canonical_situations = 1_286_792
+
+table_folder = os.path.dirname(os.path.realpath(__file__)) + '/tables/'
+histograms_path = os.path.join(table_folder, 'abstraction_histograms.npy')
+buckets_path = os.path.join(table_folder, 'abstraction_buckets.npy')
+
+# the integer cards with their suit permuted, one row per permutation of the 4 suits
+suit_permutations = np.array([[4 * (card >> 2) + permutation[card & 3] for card in range(n_cards)]
+                              for permutation in permutations(range(4))], dtype=np.int64)
+# the subsets of 2 and 3 cards in colexicographic order: the subset of index i is at row i
+all_holes = np.array([subset[::-1] for subset in combinations(range(n_cards - 1, -1, -1), 2)][::-1], dtype=np.int64)
+all_flops = np.array([subset[::-1] for subset in combinations(range(n_cards - 1, -1, -1), 3)][::-1], dtype=np.int64)
+
+
+def subset_indices(cards):
+    """
+    Colexicographic positions of the subsets of integer cards given as an array of shape (..., k).
+
+    >>> subset_indices(all_flops[[0, 1000, -1]]).tolist(), subset_indices(np.array([51, 50])).tolist()
+    ([0, 1000, 22099], 1325)
+    """
+    cards = np.sort(cards, axis=-1)
+    return binomials[cards, np.arange(1, cards.shape[-1] + 1)].sum(axis=-1)
+
+
+def situation_indices(holes, flops):
+    """
+    Indices of the situations of hole cards and flops, integer arrays of shapes (..., 2) and (..., 3).
+    """
+    return subset_indices(flops) * n_holes + subset_indices(holes)
+
+
+def _canonical_block(flop_indices):
+    # canonical indices of all the situations of the given flops (n_flops x n_holes), with the mask of those
+    # whose hole cards do not overlap the flop
+    flops, holes = all_flops[flop_indices], all_holes
+    canonical = None
+    for permutation in suit_permutations:
+        indices = subset_indices(permutation[flops])[:, None] * n_holes + subset_indices(permutation[holes])[None, :]
+        canonical = indices if canonical is None else np.minimum(canonical, indices)
+    valid = ~(flops[:, None, :, None] == holes[None, :, None, :]).any(axis=(2, 3))
+    return canonical, valid
+
+
+def canonical_indices(holes, flops):
+    """
+    Index of the canonical situation of hole cards and flops, integer arrays of shapes (N, 2) and (N, 3).
+
+    >>> holes, flops = np.array([[48, 44], [49, 45]]), np.array([[0, 5, 10], [1, 4, 11]])
+    >>> canonical = canonical_indices(holes, flops)
+    >>> bool(canonical[0] == canonical[1]), bool(canonical[0] <= situation_indices(holes, flops).min())
+    (True, True)
+    """
+    holes, flops = np.asarray(holes, dtype=np.int64), np.asarray(flops, dtype=np.int64)
+    canonical = None
+    for permutation in suit_permutations:
+        indices = situation_indices(permutation[holes], permutation[flops])
+        canonical = indices if canonical is None else np.minimum(canonical, indices)
+    return canonical
+
+
+def _blocks(block_size=500):
+    return [np.arange(start, min(start + block_size, n_flops)) for start in range(0, n_flops, block_size)]
+
+
+def canonical_situations():
+    """
+    The sorted indices of the canonical situations, with the number of situations each stands for.
+    """
+    indices, counts = [], []
+    for flop_indices in _blocks():
+        canonical, valid = _canonical_block(flop_indices)
+        block_indices, block_counts = np.unique(canonical[valid], return_counts=True)
+        indices.append(block_indices)
+        counts.append(block_counts)
+    indices, inverse = np.unique(np.concatenate(indices), return_inverse=True)
+    return indices, np.bincount(inverse, weights=np.concatenate(counts)).astype(np.int64)
+
+
+def _count_in_rows(sorted_rows, rows, values, scale=1 << 15):
+    # numbers of the entries of the given rows of sorted_rows below and equal to values, all below scale
+    flat = (sorted_rows + np.arange(len(sorted_rows))[:, None] * scale).ravel()
+    queries = values + rows * scale
+    below = np.searchsorted(flat, queries) - rows * sorted_rows.shape[1]
+    return below, np.searchsorted(flat, queries, side='right') - rows * sorted_rows.shape[1] - below
+
+
+def flop_equities(flop, holes, runouts):
+    """
+    Equities against a random hand of each hole cards (an array of shape (H, 2)) on the flop (3 integer cards)
+    completed by each runout (an array of shape (R, 2)), as an (R, H) array, with the (R, H) mask of the hole
+    cards not overlapping the runout. Every hand of the cards left is evaluated once per runout, and the hands
+    beaten by each hole cards are counted among them, taking out those sharing one of the hole cards.
+
+    >>> flop, holes = [0, 5, 10], np.array([[48, 49], [12, 13]])
+    >>> equities, valid = flop_equities(flop, holes, np.array([[20, 30]]))
+    >>> np.round(equities, 3).tolist(), valid.tolist()
+    ([[0.869, 0.653]], [[True, True]])
+    """
+    flop = list(flop)
+    rest = np.setdiff1d(np.arange(n_cards), flop)
+    pairs = np.array(list(combinations(rest, 2)), dtype=np.int64)
+    pair_index = np.zeros((n_cards, n_cards), dtype=np.int64)
+    pair_index[pairs[:, 0], pairs[:, 1]] = pair_index[pairs[:, 1], pairs[:, 0]] = np.arange(len(pairs))
+    runouts = np.asarray(runouts, dtype=np.int64)
+    n_runouts, n_pairs = len(runouts), len(pairs)
+
+    # strengths of every pair on each runout, the pairs holding a card of the runout above any strength
+    sentinel = np.iinfo(np.int16).max
+    valid_pairs = ~(pairs[None, :, :, None] == runouts[:, None, None, :]).any(axis=(2, 3))
+    rows, columns = np.nonzero(valid_pairs)
+    strengths = np.full((n_runouts, n_pairs), sentinel, dtype=np.int64)
+    strengths[rows, columns] = evaluate_with_board(flop, np.hstack([pairs[columns], runouts[rows]]))
+
+    hero = strengths[:, pair_index[holes[:, 0], holes[:, 1]]]
+    runout_rows = np.broadcast_to(np.arange(n_runouts)[:, None], hero.shape)
+    below, tied = _count_in_rows(np.sort(strengths, axis=1), runout_rows, hero)
+
+    # the same counts among the pairs holding each hole card, taken out (the hole cards themselves are tied)
+    card_position = np.zeros(n_cards, dtype=np.int64)
+    card_position[rest] = np.arange(len(rest))
+    card_pairs = np.array([[pair_index[card, other] for other in rest if other != card] for card in rest])
+    per_card = np.sort(strengths[:, card_pairs], axis=2).reshape(n_runouts * len(rest), len(rest) - 1)
+    for column in (0, 1):
+        card_rows = runout_rows * len(rest) + card_position[holes[:, column]]
+        card_below, card_tied = _count_in_rows(per_card, card_rows, hero)
+        below -= card_below
+        tied -= card_tied
+    tied += 1
+
+    n_opponents = comb(n_cards - 7, 2)
+    valid = hero != sentinel
+    return np.where(valid, (below + tied / 2) / n_opponents, 0.), valid
+
+
+def _beside(path, suffix):
+    # the path of a file built with the table at path
+    return os.path.splitext(path)[0] + suffix
+
+
+def _check_parameters(path, parameters):
+    parameters_path = _beside(path, '.parameters.json')
+    built = None
+    if os.path.exists(parameters_path):
+        with open(parameters_path) as infile:
+            built = json.load(infile)
+    if built != parameters:
+        raise ValueError(f"The histograms at {path} were built with {built}, not {parameters}: remove them to build "
+                         f"them again")
+
+
+def _fill_flop(task):
+    path, flop_index, start, stop, n_runouts, bins, seed = task
+    situations = np.load(_beside(path, '.situations.npy'), mmap_mode='r')[start:stop]
+    holes = all_holes[situations % n_holes]
+    flop = all_flops[flop_index].tolist()
+    rest = np.setdiff1d(np.arange(n_cards), flop)
+    runouts = np.array(list(combinations(rest, 2)), dtype=np.int64)
+    if n_runouts is not None and n_runouts < len(runouts):
+        rng = np.random.default_rng([seed, flop_index])
+        runouts = runouts[rng.choice(len(runouts), n_runouts, replace=False)]
+
+    equities, valid = flop_equities(flop, holes, runouts)
+    bin_indices = np.minimum((equities * bins).astype(np.int64), bins - 1)
+    histograms = np.bincount((np.arange(len(holes)) * bins + bin_indices)[valid],
+                             minlength=len(holes) * bins).reshape(len(holes), bins)
+
+    table = np.load(path, mmap_mode='r+')
+    table[start:stop] = histograms
+    table.flush()
+    return flop_index
+
+
+def build_histograms(n_runouts=200, bins=20, workers=None, seed=0, path=histograms_path):
+    """
+    Compute the histograms of equity of all the canonical situations over a pool of workers processes (all
+    the cores by default) and write them to path, with the canonical situations, their counts and the
+    parameters of the build beside it. An interrupted build called again with the same arguments resumes where
+    it stopped, histograms built with other arguments raise a ValueError rather than being used.
+    """
+    progress_path = _beside(path, '.done.npy')
+    parameters = {'n_runouts': n_runouts, 'bins': bins, 'seed': seed}
+    if os.path.exists(path):
+        _check_parameters(path, parameters)
+        if not os.path.exists(progress_path):
+            return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    situations_path, counts_path = _beside(path, '.situations.npy'), _beside(path, '.counts.npy')
+    if os.path.exists(progress_path):
+        done = np.load(progress_path)
+    else:
+        with open(_beside(path, '.parameters.json'), 'w') as outfile:
+            json.dump(parameters, outfile)
+        situations, counts = canonical_situations()
+        np.save(situations_path, situations)
+        np.save(counts_path, counts)
+        np.lib.format.open_memmap(path, mode='w+', dtype=np.uint16, shape=(len(situations), bins)).flush()
+        done = np.zeros(n_flops, dtype=bool)
+        np.save(progress_path, done)
+
+    flop_of = np.load(situations_path) // n_holes
+    flop_indices, starts = np.unique(flop_of, return_index=True)
+    stops = np.append(starts[1:], len(flop_of))
+    tasks = [(path, flop_index, start, stop, n_runouts, bins, seed)
+             for flop_index, start, stop in zip(flop_indices.tolist(), starts.tolist(), stops.tolist())
+             if not done[flop_index]]
+    with Pool(workers) as pool:
+        for flop_index in pool.imap_unordered(_fill_flop, tasks):
+            done[flop_index] = True
+            temporary_path = progress_path + '.tmp.npy'
+            np.save(temporary_path, done)
+            os.replace(temporary_path, progress_path)
+    os.remove(progress_path)
+
+
+def kmeans(points, n_clusters, weights=None, iterations=25, seed=0, chunk_size=100_000):
+    """
+    Weighted k-means of the rows of points, started from k-means++ on a sample. Return the centers and the
+    index of the center of each point.
+
+    >>> points = np.array([[0., 0.], [0.1, 0.], [5., 5.], [5.1, 5.], [0., 0.1]])
+    >>> centers, labels = kmeans(points, 2)
+    >>> bool(labels[0] == labels[1] == labels[4] != labels[2] == labels[3])
+    True
+    """
+    rng = np.random.default_rng(seed)
+    points = np.asarray(points, dtype=np.float32)
+    weights = np.ones(len(points)) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    sample = rng.choice(len(points), min(len(points), 50_000), replace=False, p=weights / weights.sum())
+    candidates = points[sample]
+    centers = candidates[[rng.integers(len(candidates))]]
+    distances = ((candidates - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, n_clusters):
+        chosen = rng.choice(len(candidates), p=distances / distances.sum()) if distances.sum() else 0
+        centers = np.vstack([centers, candidates[chosen]])
+        distances = np.minimum(distances, ((candidates - candidates[chosen]) ** 2).sum(axis=1))
+
+    labels = np.full(len(points), -1, dtype=np.int64)
+    for _ in range(iterations):
+        new_labels = np.concatenate([
+            (-2 * points[start:start + chunk_size] @ centers.T + (centers ** 2).sum(axis=1)).argmin(axis=1)
+            for start in range(0, len(points), chunk_size)])
+        if (new_labels == labels).all():
+            break
+        labels = new_labels
+        totals = np.bincount(labels, weights=weights, minlength=n_clusters)
+        for dimension in range(points.shape[1]):
+            sums = np.bincount(labels, weights=weights * points[:, dimension], minlength=n_clusters)
+            centers[totals > 0, dimension] = sums[totals > 0] / totals[totals > 0]
+    return centers, labels
+
+
+def cluster(histograms, counts, n_buckets=50, iterations=25, seed=0):
+    """
+    Bucket of each histogram by k-means on the cumulative distributions, the buckets being numbered by
+    increasing mean equity.
+    """
+    histograms = np.asarray(histograms, dtype=np.float64)
+    distributions = histograms / np.maximum(histograms.sum(axis=1, keepdims=True), 1)
+    _, labels = kmeans(np.cumsum(distributions, axis=1), n_buckets, weights=counts, iterations=iterations, seed=seed)
+
+    bins = histograms.shape[1]
+    means = distributions @ ((np.arange(bins) + 0.5) / bins)
+    totals = np.bincount(labels, weights=counts, minlength=n_buckets)
+    bucket_means = np.bincount(labels, weights=counts * means, minlength=n_buckets) / np.maximum(totals, 1)
+    order = np.argsort(np.argsort(bucket_means, kind='stable'), kind='stable')
+    return order[labels]
+
+
+def build_table(n_buckets=50, n_runouts=200, bins=20, workers=None, seed=0, iterations=25,
+                histograms_path=histograms_path, path=buckets_path):
+    """
+    Build (or resume) the histograms, cluster them and write the bucket of every situation to path.
+    """
+    build_histograms(n_runouts=n_runouts, bins=bins, workers=workers, seed=seed, path=histograms_path)
+    situations = np.load(_beside(histograms_path, '.situations.npy'))
+    counts = np.load(_beside(histograms_path, '.counts.npy'))
+    buckets = cluster(np.load(histograms_path), counts, n_buckets=n_buckets, iterations=iterations, seed=seed)
+
+    table = np.zeros(n_situations, dtype=np.uint8 if n_buckets <= 256 else np.uint16)
+    for flop_indices in _blocks():
+        canonical, valid = _canonical_block(flop_indices)
+        block = np.where(valid, buckets[np.minimum(np.searchsorted(situations, canonical), len(situations) - 1)], 0)
+        table[flop_indices[0] * n_holes:(flop_indices[-1] + 1) * n_holes] = block.ravel()
+    temporary_path = path + '.tmp.npy'
+    np.save(temporary_path, table)
+    os.replace(temporary_path, path)
+    _tables.pop(path, None)
+    return table
+
+
+_tables = dict()
+
+
+def load_table(path=buckets_path):
+    """
+    The memory mapped table of the bucket of every situation.
+    """
+    if path not in _tables:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} is not built yet, run python -m PokerAI.abstraction build")
+        _tables[path] = np.load(path, mmap_mode='r')
+    return _tables[path]
+
+
+def buckets_batch(holes, flops, path=buckets_path):
+    """
+    Buckets of integer hole cards and flops, arrays of shapes (..., 2) and (..., 3).
+    """
+    return load_table(path)[situation_indices(np.asarray(holes), np.asarray(flops))]
+
+
+def bucket(my_hand, flop, path=buckets_path):
+    """
+    Bucket of (suit, number) hole cards on a flop.
+    """
+    return int(buckets_batch(np.array(hand_to_ints(my_hand)), np.array(hand_to_ints(flop)), path=path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the table of the buckets of all the flop situations')
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--buckets', type=int, default=50)
+    parser.add_argument('--runouts', type=int, default=200, help='turn and river cards per flop, 0 for all')
+    parser.add_argument('--bins', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=None, help='processes used, all the cores by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--path', default=buckets_path)
+    args = parser.parse_args()
+    table = build_table(n_buckets=args.buckets, n_runouts=args.runouts or None, bins=args.bins,
+                        workers=args.workers, seed=args.seed, path=args.path)
+    print(f'{len(table):,} situations in {args.buckets} buckets written to {args.path}')
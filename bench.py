@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+from PokerAI.cards import ints_to_hand
+from PokerAI.evaluator import evaluate, evaluate_batch, categories, categories_batch
+from PokerAI.hand import (
+    suit_to_numbers_number_to_suits,
+    detect_flush,
+    detect_straight,
+    detect_full_house,
+    detect_four_of_a_kind,
+    detect_three_of_a_kind,
+    detect_two_pairs,
+    detect_pair,
+    detect_highest_five,
+    best_five,
+    is_better,
+)
+from PokerAI.deck import ShuffledDeck, Round, get_raw_proba_of_winning
+
+"""
+Benchmarks of the hot paths of hand evaluation and simulation, run offline with
+
+    python -m PokerAI.bench [--save] [--threshold 20] [--baseline bench_baseline.json] [--output rates.txt]
+
+Every benchmark reports a rate (hands, deals or simulations per second), the best of a few repeats in each of
+--runs passes over all the benchmarks, so that a slow moment of the machine does not pass for a regression. The
+hands come from a corpus drawn with a fixed seed holding the same number of 7 cards hands of each category, so
+that the rare categories (straight flushes, four of a kind...) weigh as much as the common ones. With --save the
+rates are stored as the JSON baseline; otherwise they are compared to the baseline and the command fails when a
+rate dropped by more than the threshold, in percent. The rates depend on the machine, so no baseline comes with
+the package: run once with --save before changing the code, then without it after.
+"""
+
+baseline_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'bench_baseline.json')
+
+
+def hand_corpus(per_category=100, seed=0, batch_size=200_000, n_cards=7):
+    """
+    per_category integer hands of n_cards cards of each category, as an (n_categories * per_category, n_cards)
+    array sorted by category.
+
+    >>> corpus = hand_corpus(per_category=2)
+    >>> corpus.shape, categories_batch(evaluate_batch(corpus)).tolist()[::2]
+    ((18, 7), [0, 1, 2, 3, 4, 5, 6, 7, 8])
+    """
+    rng = np.random.default_rng(seed)
+    found = [[] for _ in categories]
+    while min(len(hands) for hands in found) < per_category:
+        cards = rng.random((batch_size, 52)).argsort(axis=1)[:, :n_cards]
+        indices = categories_batch(evaluate_batch(cards))
+        for index, hands in enumerate(found):
+            hands.extend(cards[indices == index][:per_category - len(hands)])
+    return np.array([hand for hands in found for hand in hands])
+
+
+def measure(function, n_items, repeat=5, min_time=0.1):
+    """
+    Items per second of function() processing n_items. function is called as many times as needed to last
+    min_time seconds, and the best of repeat such measures is kept.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, time.perf_counter() - start)
+    return number * n_items / best
+
+
+def benchmarks(per_category=100, seed=0):
+    """
+    The benchmarks as a dictionary name -> (function, number of items processed, unit).
+    """
+    corpus = hand_corpus(per_category, seed)
+    hands = [ints_to_hand(cards) for cards in corpus.tolist()]
+    dictionaries = [suit_to_numbers_number_to_suits(hand) for hand in hands]
+    best_hands = [best_five(hand) for hand in hands]
+    pairs = list(zip(best_hands, best_hands[1:] + best_hands[:1]))
+    n = len(hands)
+
+    cases = {
+        'suit_to_numbers_number_to_suits': (lambda: [suit_to_numbers_number_to_suits(hand) for hand in hands], n),
+        'detect_flush': (lambda: [detect_flush(suit_to_numbers) for suit_to_numbers, _ in dictionaries], n),
+        'detect_straight': (lambda: [detect_straight(hand) for hand in hands], n),
+        'detect_highest_five': (lambda: [detect_highest_five(hand) for hand in hands], n),
+        'best_five': (lambda: [best_five(hand) for hand in hands], n),
+        'is_better': (lambda: [is_better(hand_1, hand_2) for hand_1, hand_2 in pairs], n),
+        'evaluate': (lambda: [evaluate(cards) for cards in corpus.tolist()], n),
+        'evaluate_batch': (lambda: evaluate_batch(np.tile(corpus, (100, 1))), 100 * n),
+    }
+    for detect in (detect_full_house, detect_four_of_a_kind, detect_three_of_a_kind, detect_two_pairs, detect_pair):
+        cases[detect.__name__] = (
+            lambda detect=detect: [detect(number_to_suits) for _, number_to_suits in dictionaries], n)
+    cases = {name: (function, n_items, 'hands/s') for name, (function, n_items) in cases.items()}
+
+    rng = np.random.default_rng(seed)
+    cases['ShuffledDeck'] = (lambda: [ShuffledDeck(rng=rng) for _ in range(1000)], 1000, 'decks/s')
+    cases['ShuffledDeck.deal'] = (lambda: [ShuffledDeck(rng=rng).deal(7) for _ in range(1000)], 1000, 'deals/s')
+    for n_players in (2, 6, 9):
+        round = Round(n_players, rng=np.random.default_rng(seed))
+        cases[f'Round.simulate_blindly[{n_players}]'] = (
+            lambda round=round: [round.simulate_blindly() for _ in range(500)], 500, 'simulations/s')
+        cases[f'Round.simulate_strengths[{n_players}]'] = (
+            lambda round=round: [round.simulate_strengths() for _ in range(500)], 500, 'simulations/s')
+    for n_players in (2, 6):
+        for n_runs in (1_000, 10_000):
+            cases[f'get_raw_proba_of_winning[{n_players},{n_runs}]'] = (
+                lambda n_players=n_players, n_runs=n_runs: get_raw_proba_of_winning(
+                    hands[0][:2], n_players, n_runs=n_runs, use_table=False, seed=seed),
+                n_runs, 'simulations/s')
+    return cases
+
+
+def run(names=None, per_category=100, seed=0, repeat=5, runs=3):
+    """
+    The rates of the benchmarks (all of them by default) as a dictionary name -> (rate, unit), the best of runs
+    passes over the benchmarks.
+    """
+    cases = {name: case for name, case in benchmarks(per_category, seed).items() if names is None or name in names}
+    rates = dict()
+    for _ in range(runs):
+        for name, (function, n_items, unit) in cases.items():
+            rates[name] = (max(measure(function, n_items, repeat), rates.get(name, (0,))[0]), unit)
+    return rates
+
+
+def compare(rates, baseline, threshold=20.):
+    """
+    The names of the benchmarks whose rate dropped by more than threshold percent of their baseline rate.
+
+    >>> compare({'a': (80., 'hands/s'), 'b': (50., 'hands/s')}, {'a': [100., 'hands/s'], 'b': [90., 'hands/s']})
+    ['b']
+    """
+    return [name for name, (rate, _) in rates.items()
+            if name in baseline and rate < baseline[name][0] * (1 - threshold / 100)]
+
+
+def report(rates, baseline=None):
+    lines = []
+    for name, (rate, unit) in rates.items():
+        line = f'{name:45} {rate:14,.0f} {unit}'
+        if baseline and name in baseline:
+            line += f'  ({100 * (rate / baseline[name][0] - 1):+.1f}%)'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the hand evaluation and simulation hot paths')
+    parser.add_argument('--save', action='store_true', help='store the rates as the new baseline')
+    parser.add_argument('--baseline', default=baseline_path)
+    parser.add_argument('--threshold', type=float, default=20., help='regression allowed, in percent')
+    parser.add_argument('--only', nargs='*', default=None, help='names of the benchmarks to run')
+    parser.add_argument('--per-category', type=int, default=100, help='hands of each category in the corpus')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--runs', type=int, default=3, help='passes over the benchmarks, the best rate is kept')
+    parser.add_argument('--output', default=None, help='file to write the report to')
+    args = parser.parse_args()
+
+    rates = run(args.only, per_category=args.per_category, repeat=args.repeat, runs=args.runs)
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)['rates']
+    elif not args.save:
+        print(f'No baseline at {args.baseline}, run with --save first to record one')
+    text = report(rates, baseline)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(text + '\n')
+
+    if args.save:
+        with open(args.baseline, 'w') as outfile:
+            json.dump({'python': sys.version.split()[0], 'machine': platform.machine(), 'rates': rates}, outfile,
+                      indent=2)
+    elif baseline is not None:
+        regressions = compare(rates, baseline, args.threshold)
+        if regressions:
+            print(f'Regressions of more than {args.threshold}%: {", ".join(regressions)}')
+            sys.exit(1)
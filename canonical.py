@@ -0,0 +1,213 @@
+import os
+import pickle
+import re
+from collections import OrderedDict
+from itertools import permutations
+from PokerAI.cards import suits, card_to_int, hand_to_ints, int_to_card
+from PokerAI.hand import best_five
+from PokerAI import equity as equity_module
+
+"""
+Queries that only differ by a permutation of the suits have the same answer: AsKs on a rainbow board is worth
+exactly as much as AhKh on the same board with spades and hearts swapped. canonical_form maps the groups of
+cards of a query (hole cards, board, dead cards, ...) to the smallest of their 24 images by a suit permutation,
+so that all those queries share a single key, and the answers are memoized under that key in bounded LRU caches
+which keep statistics of their hits and misses and can be saved to disk between runs.
+
+>>> key, _ = canonical_form([('S', 14), ('S', 13)], [('D', 2), ('C', 7), ('H', 9)])
+>>> key == canonical_form([('H', 14), ('H', 13)], [('D', 2), ('C', 7), ('S', 9)])[0]
+True
+"""
+
+_permutations = list(permutations(range(len(suits))))
+_specific_combo = re.compile(r'[2-9TJQKA][shdc][2-9TJQKA][shdc]')
+
+
+def canonical_form(*groups):
+    """
+    The canonical key of groups of (suit, number) cards, the order of the cards inside a group being irrelevant,
+    and the permutation of the suit indices (see cards.py) mapping the groups to that key.
+
+    >>> canonical_form([('C', 14), ('D', 14)])
+    (((48, 49),), (2, 3, 0, 1))
+    """
+    groups = [hand_to_ints(group or []) for group in groups]
+    best = None
+    for permutation in _permutations:
+        key = tuple(tuple(sorted((card & ~3) | permutation[card & 3] for card in group)) for group in groups)
+        if best is None or key < best[0]:
+            best = key, permutation
+    return best
+
+
+def _freeze(value):
+    # a hashable version of the arguments of a query, made of lists of cards and plain values
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+class LRUCache:
+    """
+    Dictionary keeping at most maxsize entries, the least recently used one being dropped first, and counting
+    the hits and misses of its lookups. Given a path, the entries are loaded from it if it exists and written to
+    it by save.
+
+    >>> cache = LRUCache(maxsize=2)
+    >>> cache.put('a', 1); cache.put('b', 2); cache.get('a'); cache.put('c', 3)
+    1
+    >>> cache.get('b'), len(cache), cache.stats()
+    (None, 2, {'hits': 1, 'misses': 1, 'size': 2, 'maxsize': 2, 'hit_rate': 0.5})
+    """
+
+    def __init__(self, maxsize=10_000, path=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def get(self, key, default=None):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        n_lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize,
+                'hit_rate': self.hits / n_lookups if n_lookups else 0.}
+
+    def save(self, path=None):
+        """
+        Write the entries, the most recently used last, atomically to path (by default the path of the cache).
+        """
+        path = path or self.path
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as outfile:
+            pickle.dump(list(self.entries.items()), outfile)
+        os.replace(temporary_path, path)
+
+    def load(self, path=None):
+        with open(path or self.path, 'rb') as infile:
+            for key, value in pickle.load(infile):
+                self.put(key, value)
+
+
+best_five_cache = LRUCache()
+equity_cache = LRUCache()
+outs_cache = LRUCache()
+
+
+def cached_best_five(hand, cache=None):
+    """
+    best_five of hand, computed once for all the hands equal up to the suits and to the order of the cards. The
+    cards returned are those of hand, but among equally good cards the choice may differ from best_five(hand).
+
+    >>> cached_best_five([('D', 14), ('D', 4), ('H', 14), ('D', 8), ('D', 13), ('S', 4), ('D', 2)])[0]
+    'flush'
+    """
+    cache = best_five_cache if cache is None else cache
+    (cards,), permutation = canonical_form(hand)
+    result = cache.get(cards)
+    if result is None:
+        result = best_five([int_to_card(card) for card in cards])
+        cache.put(cards, result)
+    inverse = {suits[permutation[index]]: suit for index, suit in enumerate(suits)}
+    category, best = result
+    return category, [(inverse[suit], number) for suit, number in best]
+
+
+def equity_key(my_hand, n_players, board=None, dead=None, opponent_hands=None, **kwargs):
+    """
+    The key of an equity query in the cache of cached_equity, the same for all the queries equal up to the
+    suits, to the order of the cards and to the order of the known opponent hands.
+
+    >>> equity_key([('S', 14), ('S', 13)], 2, n_runs=100) == equity_key([('H', 13), ('H', 14)], 2, n_runs=100)
+    True
+    """
+    groups, _ = canonical_form(my_hand, board, dead, *(opponent_hands or []))
+    return groups[:3], tuple(sorted(groups[3:])), n_players, _freeze(kwargs)
+
+
+def cached_equity(my_hand, n_players, board=None, dead=None, opponent_hands=None, cache=None, **kwargs):
+    """
+    equity.equity, computed once for all the queries equal up to the suits and to the order of the cards. The
+    other arguments (n_runs, method, seed...) are part of the key, so a simulation is not run again with fewer
+    runs. Note that with no seed, the cached estimate is returned again instead of a new one. Each call gets its
+    own copy, so that changing it leaves the cache as it was.
+
+    >>> equity_cache.clear()
+    >>> p = cached_equity([('S', 14), ('S', 13)], 2, board=[('D', 2), ('C', 7), ('H', 9)], n_runs=1000, seed=0)
+    >>> q = cached_equity([('H', 13), ('H', 14)], 2, board=[('D', 2), ('C', 7), ('S', 9)], n_runs=1000, seed=0)
+    >>> p == q, p is q, equity_cache.stats()['hits']
+    (True, False, 1)
+    """
+    cache = equity_cache if cache is None else cache
+    opponent_hands = list(opponent_hands or [])
+    key = equity_key(my_hand, n_players, board, dead, opponent_hands, **kwargs)
+    p = cache.get(key)
+    if p is None:
+        p = equity_module.equity(my_hand, n_players, board=board, dead=dead, opponent_hands=opponent_hands,
+                                 **kwargs)
+        cache.put(key, p)
+    return p.copy()
+
+
+def cached_outs(my_hand, board, opponent_range=None, dead=None, cache=None, **kwargs):
+    """
+    outs.outs, computed once for all the queries equal up to the suits and to the order of the cards. Ranges
+    naming specific combos (such as 'AsKs') or given as weights are not symmetric in the suits, those queries
+    are computed without the cache. The other arguments (max_runouts, rng) are passed to outs.
+
+    >>> result = cached_outs([('H', 14), ('H', 13)], [('H', 2), ('H', 7), ('S', 9)], opponent_range='99, 77, 22')
+    >>> len(result['outs']), result['outs'][0], result['cards'][:2]
+    (8, ('H', 3), [('S', 2), ('D', 2)])
+    """
+    from PokerAI.outs import outs
+    symmetric = opponent_range is None or isinstance(opponent_range, str) and not _specific_combo.search(opponent_range)
+    if not symmetric:
+        return outs(my_hand, board, opponent_range=opponent_range, dead=dead, **kwargs)
+
+    cache = outs_cache if cache is None else cache
+    groups, permutation = canonical_form(my_hand, board, dead)
+    key = (groups, opponent_range, _freeze(kwargs))
+    result = cache.get(key)
+    if result is None:
+        canonical_hands = [[int_to_card(card) for card in group] for group in groups]
+        result = outs(*canonical_hands[:2], opponent_range=opponent_range, dead=canonical_hands[2], **kwargs)
+        cache.put(key, result)
+
+    inverse = {suits[permutation[index]]: suit for index, suit in enumerate(suits)}
+    cards = [(inverse[suit], number) for suit, number in result['cards']]
+    order = sorted(range(len(cards)), key=lambda index: card_to_int(cards[index]))
+    mapped = dict(result)
+    mapped['cards'] = [cards[index] for index in order]
+    mapped['categories'] = [result['categories'][index] for index in order]
+    mapped['win_rates'] = result['win_rates'][order]
+    for name in ('outs', 'improving'):
+        mapped[name] = sorted([(inverse[suit], number) for suit, number in result[name]], key=card_to_int)
+    return mapped
@@ -0,0 +1,72 @@
+import numpy as np
+
+"""
+Compact integer encoding of the cards. A card ('S', 14) used everywhere else in the package is encoded
+as the integer 4 * (number - 2) + suit_index, so that the 52 cards are the integers 0 to 51,
+card >> 2 gives the rank (0 for a 2, 12 for an ace) and card & 3 gives the suit.
+"""
+
+suits = ['S', 'H', 'D', 'C']
+faces = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
+faces_values = [i for i in range(2, 15)]
+
+suit_index = {suit: i for i, suit in enumerate(suits)}
+n_cards = 52
+
+
+def card_to_int(card):
+    """
+    >>> card_to_int(('S', 2))
+    0
+    >>> card_to_int(('C', 14))
+    51
+    """
+    suit, number = card
+    return 4 * (number - 2) + suit_index[suit]
+
+
+def int_to_card(card):
+    """
+    >>> int_to_card(51)
+    ('C', 14)
+    >>> int_to_card(card_to_int(('D', 10)))
+    ('D', 10)
+    """
+    return (suits[card & 3], (card >> 2) + 2)
+
+
+def hand_to_ints(hand):
+    """
+    >>> hand_to_ints([('S', 2), ('H', 2), ('C', 14)])
+    [0, 1, 51]
+    """
+    return [card_to_int(card) for card in hand]
+
+
+def ints_to_hand(cards):
+    """
+    >>> ints_to_hand([0, 1, 51])
+    [('S', 2), ('H', 2), ('C', 14)]
+    """
+    return [int_to_card(int(card)) for card in cards]
+
+
+def deal_many(cards, n_runs, n, rng=None):
+    """
+    Deal n of the given integer cards, n_runs independent times, with a partial Fisher-Yates shuffle of each
+    row of an (n_runs, len(cards)) array: only the first n positions of each row get shuffled. The random
+    numbers come from rng, a numpy.random.Generator, or from the global numpy random state by default.
+
+    >>> dealt = deal_many(np.arange(10), 100, 6)
+    >>> dealt.shape, all(len(set(deal)) == 6 for deal in dealt.tolist())
+    ((100, 6), True)
+    """
+    rng = rng or np.random
+    dealt = np.tile(np.asarray(cards, dtype=np.int8), (n_runs, 1))
+    rows = np.arange(n_runs)
+    for i in range(n):
+        picked = i + (rng.random(n_runs) * (dealt.shape[1] - i)).astype(np.int64)
+        cards_picked = dealt[rows, picked]
+        dealt[rows, picked] = dealt[:, i]
+        dealt[:, i] = cards_picked
+    return dealt[:, :n].astype(np.int64)
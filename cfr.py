@@ -0,0 +1,430 @@
+import argparse
+import os
+import numpy as np
+from PokerAI.cards import n_cards, hand_to_ints
+from PokerAI.evaluator import evaluate_with_board
+from PokerAI.ranges import combos, n_combos, to_weights
+from PokerAI.preflop import class_indices, names, n_classes
+
+"""
+Counterfactual regret minimization of two player zero sum games abstracted from hold'em: each player holds one
+of n_hands private hands, then they bet along a public tree whose leaves are folds or showdowns (all in before
+the flop, a river spot, a preflop tree checked down after the call...). A game is the tree with:
+* weights[h, j]: the weight of player 0 holding h and player 1 holding j (0 when they share a card), with
+  priors[p][h] the weights of the range of each player
+* equity[h, j]: the fraction of the pot won by player 0 holding h at the showdown against j
+
+The solver keeps the regrets and the sums of the strategies in dense arrays of shape
+(n_decisions, n_hands, n_actions), the infoset of a hand at a decision node being a row. An iteration walks the
+tree once per player, with the vectors of the reach probabilities of all the hands: the counterfactual values
+at a leaf are a product of a weights matrix by the opponent reach vector (vector form CFR). CFR+ is used by
+default: regrets floored at 0, linear averaging and alternating updates.
+
+The average strategy is exported to a .npz table read by StrategyTable, where looking up a decision is a
+dictionary access followed by a row of an array.
+"""
+
+_folder = os.path.dirname(os.path.realpath(__file__)) + '/tables/'
+
+
+class Game:
+    """
+    Betting tree of two players, built with add. Every node knows the chips each player has put in, its
+    history (the actions leading to it, separated by '/') and, for decisions, the player to act and its children
+    by action.
+    """
+
+    def __init__(self, hand_names, weights, equity, priors=None):
+        self.hand_names = list(hand_names)
+        self.n_hands = len(self.hand_names)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.equity = np.asarray(equity, dtype=np.float64)
+        ones = np.ones(self.n_hands)
+        self.priors = [ones, ones] if priors is None else [np.asarray(prior, dtype=np.float64) for prior in priors]
+        # the weights and the weights times the share of the pot of each player, as seen from the hands of that
+        # player (rows) against those of the other (columns)
+        self.player_weights = [self.weights, self.weights.T]
+        self.shares = [self.weights * self.equity, self.weights.T * (1 - self.equity.T)]
+        self.kinds, self.players, self.contributions, self.histories, self.children = [], [], [], [], []
+        self.decisions = dict()
+
+    def add(self, kind, contributions, history, player=None):
+        """
+        Add a 'decision' of player, a 'fold' of player or a 'showdown' node, and return its index.
+        """
+        self.kinds.append(kind)
+        self.players.append(player)
+        self.contributions.append(tuple(contributions))
+        self.histories.append(history)
+        self.children.append(dict())
+        if kind == 'decision':
+            self.decisions[len(self.kinds) - 1] = len(self.decisions)
+        return len(self.kinds) - 1
+
+    def link(self, parent, action, child):
+        self.children[parent][action] = child
+
+    @property
+    def n_actions(self):
+        return max(len(self.children[node]) for node in self.decisions)
+
+    def total_weight(self):
+        return self.priors[0] @ self.weights @ self.priors[1]
+
+
+def betting_tree(game, contributions, stack, player=0, bet_sizes=(0.5, 1.), max_bets=2, history=''):
+    """
+    Add to game the betting of a street starting with the given chips put in, player to act first and at most
+    max_bets bets and raises, each of a fraction of bet_sizes of the pot after calling, or all in (up to stack
+    chips in all). The street ends with a showdown when a call or a check closes the action. Return the root.
+    """
+    def build(contributions, player, n_bets, history, acted):
+        node = game.add('decision', contributions, history, player)
+        other = 1 - player
+        to_call = contributions[other] - contributions[player]
+        prefix = history + '/' if history else ''
+        if to_call > 0:
+            game.link(node, 'fold', game.add('fold', contributions, prefix + 'fold', player))
+        called = list(contributions)
+        called[player] = contributions[other]
+        action = 'call' if to_call > 0 else 'check'
+        if acted:
+            game.link(node, action, game.add('showdown', called, prefix + action))
+        else:
+            game.link(node, action, build(called, other, n_bets, prefix + action, True))
+        if n_bets < max_bets and contributions[other] < stack:
+            pot = sum(called)
+            amounts = dict()
+            for size in bet_sizes:
+                total = min(stack, called[player] + size * pot)
+                amounts.setdefault(total, 'all in' if total == stack else f'bet {size:g}')
+            amounts.setdefault(stack, 'all in')
+            for total, action in sorted(amounts.items()):
+                raised = list(contributions)
+                raised[player] = total
+                game.link(node, action, build(raised, other, n_bets + 1, prefix + action, True))
+        return node
+
+    return build(list(contributions), player, 0, history, False)
+
+
+def river_game(board, ranges=(None, None), pot=2., stack=None, bet_sizes=(0.5, 1.), max_bets=2):
+    """
+    A river spot on the board of 5 (suit, number) cards: each player put pot / 2 in, has stack chips in all
+    (5 pots by default) and holds a combo of its range (in the notation of ranges.py, every combo by default),
+    player 0 acting first. The showdowns are decided by the evaluator.
+    """
+    board_cards = hand_to_ints(board)
+    priors = [to_weights(hand_range) if hand_range is not None else np.ones(n_combos) for hand_range in ranges]
+    on_board = np.isin(combos, board_cards).any(axis=1)
+    kept = np.flatnonzero(~on_board & ((priors[0] > 0) | (priors[1] > 0)))
+    hands = combos[kept]
+
+    strengths = evaluate_with_board(board_cards, hands)
+    equity = (strengths[:, None] > strengths[None, :]) + 0.5 * (strengths[:, None] == strengths[None, :])
+    weights = ~(hands[:, None, :, None] == hands[None, :, None, :]).any(axis=(2, 3))
+    game = Game([tuple(hand) for hand in hands.tolist()], weights, equity, [prior[kept] for prior in priors])
+    stack = 5 * pot + pot / 2 if stack is None else stack
+    betting_tree(game, (pot / 2, pot / 2), stack, bet_sizes=bet_sizes, max_bets=max_bets)
+    return game
+
+
+def class_weights():
+    """
+    Number of pairs of combos not sharing a card between the 169 classes of preflop.py.
+
+    >>> weights = class_weights()
+    >>> float(weights[names.index('AA'), names.index('AA')]), float(weights[names.index('AKs'), names.index('72o')])
+    (6.0, 48.0)
+    """
+    classes = class_indices(combos)
+    disjoint = ~(combos[:, None, :, None] == combos[None, :, None, :]).any(axis=(2, 3))
+    one_hot = np.zeros((n_combos, n_classes))
+    one_hot[np.arange(n_combos), classes] = 1
+    return one_hot.T @ disjoint @ one_hot
+
+
+def sampled_preflop_equity(n_boards=1000, seed=0):
+    """
+    Fraction of the pot won all in before the flop by each class against each other, estimated over n_boards
+    random boards, every pair of combos not sharing a card with each other nor the board being evaluated on each.
+    """
+    rng = np.random.default_rng(seed)
+    disjoint = ~(combos[:, None, :, None] == combos[None, :, None, :]).any(axis=(2, 3))
+    scores = np.zeros((n_combos, n_combos), dtype=np.float32)
+    counts = np.zeros((n_combos, n_combos), dtype=np.float32)
+    for _ in range(n_boards):
+        board = rng.choice(n_cards, 5, replace=False)
+        valid = ~np.isin(combos, board).any(axis=1)
+        strengths = np.zeros(n_combos, dtype=np.int64)
+        strengths[valid] = evaluate_with_board(board.tolist(), combos[valid])
+        pairs = disjoint & valid[:, None] & valid[None, :]
+        scores += pairs * ((strengths[:, None] > strengths[None, :]) + 0.5 * (strengths[:, None] == strengths[None, :]))
+        counts += pairs
+
+    one_hot = np.zeros((n_combos, n_classes))
+    one_hot[np.arange(n_combos), class_indices(combos)] = 1
+    # the mean over the pairs of combos of the fractions estimated for each pair
+    fractions = np.divide(scores, counts, out=np.full(scores.shape, 0.5, dtype=np.float32), where=counts > 0)
+    return (one_hot.T @ (fractions * disjoint) @ one_hot) / class_weights()
+
+
+def push_fold_game(stack, equity, weights=None, small_blind=0.5, big_blind=1.):
+    """
+    Heads up push or fold before the flop with stack big blinds: the small blind (player 0) folds or goes all
+    in, the big blind folds or calls. equity is the matrix of preflop.names classes (exact in
+    headsup.equity_matrix, estimated by sampled_preflop_equity), weights those of class_weights by default.
+    """
+    game = Game(names, class_weights() if weights is None else weights, equity)
+    root = game.add('decision', (small_blind, big_blind), '', 0)
+    game.link(root, 'fold', game.add('fold', (small_blind, big_blind), 'fold', 0))
+    facing = game.add('decision', (stack, big_blind), 'all in', 1)
+    game.link(root, 'all in', facing)
+    game.link(facing, 'fold', game.add('fold', (stack, big_blind), 'all in/fold', 1))
+    game.link(facing, 'call', game.add('showdown', (stack, stack), 'all in/call'))
+    return game
+
+
+def preflop_game(stack, equity, weights=None, small_blind=0.5, big_blind=1., bet_sizes=(1.,), max_bets=3):
+    """
+    Heads up betting before the flop with stack big blinds, the hands being checked down after a call (see
+    betting_tree and push_fold_game).
+    """
+    game = Game(names, class_weights() if weights is None else weights, equity)
+    betting_tree(game, (small_blind, big_blind), stack, bet_sizes=bet_sizes, max_bets=max_bets)
+    return game
+
+
+class CFR:
+    """
+    Solver of a Game, see the top of the module.
+
+    >>> board = [('S', 14), ('H', 10), ('D', 7), ('C', 4), ('S', 2)]
+    >>> game = river_game(board, ranges=('AK, 77, QJs', 'AK, 55-22, QJs'))
+    >>> solver = CFR(game)
+    >>> solver.iterate(200)
+    >>> bool(solver.exploitability() < 0.01 * 2)
+    True
+    """
+
+    def __init__(self, game, plus=True):
+        self.game = game
+        self.plus = plus
+        shape = (len(game.decisions), game.n_hands, game.n_actions)
+        self.regrets = np.zeros(shape)
+        self.strategy_sums = np.zeros(shape)
+        self.iteration = 0
+        self.legal = np.zeros((len(game.decisions), game.n_actions), dtype=bool)
+        for node, decision in game.decisions.items():
+            self.legal[decision, :len(game.children[node])] = True
+
+    def current_strategy(self, decision):
+        positive = np.maximum(self.regrets[decision], 0) * self.legal[decision]
+        totals = positive.sum(axis=1, keepdims=True)
+        uniform = self.legal[decision] / self.legal[decision].sum()
+        return np.where(totals > 0, positive / np.where(totals > 0, totals, 1), uniform)
+
+    def average_strategy(self):
+        totals = self.strategy_sums.sum(axis=2, keepdims=True)
+        uniform = self.legal / self.legal.sum(axis=1, keepdims=True)
+        return np.where(totals > 0, self.strategy_sums / np.where(totals > 0, totals, 1), uniform[:, None, :])
+
+    def _leaf(self, node, player, opponent_reach):
+        # counterfactual values of the hands of player at a fold or a showdown
+        game = self.game
+        contributions = game.contributions[node]
+        if game.kinds[node] == 'fold':
+            payoff = -contributions[player] if game.players[node] == player else contributions[1 - player]
+            return payoff * (game.player_weights[player] @ opponent_reach)
+        return sum(contributions) * (game.shares[player] @ opponent_reach) - contributions[player] * (
+            game.player_weights[player] @ opponent_reach)
+
+    def _traverse(self, node, player, reaches, weight):
+        game = self.game
+        if game.kinds[node] != 'decision':
+            return self._leaf(node, player, reaches[1 - player])
+        decision, acting = game.decisions[node], game.players[node]
+        strategy = self.current_strategy(decision)
+        children = list(game.children[node].values())
+        if acting != player:
+            values = 0
+            for action, child in enumerate(children):
+                child_reaches = list(reaches)
+                child_reaches[acting] = reaches[acting] * strategy[:, action]
+                values = values + self._traverse(child, player, child_reaches, weight)
+            return values
+
+        action_values = np.zeros((game.n_hands, self.legal.shape[1]))
+        for action, child in enumerate(children):
+            child_reaches = list(reaches)
+            child_reaches[acting] = reaches[acting] * strategy[:, action]
+            action_values[:, action] = self._traverse(child, player, child_reaches, weight)
+        values = (strategy * action_values).sum(axis=1)
+        self.regrets[decision] += (action_values - values[:, None]) * self.legal[decision]
+        if self.plus:
+            np.maximum(self.regrets[decision], 0, out=self.regrets[decision])
+        self.strategy_sums[decision] += weight * reaches[acting][:, None] * strategy
+        return values
+
+    def iterate(self, n_iterations=1):
+        """
+        Run n_iterations iterations, each updating the strategies of both players.
+        """
+        for _ in range(n_iterations):
+            self.iteration += 1
+            weight = self.iteration if self.plus else 1
+            for player in (0, 1):
+                self._traverse(0, player, list(self.game.priors), weight)
+
+    def _best_response(self, node, player, reaches, strategy):
+        game = self.game
+        if game.kinds[node] != 'decision':
+            return self._leaf(node, player, reaches[1 - player])
+        decision, acting = game.decisions[node], game.players[node]
+        values = []
+        for action, child in enumerate(game.children[node].values()):
+            child_reaches = list(reaches)
+            if acting != player:
+                child_reaches[acting] = reaches[acting] * strategy[decision, :, action]
+            values.append(self._best_response(child, player, child_reaches, strategy))
+        return np.max(values, axis=0) if acting == player else np.sum(values, axis=0)
+
+    def values(self, strategy=None):
+        """
+        The expected chips won by each player (per deal) with strategy (the average strategy by default).
+        """
+        strategy = self.average_strategy() if strategy is None else strategy
+        game = self.game
+
+        def expected(node, reaches):
+            if game.kinds[node] != 'decision':
+                return reaches[0] @ self._leaf(node, 0, reaches[1])
+            decision, acting = game.decisions[node], game.players[node]
+            total = 0.
+            for action, child in enumerate(game.children[node].values()):
+                child_reaches = list(reaches)
+                child_reaches[acting] = reaches[acting] * strategy[decision, :, action]
+                total += expected(child, child_reaches)
+            return total
+
+        value = float(expected(0, list(game.priors)) / game.total_weight())
+        return value, -value
+
+    def exploitability(self):
+        """
+        Mean of the chips per deal the best response of each player wins against the average strategy of the
+        other, 0 at an equilibrium.
+        """
+        strategy = self.average_strategy()
+        total = sum(self.game.priors[player] @ self._best_response(0, player, list(self.game.priors), strategy)
+                    for player in (0, 1))
+        return float(total / self.game.total_weight() / 2)
+
+    def save(self, path):
+        """
+        Checkpoint the regrets, the strategy sums and the iteration to path, a .npz file.
+        """
+        temporary_path = path + '.tmp.npz'
+        np.savez(temporary_path, regrets=self.regrets, strategy_sums=self.strategy_sums, iteration=self.iteration)
+        os.replace(temporary_path, path)
+
+    def load(self, path):
+        with np.load(path) as checkpoint:
+            self.regrets, self.strategy_sums = checkpoint['regrets'], checkpoint['strategy_sums']
+            self.iteration = int(checkpoint['iteration'])
+
+    def solve(self, n_iterations, target=None, checkpoint_path=None, checkpoint_every=100):
+        """
+        Iterate until n_iterations in all or until the exploitability (checked every checkpoint_every
+        iterations) is below target, resuming from checkpoint_path if it exists and saving to it on the way.
+        Return the exploitability reached.
+        """
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            self.load(checkpoint_path)
+        exploitability = None
+        while self.iteration < n_iterations:
+            self.iterate(min(checkpoint_every, n_iterations - self.iteration))
+            if checkpoint_path is not None:
+                self.save(checkpoint_path)
+            if target is not None:
+                exploitability = self.exploitability()
+                if exploitability <= target:
+                    break
+        return self.exploitability() if exploitability is None else exploitability
+
+    def export(self, path):
+        """
+        Write the average strategy to path, a .npz file read by StrategyTable.
+        """
+        game = self.game
+        nodes = sorted(game.decisions, key=game.decisions.get)
+        n_actions = self.legal.shape[1]
+        actions = [list(game.children[node]) + [''] * (n_actions - len(game.children[node])) for node in nodes]
+        temporary_path = path + '.tmp.npz'
+        np.savez(temporary_path, strategy=self.average_strategy().astype(np.float32),
+                 histories=np.array([game.histories[node] for node in nodes]), actions=np.array(actions),
+                 players=np.array([game.players[node] for node in nodes]),
+                 hand_names=np.array([str(name) for name in game.hand_names]))
+        os.replace(temporary_path, path)
+
+
+class StrategyTable:
+    """
+    An exported strategy: the probabilities of the actions of a hand (its index in the hands of the game) at
+    the decision of a history.
+
+    >>> import tempfile
+    >>> game = push_fold_game(2, np.full((n_classes, n_classes), 0.5))
+    >>> solver = CFR(game)
+    >>> solver.iterate(50)
+    >>> path = os.path.join(tempfile.mkdtemp(), 'push_fold.npz')
+    >>> solver.export(path)
+    >>> table = StrategyTable(path)
+    >>> table.actions(''), round(float(table.probabilities('', names.index('72o'))[1]), 2)
+    (['fold', 'all in'], 1.0)
+    """
+
+    def __init__(self, path):
+        with np.load(path) as exported:
+            self.strategy = exported['strategy']
+            self.histories = exported['histories'].tolist()
+            self.action_names = exported['actions'].tolist()
+            self.players = exported['players'].tolist()
+            self.hand_names = exported['hand_names'].tolist()
+        self.decisions = {history: index for index, history in enumerate(self.histories)}
+        self.hand_index = {name: index for index, name in enumerate(self.hand_names)}
+
+    def actions(self, history):
+        return [action for action in self.action_names[self.decisions[history]] if action]
+
+    def probabilities(self, history, hands):
+        """
+        The probabilities of the actions at history of the hands (an index or an array of indices).
+        """
+        return self.strategy[self.decisions[history], hands]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve heads up push or fold and export the strategy')
+    parser.add_argument('--stack', type=float, default=10., help='in big blinds')
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--boards', type=int, default=2000,
+                        help='boards sampled for the preflop equities, unless headsup.py built the exact ones')
+    parser.add_argument('--checkpoint', default=None)
+    parser.add_argument('--path', default=None)
+    args = parser.parse_args()
+    path = args.path or os.path.join(_folder, f'push_fold_{args.stack:g}.npz')
+    from PokerAI import headsup
+    exact = os.path.exists(headsup.matrix_path)
+    equity = headsup.equity_matrix() if exact else sampled_preflop_equity(args.boards)
+    solver = CFR(push_fold_game(args.stack, equity))
+    exploitability = solver.solve(args.iterations, checkpoint_path=args.checkpoint)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    solver.export(path)
+    strategy = solver.average_strategy()
+    pushed = [name for index, name in enumerate(names) if strategy[0, index, 1] > 0.5]
+    called = [name for index, name in enumerate(names) if strategy[1, index, 1] > 0.5]
+    print(f'{args.stack:g} big blinds, exploitability {exploitability:.5f} big blinds per hand')
+    print(f'push {len(pushed)} classes: {", ".join(pushed)}')
+    print(f'call {len(called)} classes: {", ".join(called)}')
+    print(f'written to {path}')
@@ -1,12 +1,13 @@
-from itertools import product
 from functools import cached_property
-from collections import Counter, defaultdict
 import numpy as np
-from PokerAI.hand import best_five, is_better
+from PokerAI.cards import suits, faces, faces_values, n_cards, hand_to_ints, ints_to_hand, deal_many
+from PokerAI.evaluator import evaluate_batch
+from PokerAI.hand import best_five
+from PokerAI.equity import equity, EquityTracker, split_pot
+from PokerAI import preflop
+from PokerAI.canonical import cached_equity
 
-suits = ['S', 'H', 'D', 'C']
-faces = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
-faces_values = [i for i in range(2, 15)]
+_all_cards = np.arange(n_cards)
 
 def my_hand_wins(results):
     if -1 in results:
@@ -17,41 +18,123 @@ def my_hand_wins(results):
         return 1
 
 
-def get_raw_proba_of_winning(my_hand, n_players, n_runs=100):
-    loss_draw_win = []
-    round = Round(n_players=n_players)
-    for i in range(n_runs):
-        round = Round(n_players=n_players)
-        best_hands, results = round.simulate_blindly(my_hand=my_hand)
-        loss_draw_win.append(my_hand_wins(results))
-    c = Counter(loss_draw_win)
-    p = {k: v / n_runs for k, v in c.items()}
-    return defaultdict(int, p)
+def get_raw_proba_of_winning(my_hand, n_players, n_runs=100, exact=False, use_table=True, use_cache=False, **kwargs):
+    """
+    Probabilities of winning (1), drawing (0) or losing (-1) with my_hand against n_players - 1 random hands.
+    With exact=True (or method='exact') all the possible deals of the unknown cards are enumerated instead of
+    simulating n_runs of them. The other parameters (board, dead cards, known opponent hands, method, seed,
+    workers...) are those of equity.equity; the returned dictionary also tells the method used and the number
+    of hands evaluated.
+    Before the flop, when nothing else is known, the probabilities are read from the preflop table if it was
+    built (see preflop.py) and use_table is True.
+    With use_cache=True, the results are memoized for all the queries equal up to the suits, see canonical.py.
+    """
+    if exact:
+        kwargs['method'] = 'exact'
+    known = any(kwargs.get(name) for name in ('board', 'dead', 'opponent_hands'))
+    if use_table and kwargs.get('method') != 'exact' and not known:
+        p = preflop.lookup(my_hand, n_players)
+        if p is not None:
+            return p
+    if use_cache:
+        return cached_equity(my_hand, n_players, n_runs=n_runs, **kwargs)
+    return equity(my_hand, n_players, n_runs=n_runs, **kwargs)
+
+
+class Deck:
+    """
+    Reusable deck of the integer cards of cards.py. The live cards are kept at the beginning of a preallocated
+    array, along with the position of each card in that array, so that removing a card (by swapping it with the
+    last live card) takes O(1); the removed cards are flagged in a 52 bits mask. Dealing draws only the cards
+    needed with a partial Fisher-Yates shuffle, and reset puts the cards back without any allocation.
+
+    >>> deck = Deck(exclude=[0, 51], rng=np.random.default_rng(0))
+    >>> len(deck), deck.is_live(0), deck.is_live(1)
+    (50, False, True)
+    >>> hand = deck.deal(2)
+    >>> len(deck), deck.is_live(hand[0]), deck.deal_many(1000, 5).shape
+    (48, False, (1000, 5))
+    """
+
+    def __init__(self, exclude=None, rng=None):
+        self.rng = rng or np.random.default_rng()
+        self.cards = np.arange(n_cards)
+        self.positions = np.arange(n_cards)
+        self.reset(exclude)
+
+    def reset(self, exclude=None):
+        """
+        Put back all the cards, except the excluded ones.
+        """
+        self.cards[:] = _all_cards
+        self.positions[:] = _all_cards
+        self.size = n_cards
+        self.removed = 0
+        for card in exclude or []:
+            self.remove(card)
+
+    def remove(self, card):
+        if self.removed >> card & 1:
+            return
+        self.removed |= 1 << card
+        self.size -= 1
+        position, last = self.positions[card], self.cards[self.size]
+        self.cards[position], self.positions[last] = last, position
+        self.cards[self.size], self.positions[card] = card, self.size
+
+    def is_live(self, card):
+        return not self.removed >> card & 1
+
+    @property
+    def live(self):
+        return self.cards[:self.size].copy()
+
+    def deal(self, n):
+        picks = (self.rng.random(n) * (self.size - np.arange(n))).astype(np.int64)
+        dealt = []
+        for pick in picks.tolist():
+            card = int(self.cards[pick])
+            self.remove(card)
+            dealt.append(card)
+        return dealt
+
+    def deal_many(self, n_runs, n):
+        """
+        n_runs independent deals of n of the live cards, as an (n_runs, n) array. The deck is left untouched.
+        """
+        return deal_many(self.cards[:self.size], n_runs, n, rng=self.rng)
 
+    def __len__(self):
+        return self.size
 
-class ShuffledDeck:
-    def __init__(self, exclude=None):
-        self.deck = list(product(suits, faces_values))
 
-        if exclude is not None:
-            self.deck = [card for card in self.deck if card not in exclude]
+class ShuffledDeck:
+    """
+    Deck of (suit, number) cards, dealt from a Deck.
+    """
+    def __init__(self, exclude=None, rng=None):
+        self.cards = Deck(exclude=hand_to_ints(exclude or []), rng=rng)
 
-        np.random.shuffle(self.deck)
+    @property
+    def deck(self):
+        return ints_to_hand(self.cards.live)
 
     def deal(self, n):
-        return [self.deck.pop() for i in range(n)]
+        return ints_to_hand(self.cards.deal(n))
     
     def __len__(self):
-        return len(self.deck)
+        return len(self.cards)
     
 
 class Round():
-    def __init__(self, n_players):
+    def __init__(self, n_players, rng=None):
         self.n_players = n_players
-        self.shuffled_deck = ShuffledDeck()
+        self.shuffled_deck = ShuffledDeck(rng=rng)
+        self.simulation_deck = Deck(rng=self.shuffled_deck.cards.rng)
         self.flop_ = False
         self.turn_ = False
         self.river_ = False
+        self.trackers = dict()
     
     @cached_property
     def dealt_hands(self):
@@ -74,42 +157,79 @@ class Round():
         self.river_ = True
         return self.shuffled_deck.deal(1)
     
+    @property
+    def board(self):
+        """
+        The common cards dealt so far.
+        """
+        board = []
+        if self.flop_:
+            board += self.flop
+        if self.turn_:
+            board += self.turn
+        if self.river_:
+            board += self.river
+        return board
+
+    def equity(self, my_hand=None, dead=None, n_runs=10_000, seed=None):
+        """
+        Probabilities of winning, drawing or losing with my_hand (by default the first dealt hand) given the
+        common cards dealt so far and the dead cards known. The simulated deals are kept from one street to the
+        next and only topped up or evaluated again where the new cards require it, see equity.EquityTracker.
+        """
+        if my_hand is None:
+            my_hand = self.dealt_hands[0]
+        key = tuple(my_hand)
+        if key not in self.trackers:
+            self.trackers[key] = EquityTracker(my_hand, self.n_players, n_runs=n_runs, seed=seed)
+        return self.trackers[key].update(board=self.board, dead=dead)
+
+    def showdown(self):
+        """
+        Compare the dealt hands once the river is dealt. Return the strengths of the best hands (see
+        evaluator.py), the indices of the winners and the fraction of the pot each player gets.
+        """
+        assert self.river_, "The river has not yet been dealt"
+        hands = np.array([hand_to_ints(hand + self.board) for hand in self.dealt_hands])
+        strengths = evaluate_batch(hands)
+        winners, shares = split_pot(strengths)
+        return strengths.tolist(), np.flatnonzero(winners).tolist(), shares.tolist()
+
     @cached_property
     def deck_copy(self):
         return self.shuffled_deck.deck.copy()
     
     def simulate_end(self, n):
-        np.random.shuffle(self.deck_copy)
-        return self.deck_copy[:n]
+        return ints_to_hand(self.shuffled_deck.cards.deal_many(1, n)[0])
     
+    def _simulate(self, my_hand):
+        # the integer hands of 7 cards of my_hand and of new hands of the other players on a new board
+        if my_hand is None:
+            my_hand = self.dealt_hands[0]
+        hero = hand_to_ints(my_hand)
+        self.simulation_deck.reset(exclude=hero)
+        dealt = self.simulation_deck.deal(5 + 2 * (self.n_players - 1))
+        hands = np.array([hero] + [dealt[i:i + 2] for i in range(5, len(dealt), 2)])
+        return np.hstack([hands, np.broadcast_to(dealt[:5], (len(hands), 5))])
+
     def simulate_blindly(self, my_hand=None):
         """
         Generate possible outcome for the hand you were dealt. Other players hand are re-dealt since we 
-        have no way to know which they are at any point
+        have no way to know which they are at any point.
+        Return the best_five of every player, yours first, and for each other player 1, 0 or -1 depending on
+        your hand being better, as good or worse, as hand.is_better would. See simulate_strengths for the
+        faster form returning the strengths of the hands.
         """
-        if my_hand is None:
-            my_hand = self.dealt_hands[0]
-        
-        sd = ShuffledDeck(exclude=my_hand)
-
-        other_hands = [sd.deal(2) for i in range(self.n_players - 1)]
-        common_cards = sd.deal(5)
-
-        own_best_five_hand = best_five(my_hand + common_cards)
-        others_best_hand = [best_five(hand + common_cards) for hand in other_hands]
-
-        win = []
-        for hand in others_best_hand:
-            win.append(is_better(own_best_five_hand, hand))
-        
-        return ([own_best_five_hand] + others_best_hand, win)
-    
-
-
-
-
-
-
-        
-
+        hands = self._simulate(my_hand)
+        strengths = evaluate_batch(hands).tolist()
+        win = [(strengths[0] > strength) - (strengths[0] < strength) for strength in strengths[1:]]
+        return ([best_five(ints_to_hand(hand)) for hand in hands.tolist()], win)
 
+    def simulate_strengths(self, my_hand=None):
+        """
+        simulate_blindly, but returning the strengths of the best hands (see evaluator.py) rather than the
+        best hands themselves.
+        """
+        strengths = evaluate_batch(self._simulate(my_hand)).tolist()
+        win = [(strengths[0] > strength) - (strengths[0] < strength) for strength in strengths[1:]]
+        return (strengths, win)
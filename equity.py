@@ -0,0 +1,405 @@
+from collections import Counter, defaultdict
+from copy import deepcopy
+from itertools import combinations
+from math import comb
+from multiprocessing import Pool
+import time
+import numpy as np
+from PokerAI.cards import n_cards, hand_to_ints, deal_many
+from PokerAI.evaluator import evaluate_batch
+
+"""
+Probabilities of winning, drawing or losing a round with a given hand, once all the players still in went to
+showdown. The cards which are not known (the missing common cards and the hands of the other players) are
+either dealt at random (Monte Carlo simulation) or, when there are few enough ways to deal them, exhaustively
+enumerated.
+
+In both cases the unknown cards of a deal are stored as a row of integers: first the cards completing the
+board, then two cards per opponent whose hand is not known.
+"""
+
+# above this number of possible deals, method='auto' simulates rather than enumerates
+max_exact_deals = 200_000
+# number of runs simulated at once, which bounds the memory used by the deals
+chunk_size = 50_000
+# number of standard deviations of the confidence intervals, 1.96 for 95% intervals
+z_score = 1.96
+
+
+class Equity(defaultdict):
+    """
+    Probabilities of winning (1), drawing (0) and losing (-1), with missing outcomes defaulting to 0 as
+    get_raw_proba_of_winning always did, along with how they were computed: the method ('exact' or
+    'simulate'), the number of deals considered and the number of hands evaluated. Simulated probabilities
+    also come with their confidence intervals, a dictionary of (low, high) per outcome, and with their
+    effective sample size n_effective, the number of independent deals as precise as the deals considered
+    (n_deals unless they were spread evenly, see sampling.py).
+    """
+
+    def __init__(self, probas=(), method=None, n_deals=0, n_evaluations=0, intervals=None, n_effective=None):
+        super().__init__(int, probas)
+        self.method = method
+        self.n_deals = n_deals
+        self.n_evaluations = n_evaluations
+        self.intervals = intervals
+        self.n_effective = n_deals if n_effective is None else n_effective
+
+    def __reduce__(self):
+        return self.__class__, (dict(self), self.method, self.n_deals, self.n_evaluations, self.intervals,
+                                self.n_effective)
+
+    def copy(self):
+        return deepcopy(self)
+
+    def __repr__(self):
+        return f'Equity({dict(self)}, method={self.method!r}, n_deals={self.n_deals})'
+
+
+def my_hands_win(results):
+    """
+    Vectorized deck.my_hand_wins, over the rows of an (n_runs, n_players - 1) array of results.
+
+    >>> my_hands_win(np.array([[1, -1], [0, 0], [1, 0]])).tolist()
+    [-1, 0, 1]
+    """
+    return np.where((results == -1).any(axis=1), -1, np.where((results == 0).all(axis=1), 0, 1))
+
+
+def split_pot(strengths):
+    """
+    Showdown of all the players at once, over the last axis of an array of strengths of shape (..., n_players):
+    the winners are the players of the highest strength and each of them gets an equal fraction of the pot.
+    Return the boolean array of the winners and the array of the pot fractions, both of the shape of strengths.
+
+    >>> winners, shares = split_pot(np.array([[5, 9, 9], [7, 3, 1]]))
+    >>> winners.tolist(), shares.tolist()
+    ([[False, True, True], [True, False, False]], [[0.0, 0.5, 0.5], [1.0, 0.0, 0.0]])
+    """
+    winners = strengths == strengths.max(axis=-1, keepdims=True)
+    return winners, winners / winners.sum(axis=-1, keepdims=True)
+
+
+def remaining_cards(*known):
+    """
+    The integer cards not present in any of the given lists of (suit, number) cards.
+
+    >>> len(remaining_cards([('S', 14), ('H', 14)], [('D', 2)]))
+    49
+    """
+    excluded = [card for cards in known if cards for card in hand_to_ints(cards)]
+    return np.setdiff1d(np.arange(n_cards), excluded)
+
+
+def n_possible_deals(n_remaining, n_missing, n_unknown):
+    """
+    Number of ways to complete a board missing n_missing cards and to deal the hands of n_unknown opponents.
+
+    >>> n_possible_deals(45, 2, 0), n_possible_deals(47, 2, 1)
+    (990, 1070190)
+    """
+    n_deals = comb(n_remaining, n_missing)
+    for i in range(n_unknown):
+        n_deals *= comb(n_remaining - n_missing - 2 * i, 2)
+    return n_deals
+
+
+def enumerate_deals(remaining, n_missing, n_unknown):
+    """
+    All the possible deals of the unknown cards, one per row.
+
+    >>> enumerate_deals(np.arange(5), 1, 1).shape
+    (30, 3)
+    """
+    deals = np.array(list(combinations(remaining, n_missing)), dtype=np.int64)
+    deals = deals.reshape(comb(len(remaining), n_missing), n_missing)
+    pairs = np.array(list(combinations(remaining, 2)), dtype=np.int64)
+    for _ in range(n_unknown):
+        rows = np.repeat(deals, len(pairs), axis=0)
+        hands = np.tile(pairs, (len(deals), 1))
+        collision = (rows[:, :, None] == hands[:, None, :]).any(axis=(1, 2))
+        deals = np.hstack([rows, hands])[~collision]
+    return deals
+
+
+def sample_deals(remaining, n_missing, n_unknown, n_runs, rng=None):
+    """
+    n_runs random deals of the unknown cards, one per row. The random numbers come from rng, a
+    numpy.random.Generator, or from the global numpy random state by default.
+
+    >>> deals = sample_deals(np.arange(10), 2, 2, 100)
+    >>> deals.shape, all(len(set(deal)) == 6 for deal in deals.tolist())
+    ((100, 6), True)
+    """
+    return deal_many(remaining, n_runs, n_missing + 2 * n_unknown, rng=rng)
+
+
+def showdown(hero, board, opponents, deals):
+    """
+    Results (1, 0 or -1) of hero against the other players, for each deal of the unknown cards. The hero,
+    the board and the known opponents hands are integer cards, opponents being a list of hands.
+    When at most two common cards are missing, the many deals sharing the same board only need one evaluation
+    of the hand of hero.
+    Return the results and the number of hands evaluated.
+    """
+    n_deals = len(deals)
+    n_missing = 5 - len(board)
+    common_cards = np.hstack([np.broadcast_to(board, (n_deals, len(board))), deals[:, :n_missing]])
+    if n_missing <= 2 and n_deals > 0:
+        completions, inverse = np.unique(np.sort(deals[:, :n_missing], axis=1), axis=0, return_inverse=True)
+        n_boards = len(completions)
+        boards = np.hstack([np.broadcast_to(board, (n_boards, len(board))), completions])
+        own_strength = evaluate_batch(np.hstack([np.broadcast_to(hero, (n_boards, len(hero))), boards]))
+        own_strength = own_strength[inverse.ravel()]
+    else:
+        n_boards = n_deals
+        own_strength = evaluate_batch(np.hstack([np.broadcast_to(hero, (n_deals, len(hero))), common_cards]))
+
+    n_unknown = (deals.shape[1] - n_missing) // 2
+    unknown = deals[:, n_missing:].reshape(n_deals, n_unknown, 2)
+    known = np.broadcast_to(np.array(opponents, dtype=np.int64).reshape(1, -1, 2), (n_deals, len(opponents), 2))
+    other_hands = np.concatenate([known, unknown], axis=1)
+    n_others = other_hands.shape[1]
+    others_strength = evaluate_batch(np.concatenate(
+        [other_hands, np.broadcast_to(common_cards[:, None], (n_deals, n_others, 5))], axis=2))
+
+    results = my_hands_win(np.sign(own_strength[:, None] - others_strength))
+    return results, n_boards + n_deals * n_others
+
+
+def _simulate_chunk(task):
+    hero, board, opponents, remaining, n_unknown, n_runs, rng = task
+    deals = sample_deals(remaining, 5 - len(board), n_unknown, n_runs, rng=rng)
+    results, n_evaluations = showdown(hero, board, opponents, deals)
+    return Counter(results.tolist()), n_evaluations
+
+
+def simulate(hero, board, opponents, remaining, n_unknown, n_runs, seed=None, workers=1, chunk_size=chunk_size,
+             rng=None):
+    """
+    Simulate n_runs deals of the remaining cards and count the results of hero, all cards being integers.
+    The runs are split in chunks of chunk_size, each chunk drawing its deals from its own numpy.random.Generator
+    spawned from numpy.random.SeedSequence(seed), and the chunks are shared among a pool of workers processes
+    (all the cores if None). The chunks not depending on the number of workers, a given seed gives the same
+    counts whatever the number of workers.
+    If rng is given, all the chunks draw from it one after the other, in this process.
+    Return the counts of the results and the number of hands evaluated.
+    """
+    sizes = [min(chunk_size, n_runs - start) for start in range(0, n_runs, chunk_size)]
+    if rng is not None:
+        generators, workers = [rng] * len(sizes), 1
+    else:
+        generators = [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(len(sizes))]
+    tasks = [(hero, board, opponents, remaining, n_unknown, size, generator)
+             for size, generator in zip(sizes, generators)]
+
+    if workers == 1 or len(tasks) == 1:
+        outputs = [_simulate_chunk(task) for task in tasks]
+    else:
+        with Pool(workers) as pool:
+            outputs = pool.map(_simulate_chunk, tasks)
+
+    counts, n_evaluations = Counter(), 0
+    for chunk_counts, chunk_evaluations in outputs:
+        counts.update(chunk_counts)
+        n_evaluations += chunk_evaluations
+    return counts, n_evaluations
+
+
+def wilson_interval(successes, n, z=z_score):
+    """
+    Wilson score interval of a probability estimated by successes out of n trials.
+
+    >>> low, high = wilson_interval(50, 100)
+    >>> round(low, 4), round(high, 4)
+    (0.4038, 0.5962)
+    """
+    p = successes / n
+    center = (p + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+    half_width = z / (1 + z ** 2 / n) * (p * (1 - p) / n + z ** 2 / (4 * n ** 2)) ** 0.5
+    return center - half_width, center + half_width
+
+
+def simulate_adaptive(hero, board, opponents, remaining, n_unknown, ci_halfwidth=None, deadline_ms=None,
+                      max_runs=1_000_000, batch_size=2_000, seed=None, rng=None):
+    """
+    Simulate batches of batch_size deals until the Wilson intervals of the probabilities of winning and of
+    drawing are narrower than 2 * ci_halfwidth, deadline_ms milliseconds have passed or max_runs deals were
+    simulated, whichever comes first. Each batch draws from its own generator spawned from
+    numpy.random.SeedSequence(seed), or from rng if given.
+    Return the counts of the results and the number of hands evaluated.
+    """
+    start = time.perf_counter()
+    seed_sequence = np.random.SeedSequence(seed)
+    counts, n_evaluations, n_runs = Counter(), 0, 0
+    while n_runs < max_runs:
+        generator = rng if rng is not None else np.random.default_rng(seed_sequence.spawn(1)[0])
+        task = (hero, board, opponents, remaining, n_unknown, min(batch_size, max_runs - n_runs), generator)
+        batch_counts, batch_evaluations = _simulate_chunk(task)
+        counts.update(batch_counts)
+        n_evaluations += batch_evaluations
+        n_runs += sum(batch_counts.values())
+
+        if ci_halfwidth is not None:
+            intervals = [wilson_interval(counts[outcome], n_runs) for outcome in (1, 0)]
+            if max(high - low for low, high in intervals) <= 2 * ci_halfwidth:
+                break
+        if deadline_ms is not None and (time.perf_counter() - start) * 1000 >= deadline_ms:
+            break
+    return counts, n_evaluations
+
+
+def equity(my_hand, n_players, board=None, dead=None, opponent_hands=None, n_runs=100, method='simulate',
+           max_deals=max_exact_deals, seed=None, workers=1, rng=None, ci_halfwidth=None, deadline_ms=None,
+           max_runs=1_000_000, sampling='random'):
+    """
+    Probabilities to win, draw or lose with my_hand against n_players - 1 opponents, given the common cards
+    already on the board, the dead cards known not to be in play and the hands of the first opponents, if known.
+    The method is one of:
+    * 'simulate': n_runs random deals of the unknown cards, see simulate for seed, workers and rng
+    * 'exact': enumerate all the possible deals
+    * 'auto': 'exact' if there are at most max_deals possible deals, 'simulate' otherwise
+    Giving a target ci_halfwidth for the confidence intervals or a time budget deadline_ms makes the simulation
+    sequential: it runs up to max_runs deals (instead of n_runs) and stops as soon as the target or the
+    deadline is reached, see simulate_adaptive.
+    The simulated deals are independent with sampling='random'; 'stratified' or 'quasi' spreads them evenly
+    over the opponent hands and the runouts for the same accuracy from fewer deals, see sampling.py (they are
+    then simulated in this process, whatever workers).
+
+    Heads-up on the turn against a known hand, only the 44 rivers need to be looked at:
+
+    >>> p = equity([('S', 14), ('H', 14)], 2, board=[('D', 2), ('C', 7), ('S', 9), ('H', 13)],
+    ...            opponent_hands=[[('D', 7), ('H', 7)]], method='auto')
+    >>> p.method, p.n_deals, round(p[1], 4), round(p[-1], 4)
+    ('exact', 44, 0.0455, 0.9545)
+    """
+    board = list(board or [])
+    opponent_hands = list(opponent_hands or [])
+    remaining = remaining_cards(my_hand, board, dead, *opponent_hands)
+    n_missing = 5 - len(board)
+    n_unknown = n_players - 1 - len(opponent_hands)
+    assert n_unknown >= 0, "More opponent hands than opponents"
+
+    if method == 'auto':
+        n_deals = n_possible_deals(len(remaining), n_missing, n_unknown)
+        method = 'exact' if n_deals <= max_deals else 'simulate'
+
+    hero = np.array(hand_to_ints(my_hand))
+    board = np.array(hand_to_ints(board), dtype=np.int64)
+    opponents = [hand_to_ints(hand) for hand in opponent_hands]
+    if method == 'exact':
+        results, n_evaluations = showdown(hero, board, opponents, enumerate_deals(remaining, n_missing, n_unknown))
+        c = Counter(results.tolist())
+    elif method == 'simulate' and sampling != 'random':
+        from PokerAI.sampling import simulate_sampled, replicate_equity
+        replicate_counts, n_evaluations = simulate_sampled(hero, board, opponents, remaining, n_unknown, n_runs,
+                                                           sampling=sampling, seed=seed, rng=rng,
+                                                           ci_halfwidth=ci_halfwidth, deadline_ms=deadline_ms,
+                                                           max_runs=max_runs)
+        return replicate_equity(replicate_counts, n_evaluations)
+    elif method == 'simulate' and (ci_halfwidth is not None or deadline_ms is not None):
+        c, n_evaluations = simulate_adaptive(hero, board, opponents, remaining, n_unknown, ci_halfwidth=ci_halfwidth,
+                                             deadline_ms=deadline_ms, max_runs=max_runs, seed=seed, rng=rng)
+    elif method == 'simulate':
+        c, n_evaluations = simulate(hero, board, opponents, remaining, n_unknown, n_runs, seed=seed,
+                                    workers=workers, rng=rng)
+    else:
+        raise ValueError(f"Unknown method {method}, should be 'simulate', 'exact' or 'auto'")
+
+    return equity_from_counts(c, method, n_evaluations)
+
+
+def equity_from_counts(counts, method, n_evaluations):
+    """
+    The Equity of the counts of the results of the deals, with confidence intervals if they were simulated.
+
+    >>> p = equity_from_counts(Counter({1: 30, -1: 70}), 'simulate', 200)
+    >>> p[1], p[0], p.n_deals, round(p.intervals[1][0], 4)
+    (0.3, 0, 100, 0.2189)
+    """
+    n_deals = sum(counts.values())
+    p = {k: v / n_deals for k, v in counts.items()}
+    intervals = None
+    if method == 'simulate':
+        intervals = {outcome: wilson_interval(counts[outcome], n_deals) for outcome in (1, 0, -1)}
+    return Equity(p, method=method, n_deals=n_deals, n_evaluations=n_evaluations, intervals=intervals)
+
+
+class EquityTracker:
+    """
+    Equity of a hand along the streets of a round, against n_players - 1 random hands. The simulated deals
+    (the five common cards then two cards per opponent) are kept from one street to the next. When a common
+    card is revealed, each deal is made consistent with it by swapping it into its board slot: a deal which had
+    given it to an opponent or to a later slot trades it with the card of that slot, a deal which had not dealt
+    it at all simply takes it. Such a swap keeps the deals uniformly distributed given the public cards, so the
+    opponents hands and the rest of the runouts are reused, and only the deals which changed are evaluated
+    again. Deals holding a card newly known to be dead are thrown away and the shortfall is simulated anew.
+
+    >>> tracker = EquityTracker([('S', 14), ('H', 14)], 3, n_runs=1_000, seed=0)
+    >>> p = tracker.update(board=[('D', 2), ('C', 7), ('S', 9)])
+    >>> p = tracker.update(board=[('D', 2), ('C', 7), ('S', 9), ('H', 13)])
+    >>> p.n_deals, tracker.n_evaluations < 2 * 3 * 1_000
+    (1000, True)
+    """
+
+    def __init__(self, my_hand, n_players, dead=None, n_runs=10_000, seed=None):
+        self.hero = np.array(hand_to_ints(my_hand))
+        self.n_players = n_players
+        self.n_runs = n_runs
+        self.rng = np.random.default_rng(seed)
+        self.board = []
+        self.dead = hand_to_ints(dead or [])
+        self.deals = np.zeros((0, 5 + 2 * (n_players - 1)), dtype=np.int64)
+        self.results = np.zeros(0, dtype=np.int64)
+        self.n_evaluations = 0
+
+    def _evaluate(self, rows):
+        board = np.array(self.board, dtype=np.int64)
+        results, n_evaluations = showdown(self.hero, board, [], self.deals[rows, len(self.board):])
+        self.results[rows] = results
+        self.n_evaluations += n_evaluations
+
+    def _top_up(self):
+        n_missing = self.n_runs - len(self.deals)
+        remaining = np.setdiff1d(np.arange(n_cards), np.concatenate([self.hero, self.board, self.dead]))
+        unknown = sample_deals(remaining, 5 - len(self.board), self.n_players - 1, n_missing, rng=self.rng)
+        new_deals = np.hstack([np.broadcast_to(np.array(self.board, dtype=np.int64), (n_missing, len(self.board))),
+                               unknown])
+        self.deals = np.vstack([self.deals, new_deals])
+        self.results = np.concatenate([self.results, np.zeros(n_missing, dtype=np.int64)])
+        self._evaluate(np.arange(len(self.deals) - n_missing, len(self.deals)))
+
+    def update(self, board=None, dead=None):
+        """
+        Take into account the common cards revealed so far (the board of the previous call followed by the new
+        cards) and any new dead cards, and return the equity.
+        """
+        board = hand_to_ints(board or [])
+        assert board[:len(self.board)] == self.board, "The board can only grow"
+        changed = np.zeros(len(self.deals), dtype=bool)
+        rows = np.arange(len(self.deals))
+        for slot in range(len(self.board), len(board)):
+            card = board[slot]
+            changed |= self.deals[:, slot] != card
+            dealt = self.deals == card
+            has_card = dealt.any(axis=1)
+            column = dealt.argmax(axis=1)
+            self.deals[rows[has_card], column[has_card]] = self.deals[has_card, slot]
+            self.deals[:, slot] = card
+        self.board = board
+
+        new_dead = [card for card in hand_to_ints(dead or []) if card not in self.dead]
+        self.dead += new_dead
+        kept = ~np.isin(self.deals, new_dead).any(axis=1)
+        self.deals, self.results, changed = self.deals[kept], self.results[kept], changed[kept]
+
+        self._evaluate(np.flatnonzero(changed))
+        if len(self.deals) < self.n_runs:
+            self._top_up()
+        return self.equity()
+
+    def equity(self):
+        c = Counter(self.results.tolist())
+        p = {k: v / len(self.results) for k, v in c.items()}
+        intervals = {outcome: wilson_interval(c[outcome], len(self.results)) for outcome in (1, 0, -1)}
+        return Equity(p, method='simulate', n_deals=len(self.results), n_evaluations=self.n_evaluations,
+                      intervals=intervals)
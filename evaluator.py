@@ -0,0 +1,290 @@
+from itertools import product
+import numpy as np
+from PokerAI.cards import hand_to_ints
+
+"""
+Lookup table evaluator working on the integer cards of cards.py. Any 5, 6 or 7 cards hand is mapped to a
+single integer strength between 1 and n_strengths: the larger the strength, the better the hand and two
+hands of equal strength split the pot. The strength is the rank of the best five cards among the 7462
+distinct poker hands.
+
+Two tables are computed once at import time:
+* the flush table maps the 13 bits mask of the numbers of a suit to the best flush or straight flush
+* the rank table maps the multiset of numbers of the hand (encoded in base 5, since a number appears at most
+  4 times) to the best hand ignoring the suits
+
+The categories are ordered as in hand.is_better.
+"""
+
+categories = ['highest_cards', 'pair', 'two_pairs', 'three_of_a_kind', 'straight',
+              'flush', 'full_house', 'four_of_a_kind', 'straight_flush']
+
+
+def pack(category, numbers):
+    """
+    Pack a category and up to five numbers (from 2 to 14, most important first) into an integer, with the
+    category in the highest bits. Comparing the packed integers is comparing the hands.
+
+    >>> hex(pack(1, [14, 13, 9, 2]))
+    '0x1ed920'
+    >>> pack(6, [3, 14]) > pack(6, [2, 14])
+    True
+    """
+    key = category
+    for i in range(5):
+        key = (key << 4) | (numbers[i] if i < len(numbers) else 0)
+    return key
+
+
+def unpack(key):
+    """
+    >>> unpack(pack(1, [14, 13, 9, 2]))
+    ('pair', [14, 13, 9, 2])
+    """
+    numbers = [int(key >> shift) & 15 for shift in range(16, -1, -4)]
+    return categories[int(key) >> 20], [number for number in numbers if number]
+
+
+def _top_numbers(present, n):
+    # the n highest numbers (2 to 14) flagged in the (N, 13) boolean array present, 0 when there are fewer
+    numbers = np.where(present, np.arange(2, 15), 0)
+    return -np.sort(-numbers, axis=1)[:, :n]
+
+
+def _highest_bits(n_bits):
+    # index of the highest bit set of every integer of n_bits bits, -1 for 0
+    highest = np.full(1 << n_bits, -1, dtype=np.int64)
+    for bit in range(n_bits):
+        highest[1 << bit:] = bit
+    return highest
+
+
+_highest_bit = _highest_bits(14)
+
+
+def straight_tops(masks):
+    """
+    Return the highest number of the best straight present in each 13 bits mask of numbers (bit 0 for a 2,
+    bit 12 for an ace), or 0 if there is none. The ace counts as 1 in the smallest straight.
+
+    >>> straight_tops(np.array([0b1000000001111, 0b0000111110000, 0b1000000000111]))
+    array([ 5, 10,  0])
+    """
+    # bit i of extended stands for the number i + 1, the ace appearing both as 1 and 14
+    extended = (masks << 1) | ((masks >> 12) & 1)
+    runs = extended & (extended >> 1) & (extended >> 2) & (extended >> 3) & (extended >> 4)
+    return np.where(runs > 0, _highest_bit[runs] + 5, 0)
+
+
+def rank_counts_keys(counts):
+    """
+    Packed keys of the best hands ignoring the suits, given an (N, 13) array of how many times each number
+    (index 0 for a 2) appears in each hand.
+
+    >>> counts = np.zeros((2, 13), dtype=int)
+    >>> counts[0, [12, 2, 6, 0]] = 3, 2, 1, 1
+    >>> counts[1, [12, 0, 1, 2, 3, 10]] = 2, 1, 1, 1, 1, 1
+    >>> [unpack(key) for key in rank_counts_keys(counts)]
+    [('full_house', [14, 4]), ('straight', [5])]
+    """
+    counts = np.asarray(counts)
+    present = counts > 0
+    numbers = np.arange(2, 15)
+
+    quads = _top_numbers(counts == 4, 1)
+    trips = _top_numbers(counts == 3, 2)
+    pairs = _top_numbers(counts == 2, 3)
+    tops = straight_tops((present * (1 << np.arange(13))).sum(axis=1))
+
+    def others(excluded, n):
+        kept = present.copy()
+        for column in excluded.T:
+            kept &= numbers != column[:, None]
+        return _top_numbers(kept, n)
+
+    zeros = np.zeros((len(counts), 1), dtype=int)
+    candidates = [
+        (quads[:, 0] > 0, 7, np.hstack([quads, others(quads, 1)])),
+        ((trips[:, 0] > 0) & ((trips[:, 1] > 0) | (pairs[:, 0] > 0)), 6,
+         np.hstack([trips[:, :1], np.maximum(trips[:, 1:], pairs[:, :1])])),
+        (tops > 0, 4, tops[:, None]),
+        (trips[:, 0] > 0, 3, np.hstack([trips[:, :1], others(trips[:, :1], 2)])),
+        (pairs[:, 1] > 0, 2, np.hstack([pairs[:, :2], others(pairs[:, :2], 1)])),
+        (pairs[:, 0] > 0, 1, np.hstack([pairs[:, :1], others(pairs[:, :1], 3)])),
+        (np.ones(len(counts), dtype=bool), 0, _top_numbers(present, 5)),
+    ]
+
+    keys = np.zeros(len(counts), dtype=np.int64)
+    found = np.zeros(len(counts), dtype=bool)
+    for condition, category, kickers in candidates:
+        new = condition & ~found
+        kickers = np.hstack([kickers, zeros.repeat(5 - kickers.shape[1], axis=1)])
+        packed = np.full(len(counts), category, dtype=np.int64)
+        for column in kickers.T:
+            packed = (packed << 4) | column
+        keys[new] = packed[new]
+        found |= new
+    return keys
+
+
+def _rank_multisets(n_min=5, n_max=7):
+    # the counts of each number for all the hands of n_min to n_max cards, built one number at a time
+    counts = np.zeros((1, 0), dtype=np.int64)
+    for rank in range(13):
+        counts = np.vstack([np.hstack([counts, np.full((len(counts), 1), count)]) for count in range(5)])
+        counts = counts[counts.sum(axis=1) <= n_max]
+    return counts[counts.sum(axis=1) >= n_min]
+
+
+def _build_tables():
+    masks = np.arange(1 << 13)
+    bits = (masks[:, None] >> np.arange(13)) & 1
+    # a single suit can only make a straight (flush) or high cards (flush)
+    flush_keys = rank_counts_keys(bits)
+    flush_keys += np.where(flush_keys >> 20 == 4, 4, 5) << 20
+    flush_keys[bits.sum(axis=1) < 5] = 0
+
+    counts = _rank_multisets()
+    rank_keys = rank_counts_keys(counts)
+
+    # the best five of 6 or 7 cards being a 5 cards hand, the 5 cards hands give all the keys
+    packed_keys = np.union1d(flush_keys[bits.sum(axis=1) == 5], rank_keys[counts.sum(axis=1) == 5])
+
+    flush_table = np.where(flush_keys > 0, np.searchsorted(packed_keys, flush_keys) + 1, 0)
+    quinaries = counts @ (5 ** np.arange(13))
+    rank_table = dict(zip(quinaries.tolist(), (np.searchsorted(packed_keys, rank_keys) + 1).tolist()))
+    return packed_keys.tolist(), flush_table.tolist(), rank_table
+
+
+def _build_flush_suits(max_cards=7):
+    # the suits of the cards are counted in four 4 bits counters, a flush is a counter reaching 5
+    flush_suits = dict()
+    for suit_counts in product(range(max_cards + 1), repeat=4):
+        if sum(suit_counts) <= max_cards:
+            key = sum(count << (4 * suit) for suit, count in enumerate(suit_counts))
+            flush_suits[key] = max(range(4), key=suit_counts.__getitem__) if max(suit_counts) >= 5 else -1
+    return flush_suits
+
+
+packed_keys, _flush_table, _rank_table = _build_tables()
+_flush_suits = _build_flush_suits()
+_card_keys = [(5 ** (card >> 2)) << 16 | 1 << (4 * (card & 3)) for card in range(52)]
+_category_starts = [next(strength for strength, key in enumerate(packed_keys, start=1) if key >> 20 == category)
+                    for category in range(len(categories))]
+
+n_strengths = len(packed_keys)
+
+# the same tables as arrays, for the batch evaluation
+_card_keys_array = np.array(_card_keys, dtype=np.int64)
+_rank_quinaries = np.array(sorted(_rank_table), dtype=np.int64)
+_rank_strengths = np.array([_rank_table[quinary] for quinary in _rank_quinaries.tolist()], dtype=np.int16)
+_flush_table_array = np.array(_flush_table, dtype=np.int16)
+_flush_suits_array = np.full(1 << 16, -1, dtype=np.int8)
+_flush_suits_array[list(_flush_suits)] = list(_flush_suits.values())
+
+
+def evaluate(cards):
+    """
+    Return the strength of the best five cards among the 5 to 7 integer cards.
+
+    >>> royal_flush = [48, 44, 40, 36, 32]
+    >>> evaluate(royal_flush) == n_strengths
+    True
+    >>> evaluate([0, 5, 10, 12, 20])
+    1
+    >>> describe(evaluate([0, 5, 10, 12, 21, 1, 2]))
+    ('three_of_a_kind', [2, 7, 5])
+    """
+    key = sum([_card_keys[card] for card in cards])
+    suit = _flush_suits[key & 0xFFFF]
+    if suit < 0:
+        return _rank_table[key >> 16]
+    return _flush_table[sum([1 << (card >> 2) for card in cards if card & 3 == suit])]
+
+
+def evaluate_hand(hand):
+    """
+    Same as evaluate, for a hand of (suit, number) cards.
+
+    >>> hand = [('D', 14), ('D', 4), ('H', 14), ('D', 8), ('D', 13), ('S', 4), ('D', 2)]
+    >>> category(evaluate_hand(hand))
+    'flush'
+    """
+    return evaluate(hand_to_ints(hand))
+
+
+def evaluate_batch(cards):
+    """
+    Vectorized evaluate: cards is an integer array of shape (..., k) with 5 <= k <= 7, typically (N, 7), and
+    the strengths of each of the hands are returned in an array of shape (...,).
+    The numbers of each hand are counted in base 5 and the suits in 4 bits counters, so that a single sum of
+    precomputed per card keys gives both the rank histogram and the suit counts. Hands without a flush are then
+    looked up in the sorted rank table, hands with a flush in the flush table.
+
+    >>> cards = np.array([[48, 44, 40, 36, 32, 0, 1], [0, 5, 10, 12, 21, 1, 2]])
+    >>> evaluate_batch(cards).tolist() == [evaluate(hand) for hand in cards.tolist()]
+    True
+    >>> evaluate_batch(cards.reshape(1, 2, 7)).shape
+    (1, 2)
+    """
+    return evaluate_with_board([], cards)
+
+
+def evaluate_with_board(board, cards):
+    """
+    Strengths of the hands made of the integer cards of board, shared by all hands, and of each row of cards,
+    an integer array of shape (..., k). The key of the board is summed once, so that only the k cards of each
+    row are looked up, which is what makes evaluating many hands on the same partial board fast.
+
+    >>> board = [0, 5, 10]
+    >>> cards = np.array([[12, 21, 1, 2], [48, 44, 40, 36]])
+    >>> full_hands = np.hstack([np.tile(board, (2, 1)), cards])
+    >>> evaluate_with_board(board, cards).tolist() == evaluate_batch(full_hands).tolist()
+    True
+    """
+    cards = np.asarray(cards)
+    keys = sum([_card_keys[card] for card in board]) + _card_keys_array[cards].sum(axis=-1)
+    strengths = _rank_strengths[np.searchsorted(_rank_quinaries, keys >> 16)]
+
+    suit = _flush_suits_array[keys & 0xFFFF]
+    flush = suit >= 0
+    if flush.any():
+        board_masks = np.zeros(4, dtype=np.int64)
+        for card in board:
+            board_masks[card & 3] |= 1 << (card >> 2)
+        flush_cards, flush_suit = cards[flush], suit[flush]
+        in_suit = (flush_cards & 3) == flush_suit[..., None]
+        masks = board_masks[flush_suit] + np.where(in_suit, 1 << (flush_cards >> 2), 0).sum(axis=-1)
+        strengths[flush] = _flush_table_array[masks]
+    return strengths
+
+
+def categories_batch(strengths):
+    """
+    Vectorized category, returning the index of the category in categories.
+
+    >>> categories_batch(np.array([1, n_strengths])).tolist()
+    [0, 8]
+    """
+    return np.searchsorted(_category_starts, strengths, side='right') - 1
+
+
+def category(strength):
+    """
+    >>> category(1), category(n_strengths)
+    ('highest_cards', 'straight_flush')
+    """
+    index = 0
+    while index + 1 < len(_category_starts) and _category_starts[index + 1] <= strength:
+        index += 1
+    return categories[index]
+
+
+def describe(strength):
+    """
+    Return the category and the numbers (most important first) defining a strength.
+
+    >>> describe(evaluate_hand([('S', 3), ('S', 4), ('H', 2), ('D', 5), ('H', 8), ('S', 14), ('D', 7)]))
+    ('straight', [5])
+    """
+    return unpack(packed_keys[strength - 1])
@@ -0,0 +1,256 @@
+import time
+import numpy as np
+from PokerAI.cards import n_cards, hand_to_ints
+from PokerAI.evaluator import evaluate_batch, evaluate_with_board
+from PokerAI.ranges import combos, n_combos, to_weights, remove_cards, sample_combos
+from PokerAI.outs import outs, _evaluate_runouts, _win_rates
+from PokerAI.canonical import cached_outs
+
+"""
+Features of a decision for the strategies: for hole cards on a board of 0 to 5 cards, against an opponent
+range (every combo by default) and n_players - 1 such opponents:
+* 'hand_strength': the rate of wins now against the range (ties counting half), to the power of the number of
+  opponents, the equity before the flop
+* 'positive_potential' and 'negative_potential': see outs.py
+* 'effective_hand_strength': hand_strength * (1 - negative_potential) + (1 - hand_strength) * positive_potential
+* 'equity': the rate of wins at the river against the range, averaged over the runouts
+* 'histogram': the distribution over the runouts of the rate of wins at the river, on bins equal parts of [0, 1]
+
+On the flop and the turn every runout is evaluated against every combo (see outs.py), before the flop the boards
+are sampled. Given a latency budget deadline_ms, the number of runouts is chosen from the measured throughput of
+the evaluator to fit in it. HandFeatures keeps the features of the streets of a hand already seen, and
+batch_features scores many states at once by sampling.
+"""
+
+default_preflop_runouts = 200
+# the most random keys drawn at once by batch_features, states are processed in chunks below it
+max_batch_keys = 1 << 22
+
+_evaluations_per_ms = []
+_keys_per_ms = []
+
+
+def evaluations_per_ms():
+    """
+    The throughput of evaluator.evaluate_with_board on this machine, measured once.
+    """
+    if not _evaluations_per_ms:
+        cards = np.random.default_rng(0).random((20_000, n_cards)).argsort(axis=1)[:, :4]
+        start = time.perf_counter()
+        evaluate_with_board([0, 5, 10], cards)
+        _evaluations_per_ms.append(len(cards) / max((time.perf_counter() - start) * 1000, 1e-3))
+    return _evaluations_per_ms[0]
+
+
+def keys_per_ms():
+    """
+    The throughput of drawing and sorting random keys to deal cards, on this machine, measured once.
+    """
+    if not _keys_per_ms:
+        start = time.perf_counter()
+        np.random.default_rng(0).random((20_000, n_cards)).argsort(axis=1)
+        _keys_per_ms.append(20_000 * n_cards / max((time.perf_counter() - start) * 1000, 1e-3))
+    return _keys_per_ms[0]
+
+
+def _runouts_for(deadline_ms, n_evaluations, n_keys=0, n_fixed=0):
+    # the number of runouts of n_evaluations evaluations and n_keys sorted keys each fitting in deadline_ms, once
+    # the n_fixed evaluations done whatever the number of runouts are taken out
+    per_runout = n_evaluations / evaluations_per_ms() + n_keys / keys_per_ms()
+    return max(1, int((deadline_ms - n_fixed / evaluations_per_ms()) / per_runout))
+
+
+def _weights(opponent_range, known):
+    weights = remove_cards(np.ones(n_combos) if opponent_range is None else to_weights(opponent_range), known)
+    if weights.sum() == 0:
+        raise ValueError("The opponent range is empty once the known cards are removed")
+    return weights
+
+
+def _river_win_rates(hero, board, weights, n_runouts, rng):
+    # rates of wins of hero against the combos of the range on n_runouts random completions of the board
+    known = hero + board
+    remaining = np.setdiff1d(np.arange(n_cards), known)
+    keys = rng.random((n_runouts, len(remaining)))
+    runouts = remaining[keys.argsort(axis=1)[:, :5 - len(board)]]
+    hero_strengths = evaluate_with_board(known, runouts)
+    kept = np.flatnonzero(weights)
+    opponent_strengths, runout_weights = _evaluate_runouts(board, combos[kept], weights[kept], runouts)
+    return _win_rates(hero_strengths, opponent_strengths, runout_weights)
+
+
+def _summary(hand_strength, positive, negative, river_win_rates, n_players, bins):
+    hand_strength = hand_strength ** (n_players - 1)
+    return {
+        'hand_strength': hand_strength,
+        'positive_potential': positive,
+        'negative_potential': negative,
+        'effective_hand_strength': hand_strength * (1 - negative) + (1 - hand_strength) * positive,
+        'equity': float(np.mean(river_win_rates)),
+        'histogram': np.histogram(river_win_rates, bins=bins, range=(0, 1))[0] / len(river_win_rates),
+    }
+
+
+def hand_features(my_hand, board=None, opponent_range=None, n_players=2, bins=10, deadline_ms=None, seed=None):
+    """
+    The features of my_hand on board, see the top of the module.
+
+    >>> features = hand_features([('S', 14), ('S', 13)], [('S', 2), ('S', 7), ('H', 9)])
+    >>> round(features['hand_strength'], 3), round(features['effective_hand_strength'], 3), len(features['histogram'])
+    (0.596, 0.707, 10)
+    """
+    rng = np.random.default_rng(seed)
+    board = list(board or [])
+    hero, board_cards = hand_to_ints(my_hand), hand_to_ints(board)
+
+    if len(board) in (3, 4):
+        max_runouts = None
+        if deadline_ms is not None and len(board) == 3:
+            n_opponent_combos = int((_weights(opponent_range, hero + board_cards) > 0).sum())
+            # the combos are evaluated now and with each next card whatever the number of runouts
+            n_next_cards = n_cards - len(hero) - len(board_cards)
+            max_runouts = _runouts_for(deadline_ms, n_opponent_combos, n_fixed=(1 + n_next_cards) * n_opponent_combos)
+        # the drawn runouts depend on rng, so only the exact results go through the cache
+        if max_runouts is None:
+            result = cached_outs(my_hand, board, opponent_range=opponent_range)
+        else:
+            result = outs(my_hand, board, opponent_range=opponent_range, max_runouts=max_runouts, rng=rng)
+        return _summary(result['win_rate'], result['positive_potential'], result['negative_potential'],
+                        result['river_win_rates'], n_players, bins)
+
+    weights = _weights(opponent_range, hero + board_cards)
+    if len(board) == 5:
+        rates = _river_win_rates(hero, board_cards, weights, 1, rng)
+        return _summary(float(rates[0]), 0., 0., rates, n_players, bins)
+    if len(board) == 0:
+        n_runouts = default_preflop_runouts
+        if deadline_ms is not None:
+            n_runouts = _runouts_for(deadline_ms, int((weights > 0).sum()), n_keys=n_cards - len(hero))
+        rates = _river_win_rates(hero, board_cards, weights, n_runouts, rng)
+        equity = float(rates.mean())
+        return _summary(equity, 0., 0., rates, n_players, bins)
+    raise ValueError(f"A board has 0, 3, 4 or 5 cards, not {len(board)}")
+
+
+class HandFeatures:
+    """
+    The features of one hand along its streets: the features of a board already asked for are returned
+    without being computed again, so that all the decisions of a street share them.
+
+    >>> features = HandFeatures([('S', 14), ('H', 14)], n_players=3, seed=0)
+    >>> features.update()['hand_strength'] > 0.5, features.update() is features.update()
+    (True, True)
+    """
+
+    def __init__(self, my_hand, opponent_range=None, n_players=2, bins=10, deadline_ms=None, seed=None):
+        self.my_hand = my_hand
+        self.opponent_range = opponent_range
+        self.n_players = n_players
+        self.bins = bins
+        self.deadline_ms = deadline_ms
+        self.seed = seed
+        self.streets = dict()
+
+    def update(self, board=None, n_players=None):
+        """
+        The features on board, with n_players still in the hand (the number given at creation by default).
+        """
+        key = (tuple(board or []), n_players or self.n_players)
+        if key not in self.streets:
+            self.streets[key] = hand_features(self.my_hand, board, opponent_range=self.opponent_range,
+                                              n_players=key[1], bins=self.bins, deadline_ms=self.deadline_ms,
+                                              seed=self.seed)
+        return self.streets[key]
+
+
+def _batch_chunk(known, base_weights, n_samples, n_players, rng):
+    # the features of states sharing the number of cards of their boards, from their known integer cards (the
+    # hand then the board) as rows
+    held, board = known[:, :2], known[:, 2:]
+    n, length = known.shape[0], known.shape[1] - 2
+    features = dict()
+
+    # opponent hands drawn from the range, drawn again while they hold a known card
+    opponents = combos[sample_combos(base_weights, n * n_samples, rng)].reshape(n, n_samples, 2)
+    colliding = (opponents[:, :, :, None] == known[:, None, None, :]).any(axis=(2, 3))
+    while colliding.any():
+        opponents[colliding] = combos[sample_combos(base_weights, int(colliding.sum()), rng)]
+        colliding = (opponents[:, :, :, None] == known[:, None, None, :]).any(axis=(2, 3))
+
+    # missing common cards among the cards neither known nor held by the opponent
+    keys = rng.random((n, n_samples, n_cards))
+    keys[np.arange(n)[:, None, None], np.arange(n_samples)[None, :, None], opponents] = 2
+    keys[np.arange(n)[:, None], :, known] = 2
+    runouts = keys.argsort(axis=2)[:, :, :5 - length]
+
+    boards_now = np.broadcast_to(board[:, None], (n, n_samples, length))
+    final_boards = np.concatenate([boards_now, runouts], axis=2)
+    hero_final = evaluate_batch(np.concatenate([np.broadcast_to(held[:, None], (n, n_samples, 2)), final_boards],
+                                               axis=2))
+    opponents_final = evaluate_batch(np.concatenate([opponents, final_boards], axis=2))
+    final = 1 - np.sign(hero_final - opponents_final)
+    equity = ((final == 0) + 0.5 * (final == 1)).mean(axis=1)
+    features['equity'] = equity
+
+    if length < 3:
+        features['hand_strength'] = equity ** (n_players - 1)
+        features['effective_hand_strength'] = equity ** (n_players - 1)
+        return features
+    hero_now = evaluate_batch(np.concatenate([held, board], axis=1))
+    opponents_now = evaluate_batch(np.concatenate([opponents, boards_now], axis=2))
+    now = 1 - np.sign(hero_now[:, None] - opponents_now)
+    transitions = np.stack([np.bincount(3 * now[i] + final[i], minlength=9) for i in range(n)]).reshape(n, 3, 3)
+    totals = transitions.sum(axis=2)
+    ahead, tied, behind = 0, 1, 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        positive = ((transitions[:, behind, ahead] + transitions[:, behind, tied] / 2 +
+                     transitions[:, tied, ahead] / 2) / (totals[:, behind] + totals[:, tied] / 2))
+        negative = ((transitions[:, ahead, behind] + transitions[:, ahead, tied] / 2 +
+                     transitions[:, tied, behind] / 2) / (totals[:, ahead] + totals[:, tied] / 2))
+    positive, negative = np.nan_to_num(positive), np.nan_to_num(negative)
+    hand_strength = ((totals[:, ahead] + totals[:, tied] / 2) / n_samples) ** (n_players - 1)
+    features['hand_strength'] = hand_strength
+    features['positive_potential'] = positive
+    features['negative_potential'] = negative
+    features['effective_hand_strength'] = hand_strength * (1 - negative) + (1 - hand_strength) * positive
+    return features
+
+
+def batch_features(hands, boards, opponent_range=None, n_players=2, n_samples=1000, deadline_ms=None, seed=None):
+    """
+    The hand strength, potentials, effective hand strength and equity of many states at once, the hands and
+    boards being lists of (suit, number) cards, estimated on n_samples deals of an opponent hand from the range
+    and of the missing common cards per state. Given a latency budget deadline_ms for the whole batch, n_samples
+    is chosen from the throughput of the evaluator instead. States whose boards have the same number of cards
+    are evaluated in vectorized calls, by chunks drawing at most max_batch_keys random keys. Return a dictionary
+    of arrays, one value per state, the potentials being 0 before the flop and on the river.
+
+    >>> features = batch_features([[('S', 14), ('H', 14)], [('S', 7), ('H', 2)]], [[], []], seed=0)
+    >>> equities = features['equity']
+    >>> bool(0.8 < equities[0] < 0.9), bool(0.3 < equities[1] < 0.4)
+    (True, True)
+    """
+    rng = np.random.default_rng(seed)
+    n_states = len(hands)
+    names = ['hand_strength', 'positive_potential', 'negative_potential', 'effective_hand_strength', 'equity']
+    features = {name: np.zeros(n_states) for name in names}
+    base_weights = np.ones(n_combos) if opponent_range is None else to_weights(opponent_range)
+
+    lengths = np.array([len(board or []) for board in boards])
+    invalid = set(lengths.tolist()) - {0, 3, 4, 5}
+    if invalid:
+        raise ValueError(f"A board has 0, 3, 4 or 5 cards, not {min(invalid)}")
+    if deadline_ms is not None:
+        # per sample of a state: up to 4 evaluations, the hands of both players now and at the river, and the
+        # keys dealing the missing common cards
+        n_samples = _runouts_for(deadline_ms, 4 * max(n_states, 1), n_keys=n_cards * max(n_states, 1))
+    chunk_states = max(1, max_batch_keys // (n_samples * n_cards))
+    for length in np.unique(lengths).tolist():
+        length_states = np.flatnonzero(lengths == length)
+        for start in range(0, len(length_states), chunk_states):
+            states = length_states[start:start + chunk_states]
+            known = np.array([hand_to_ints(hands[state]) + hand_to_ints(boards[state] or []) for state in states])
+            chunk = _batch_chunk(known, base_weights, n_samples, n_players, rng)
+            for name, values in chunk.items():
+                features[name][states] = values
+    return features
@@ -0,0 +1,272 @@
+import argparse
+import numpy as np
+from PokerAI.cards import n_cards, deal_many
+from PokerAI.evaluator import evaluate_batch
+from PokerAI.equity import z_score
+
+"""
+No limit hold'em played on many tables at once. The state of all the tables lives in arrays with one row per
+table (and one column per seat): the cards, the stacks, the chips put in the pot, who folded or is all in...
+At each step, every table whose hand is not over has one seat to act, and each strategy is asked once for the
+decisions of all the tables where it is to act (see strategies.py). The hands are independent: every player
+starts each hand with the same stack, and the button moves from one batch of hands to the next, so that the
+strategies play every position as often.
+
+The actions are fold, call (checking when there is nothing to call) and bet (raising to a total bet on the
+street, clipped between the minimum raise and all in). At the end of a hand, the pots, side pots included, go to
+the best hands among the players who did not fold, as evaluated by evaluator.py.
+"""
+
+fold, call, bet = 0, 1, 2
+streets = ('preflop', 'flop', 'turn', 'river')
+board_sizes = np.array([0, 3, 4, 5])
+
+
+def next_seats(start, eligible):
+    """
+    For each row, the first eligible seat after start, going around the table.
+
+    >>> next_seats(np.array([0, 2]), np.array([[True, False, True], [True, True, False]])).tolist()
+    [2, 0]
+    """
+    n_seats = eligible.shape[1]
+    distances = (np.arange(n_seats) - start[:, None] - 1) % n_seats
+    return np.where(eligible, distances, n_seats).argmin(axis=1)
+
+
+def award_pots(contributions, strengths, folded):
+    """
+    The chips each player gets back from the pot, given the chips each put in, the strengths of their hands and
+    who folded, all arrays of shape (n_tables, n_seats). The pot is cut in layers at the contributions of the
+    players: a layer goes to the best hands among the players who did not fold and put in at least as much,
+    split equally between ties (the layers above the contributions of all the other players are thus given back).
+
+    >>> contributions = np.array([[10., 50, 50], [20, 20, 5]])
+    >>> strengths = np.array([[9, 5, 3], [1, 2, 3]])
+    >>> award_pots(contributions, strengths, np.array([[False, False, False], [False, False, True]])).tolist()
+    [[30.0, 80.0, 0.0], [0.0, 45.0, 0.0]]
+    """
+    live = ~folded
+    levels = np.sort(contributions, axis=1)
+    payouts = np.zeros(contributions.shape)
+    below = np.zeros(len(contributions))
+    for level in levels.T:
+        layer = np.minimum(contributions, level[:, None]).sum(axis=1) - below
+        below = below + layer
+        eligible = live & (contributions >= level[:, None])
+        eligible = np.where(eligible.any(axis=1, keepdims=True), eligible, live)
+        best = np.where(eligible, strengths, -1).max(axis=1, keepdims=True)
+        winners = eligible & (strengths == best)
+        payouts += winners * (layer / winners.sum(axis=1))[:, None]
+    return payouts
+
+
+class Tables:
+    """
+    Hands played at the same time on n_tables tables of n_seats seats, each seat starting every hand with
+    stack chips.
+    """
+
+    def __init__(self, n_tables, n_seats, stack=100., small_blind=0.5, big_blind=1., rng=None):
+        self.n_tables = n_tables
+        self.n_seats = n_seats
+        self.stack = stack
+        self.small_blind = small_blind
+        self.big_blind = big_blind
+        self.rng = rng or np.random.default_rng()
+
+    def deal(self, button):
+        """
+        Start a new hand on every table, the button being at the given seat: deal the cards and post the blinds.
+        """
+        n_tables, n_seats = self.n_tables, self.n_seats
+        rows = np.arange(n_tables)
+        dealt = deal_many(np.arange(n_cards), n_tables, 5 + 2 * n_seats, rng=self.rng)
+        self.board = dealt[:, :5]
+        self.hands = dealt[:, 5:].reshape(n_tables, n_seats, 2)
+        self.button = np.full(n_tables, button)
+
+        self.stacks = np.full((n_tables, n_seats), float(self.stack))
+        self.committed = np.zeros((n_tables, n_seats))
+        self.street_bets = np.zeros((n_tables, n_seats))
+        self.folded = np.zeros((n_tables, n_seats), dtype=bool)
+        self.acted = np.zeros((n_tables, n_seats), dtype=bool)
+        self.street = np.zeros(n_tables, dtype=np.int64)
+        self.done = np.zeros(n_tables, dtype=bool)
+        self.showdown = np.zeros(n_tables, dtype=bool)
+
+        everyone = np.ones((n_tables, n_seats), dtype=bool)
+        # heads up, the button posts the small blind
+        small = self.button if n_seats == 2 else next_seats(self.button, everyone)
+        big = next_seats(small, everyone)
+        self._put(rows, small, np.full(n_tables, self.small_blind))
+        self._put(rows, big, np.full(n_tables, self.big_blind))
+        self.current_bet = self.street_bets.max(axis=1)
+        self.min_raise = np.full(n_tables, float(self.big_blind))
+        self.actor = next_seats(big, everyone)
+
+    def _put(self, rows, seats, amounts):
+        amounts = np.minimum(amounts, self.stacks[rows, seats])
+        self.stacks[rows, seats] -= amounts
+        self.committed[rows, seats] += amounts
+        self.street_bets[rows, seats] += amounts
+
+    @property
+    def all_in(self):
+        return (self.stacks == 0) & ~self.folded
+
+    def observe(self, rows):
+        """
+        What the players to act on the given tables know: their cards, the common cards shown (the others are
+        -1), the street, the pot, the chips to call, their stack, the bounds of a raise and the players left.
+        """
+        seats = self.actor[rows]
+        board = np.where(np.arange(5) < board_sizes[self.street[rows]][:, None], self.board[rows], -1)
+        stacks, street_bets = self.stacks[rows, seats], self.street_bets[rows, seats]
+        return {
+            'hands': self.hands[rows, seats],
+            'board': board,
+            'street': self.street[rows],
+            'pot': self.committed[rows].sum(axis=1),
+            'to_call': np.minimum(self.current_bet[rows] - street_bets, stacks),
+            'stack': stacks,
+            'min_raise_to': self.current_bet[rows] + self.min_raise[rows],
+            'max_raise_to': street_bets + stacks,
+            'n_players': (~self.folded[rows]).sum(axis=1),
+            'seat': seats,
+            'button': self.button[rows],
+        }
+
+    def act(self, rows, actions, raise_to=None):
+        """
+        Apply the actions (fold, call or bet) of the players to act on the given tables, raise_to being the
+        total bet on the street of the bets.
+        """
+        seats = self.actor[rows]
+        actions = np.asarray(actions)
+        to_call = self.current_bet[rows] - self.street_bets[rows, seats]
+        stacks = self.stacks[rows, seats]
+        folding = (actions == fold) & (to_call > 0)
+        # a player facing only an all in short of a full raise since acting may call it but not raise
+        betting = (actions == bet) & (stacks > to_call) & ~self.acted[rows, seats]
+
+        if raise_to is None:
+            raise_to = np.zeros(len(rows))
+        bounded = np.minimum(np.maximum(raise_to, self.current_bet[rows] + self.min_raise[rows]),
+                             self.street_bets[rows, seats] + stacks)
+        amounts = np.where(betting, bounded - self.street_bets[rows, seats], np.minimum(to_call, stacks))
+        amounts = np.where(folding, 0., amounts)
+        self._put(rows, seats, amounts)
+        self.folded[rows, seats] |= folding
+        self.acted[rows, seats] = True
+
+        new_bets = self.street_bets[rows, seats]
+        raising = new_bets > self.current_bet[rows]
+        # only a full raise opens the action again to the players who already acted
+        reopening = new_bets - self.current_bet[rows] >= self.min_raise[rows]
+        raised_rows, reopened_rows = rows[raising], rows[reopening]
+        self.min_raise[raised_rows] = np.maximum(self.min_raise[raised_rows],
+                                                 new_bets[raising] - self.current_bet[raised_rows])
+        self.current_bet[raised_rows] = new_bets[raising]
+        self.acted[reopened_rows] = False
+        self.acted[reopened_rows, seats[reopening]] = True
+        self._advance(rows)
+
+    def _advance(self, rows):
+        # the next player to act on the given tables, or the next street, or the end of the hand
+        live = ~self.folded[rows]
+        can_act = live & (self.stacks[rows] > 0)
+        to_act = can_act & (~self.acted[rows] | (self.street_bets[rows] < self.current_bet[rows, None]))
+        pending = to_act.any(axis=1)
+
+        waiting = rows[pending]
+        self.actor[waiting] = next_seats(self.actor[waiting], to_act[pending])
+
+        over = (live.sum(axis=1) < 2) | ~pending & ((self.street[rows] == 3) | (can_act.sum(axis=1) < 2))
+        self.done[rows[over]] = True
+        self.showdown[rows[over & (live.sum(axis=1) > 1)]] = True
+
+        next_street = rows[~pending & ~over]
+        self.street[next_street] += 1
+        self.street_bets[next_street] = 0
+        self.current_bet[next_street] = 0
+        self.min_raise[next_street] = self.big_blind
+        self.acted[next_street] = False
+        self.actor[next_street] = next_seats(self.button[next_street], can_act[~pending & ~over])
+
+    def results(self):
+        """
+        The chips won (or lost, if negative) by every seat once all the hands are over.
+        """
+        assert self.done.all(), "Some hands are not over"
+        cards = np.concatenate([self.hands, np.broadcast_to(self.board[:, None], (self.n_tables, self.n_seats, 5))],
+                               axis=2)
+        strengths = evaluate_batch(cards)
+        return award_pots(self.committed, strengths, self.folded) - self.committed
+
+    def play(self, strategies, button=0):
+        """
+        Play one hand on every table, the seat i being played by strategies[i]. Return the chips won by every
+        seat, as an array of shape (n_tables, n_seats).
+        """
+        self.deal(button)
+        seat_strategies = np.arange(self.n_seats)
+        while not self.done.all():
+            rows = np.flatnonzero(~self.done)
+            acting = seat_strategies[self.actor[rows]]
+            for index, strategy in enumerate(strategies):
+                selected = rows[acting == index]
+                if len(selected):
+                    decisions = strategy.act(self.observe(selected))
+                    actions, raise_to = decisions if isinstance(decisions, tuple) else (decisions, None)
+                    self.act(selected, actions, raise_to)
+        return self.results()
+
+
+def play(strategies, n_hands, n_tables=10_000, stack=100., small_blind=0.5, big_blind=1., seed=None, z=z_score):
+    """
+    Play n_hands hands (rounded up to a multiple of n_tables) between the strategies, one per seat, on n_tables
+    tables at once, moving the button after each batch of hands. Return, for each strategy by name, the hands
+    played, the mean of the big blinds won per hand with its confidence interval, and the big blinds won per
+    100 hands.
+
+    >>> from PokerAI.strategies import CallingStation, HandStrength
+    >>> report = play([CallingStation(), HandStrength()], 2000, n_tables=1000, seed=0)
+    >>> sorted(report), report['HandStrength']['hands']
+    (['CallingStation', 'HandStrength'], 2000)
+    """
+    rng = np.random.default_rng(seed)
+    n_seats = len(strategies)
+    tables = Tables(n_tables, n_seats, stack=stack, small_blind=small_blind, big_blind=big_blind, rng=rng)
+    won = []
+    for batch in range(-(-n_hands // n_tables)):
+        won.append(tables.play(strategies, button=batch % n_seats) / big_blind)
+    won = np.concatenate(won)
+
+    report = dict()
+    for seat, strategy in enumerate(strategies):
+        results = won[:, seat]
+        mean, half_width = float(results.mean()), float(z * results.std() / np.sqrt(len(results)))
+        name = getattr(strategy, 'name', type(strategy).__name__)
+        if name in report or sum(getattr(other, 'name', type(other).__name__) == name for other in strategies) > 1:
+            name = f'{name} {seat}'
+        report[name] = {'hands': len(results), 'big_blinds_per_hand': mean,
+                        'interval': (mean - half_width, mean + half_width), 'big_blinds_per_100': 100 * mean}
+    return report
+
+
+if __name__ == '__main__':
+    from PokerAI import strategies as available
+    parser = argparse.ArgumentParser(description='Play strategies of strategies.py against each other')
+    parser.add_argument('strategies', nargs='+', help='names of classes of strategies.py, one per seat')
+    parser.add_argument('--hands', type=int, default=1_000_000)
+    parser.add_argument('--tables', type=int, default=10_000)
+    parser.add_argument('--stack', type=float, default=100., help='in big blinds')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    players = [getattr(available, name)() for name in args.strategies]
+    report = play(players, args.hands, n_tables=args.tables, stack=args.stack, seed=args.seed)
+    for name, result in report.items():
+        low, high = result['interval']
+        print(f"{name}: {result['big_blinds_per_100']:+.2f} bb/100 over {result['hands']:,} hands "
+              f"(95% interval {100 * low:+.2f} to {100 * high:+.2f})")
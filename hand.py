@@ -1,4 +1,5 @@
 from collections import defaultdict
+from itertools import combinations
 
 """
 In all the "detect" functions below, care is taken to return the hand from least to most important
@@ -339,6 +340,38 @@ def best_five(hand):
             return ('highest_cards', detect_highest_five(hand))
         
         
+ranking = {'highest_cards': 0, 'pair': 1, 'two_pairs': 2, 'three_of_a_kind': 3, 'straight': 4,
+           'flush': 5, 'full_house': 6, 'four_of_a_kind': 7, 'straight_flush': 8}
+
+
+def hand_key(best_hand):
+    """
+    Pack a best hand, as returned by best_five, into a single integer: the ranking of its type in the highest
+    bits, then 4 bits per number from the most to the least important card (up to 7 cards, since best_five may
+    return longer flushes and straights). Comparing the keys of two best hands is comparing the hands the way
+    is_better does, so many hands can be sorted or ranked as integers.
+
+    >>> hex(hand_key(('pair', [('C', 9), ('D', 10), ('D', 11), ('D', 14), ('H', 14)])))
+    '0x1eeba900'
+    >>> longer_flush = ('flush', [('D', 2), ('D', 4), ('D', 8), ('D', 12), ('D', 13), ('D', 14)])
+    >>> hand_key(longer_flush) > hand_key(('flush', longer_flush[1][1:]))
+    True
+    """
+    key = ranking[best_hand[0]]
+    numbers = [card[1] for card in best_hand[1]][::-1]
+    for i in range(7):
+        key = (key << 4) | (numbers[i] if i < len(numbers) else 0)
+    return key
+
+
+def best_five_key(hand):
+    """
+    >>> best_five_key([('D', 14), ('D', 10), ('H', 14), ('S', 2), ('D', 11), ('C', 9), ('S', 7)]) >> 28
+    1
+    """
+    return hand_key(best_five(hand))
+
+
 def is_better(best_hand_1, best_hand_2):
 
     """
@@ -372,39 +405,18 @@ def is_better(best_hand_1, best_hand_2):
     0
     """
 
-    ranking = {'highest_cards': 0, 'pair': 1, 'two_pairs': 2, 'three_of_a_kind': 3, 'straight': 4,
-               'flush': 5, 'full_house': 6, 'four_of_a_kind': 7, 'straight_flush': 8}
-    
-    same_hand = best_hand_1 == best_hand_2
-    if same_hand:
-        return 0
-    
-    same_type = ranking[best_hand_1[0]] == ranking[best_hand_2[0]]
-    if same_type:
-        numbers_1 = [card[1] for card in best_hand_1[1]]
-        numbers_2 = [card[1] for card in best_hand_2[1]]
+    key_1, key_2 = hand_key(best_hand_1), hand_key(best_hand_2)
+    return (key_1 > key_2) - (key_1 < key_2)
 
-        if numbers_1 == numbers_2:
-            return 0
-        else:
-            win =  numbers_1[::-1] > numbers_2[::-1]
-
-    else:
-        win = ranking[best_hand_1[0]] > ranking[best_hand_2[0]]
-
-
-    if win:
-        return 1
-    else:
-        return -1
-    
-
-    
-
-        
-   
-
-  
-        
 
+def best_five_of_fives(hand):
+    """
+    Best hand among all the 5 cards subsets of hand, compared as is_better does. Much slower than best_five, but
+    best_five and is_better are only ever applied to 5 cards, which makes it the reference when checking faster
+    evaluators. It differs from best_five on 7 cards holding two three of a kind for instance:
 
+    >>> hand = [('H', 4), ('S', 13), ('S', 4), ('S', 12), ('D', 12), ('C', 12), ('D', 4)]
+    >>> best_five(hand)[0], best_five_of_fives(hand)
+    ('three_of_a_kind', ('full_house', [('H', 4), ('S', 4), ('S', 12), ('D', 12), ('C', 12)]))
+    """
+    return max((best_five(list(five)) for five in combinations(hand, 5)), key=hand_key)
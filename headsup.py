@@ -0,0 +1,232 @@
+import argparse
+import os
+from itertools import combinations, permutations
+from multiprocessing import Pool
+import numpy as np
+from PokerAI.cards import n_cards, hand_to_ints
+from PokerAI.evaluator import evaluate_with_board
+from PokerAI.equity import Equity
+from PokerAI.preflop import class_index, class_indices, names, n_classes, outcomes
+from PokerAI.ranges import combos, n_combos, to_weights
+from PokerAI.rank_index import binomials
+
+"""
+Exact heads up all in equities before the flop: for every pair of the 169 classes of preflop.py, the numbers of
+wins, ties and losses of the first class over all the pairs of combos of the two classes not sharing a card and
+all the 1,712,304 boards of the 48 cards left for each.
+
+Rather than each pair of combos, the build goes through the boards: on a board, the 1081 combos left are
+evaluated once, and the wins of a class over another are counted by sorting the combos by strength (the pairs
+of combos sharing a card are then taken out). Boards equal up to a permutation of the suits give the same counts,
+since a permutation of the suits keeps the classes: only the 134,459 canonical boards are evaluated, each counted
+as many times as there are boards in its class. The boards are split in chunks over a pool of workers, and the
+counts are checkpointed after each chunk.
+
+The table of shape (169, 169, 3), the last axis following outcomes, holds the counts as uint32. Equity against a
+range is then a lookup and a dot product, and push_fold solves the push or fold game (see cfr.py) on it.
+"""
+
+n_boards = 1_712_304
+
+table_folder = os.path.dirname(os.path.realpath(__file__)) + '/tables/'
+matrix_path = os.path.join(table_folder, 'headsup_equity.npy')
+
+_combo_classes = class_indices(combos)
+# the ordered pairs of different combos sharing a card, with the index of their pair of classes
+_first, _second = np.nonzero((combos[:, None, :, None] == combos[None, :, None, :]).any(axis=(2, 3)) &
+                             ~np.eye(n_combos, dtype=bool))
+_sharing_classes = _combo_classes[_first] * n_classes + _combo_classes[_second]
+
+
+def canonical_boards():
+    """
+    The boards of 5 integer cards smallest in colexicographic order among their permutations of the suits, with
+    the number of boards each stands for.
+
+    >>> boards, counts = canonical_boards()
+    >>> len(boards), int(counts.sum())
+    (134459, 2598960)
+    """
+    boards = np.array(list(combinations(range(n_cards), 5)), dtype=np.int64)
+    canonical = None
+    for permutation in permutations(range(4)):
+        mapped = np.sort(4 * (boards >> 2) + np.array(permutation)[boards & 3], axis=1)
+        indices = binomials[mapped, np.arange(1, 6)].sum(axis=1)
+        canonical = indices if canonical is None else np.minimum(canonical, indices)
+    own = binomials[boards, np.arange(1, 6)].sum(axis=1)
+    counts = np.bincount(canonical, minlength=len(boards))
+    representatives = np.flatnonzero(own == canonical)
+    return boards[representatives], counts[own[representatives]]
+
+
+def board_counts(board):
+    """
+    Wins and ties of every class against every other on a board of 5 integer cards, each an array (169, 169) of
+    the numbers of ordered pairs of combos not sharing a card with each other nor with the board.
+    """
+    valid = ~np.isin(combos, board).any(axis=1)
+    classes = _combo_classes[valid]
+    strengths = np.zeros(n_combos, dtype=np.int32)
+    strengths[valid] = evaluate_with_board(list(board), combos[valid])
+    levels, inverse = np.unique(strengths[valid], return_inverse=True)
+
+    at_level = np.bincount(classes * len(levels) + inverse, minlength=n_classes * len(levels))
+    at_level = at_level.reshape(n_classes, len(levels)).astype(np.float64)
+    below = np.cumsum(at_level, axis=1) - at_level
+    wins = at_level @ below.T
+    ties = at_level @ at_level.T - np.diag(np.bincount(classes, minlength=n_classes))
+
+    # the pairs of combos sharing a card were counted above, they are counted again by outcome to be taken out
+    kept = valid[_first] & valid[_second]
+    outcome = np.sign(strengths[_first] - strengths[_second]) + 1
+    dropped = 3 * n_classes ** 2
+    sharing = np.bincount(np.where(kept, _sharing_classes * 3 + outcome, dropped), minlength=dropped + 1)
+    sharing = sharing[:dropped].reshape(n_classes, n_classes, 3)
+    wins -= sharing[..., 2]
+    ties -= sharing[..., 1]
+    return np.rint(wins).astype(np.int64), np.rint(ties).astype(np.int64)
+
+
+def _count_chunk(task):
+    index, boards, counts = task
+    wins, ties = np.zeros((n_classes, n_classes), dtype=np.int64), np.zeros((n_classes, n_classes), dtype=np.int64)
+    for board, count in zip(boards, counts.tolist()):
+        board_wins, board_ties = board_counts(board)
+        wins += count * board_wins
+        ties += count * board_ties
+    return index, wins, ties
+
+
+def _save_checkpoint(wins, ties, done, path):
+    temporary_path = path + '.tmp.npz'
+    np.savez(temporary_path, wins=wins, ties=ties, done=done)
+    os.replace(temporary_path, path)
+
+
+def build_matrix(workers=None, chunk_size=1000, path=matrix_path, checkpoint=None):
+    """
+    Count the wins, ties and losses of every class against every other over a pool of workers processes (all
+    the cores by default), chunk_size canonical boards at a time. The counts are checkpointed after each
+    chunk (beside path by default), so that an interrupted build started again with the same arguments resumes
+    where it stopped.
+    """
+    checkpoint = checkpoint or os.path.splitext(path)[0] + '.ckpt.npz'
+    boards, counts = canonical_boards()
+    n_chunks = -(-len(boards) // chunk_size)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    wins, ties = np.zeros((n_classes, n_classes), dtype=np.int64), np.zeros((n_classes, n_classes), dtype=np.int64)
+    done = np.zeros(n_chunks, dtype=bool)
+    if os.path.exists(checkpoint):
+        with np.load(checkpoint) as saved:
+            wins, ties, done = saved['wins'], saved['ties'], saved['done']
+
+    tasks = [(index, boards[index * chunk_size:(index + 1) * chunk_size],
+              counts[index * chunk_size:(index + 1) * chunk_size]) for index in range(n_chunks) if not done[index]]
+    with Pool(workers) as pool:
+        for index, chunk_wins, chunk_ties in pool.imap_unordered(_count_chunk, tasks):
+            wins += chunk_wins
+            ties += chunk_ties
+            done[index] = True
+            _save_checkpoint(wins, ties, done, checkpoint)
+
+    matrix = np.stack([wins, ties, wins.T], axis=2).astype(np.uint32)
+    temporary_path = path + '.tmp.npy'
+    np.save(temporary_path, matrix)
+    os.replace(temporary_path, path)
+    os.remove(checkpoint)
+    _matrices.pop(path, None)
+    return matrix
+
+
+_matrices = dict()
+
+
+def load_matrix(path=matrix_path):
+    """
+    The table of the counts of wins, ties and losses.
+    """
+    if path not in _matrices:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} is not built yet, run python -m PokerAI.headsup build")
+        _matrices[path] = np.load(path)
+    return _matrices[path]
+
+
+def equity_matrix(path=matrix_path):
+    """
+    Fraction of the pot won all in by each class against each other, ties counting half.
+    """
+    counts = load_matrix(path).astype(np.float64)
+    return (counts[..., 0] + counts[..., 1] / 2) / counts.sum(axis=2)
+
+
+def class_range(opponent_range):
+    """
+    Weight of each class in a range (in the notation of ranges.py, or as weights of the combos): the mean
+    weight of its combos.
+
+    >>> weights = class_range('AA, AKs')
+    >>> float(weights[names.index('AA')]), float(weights[names.index('AKo')]), float(weights.sum())
+    (1.0, 0.0, 2.0)
+    """
+    weights = to_weights(opponent_range) if isinstance(opponent_range, str) else np.asarray(opponent_range)
+    return (np.bincount(_combo_classes, weights=weights, minlength=n_classes) /
+            np.bincount(_combo_classes, minlength=n_classes))
+
+
+def all_in_equity(my_hand, opponent_range=None, path=matrix_path):
+    """
+    Probabilities of winning, drawing or losing all in before the flop with my_hand (its class, the suits of
+    my_hand being averaged over) against a range (every hand by default).
+    """
+    counts = load_matrix(path)[class_index(my_hand)].astype(np.float64)
+    weights = np.ones(n_classes) if opponent_range is None else class_range(opponent_range)
+    totals = weights @ counts
+    return Equity({outcome: float(total / totals.sum()) for outcome, total in zip(outcomes, totals) if total > 0},
+                  method='table')
+
+
+def push_fold(stacks, iterations=1000, path=matrix_path):
+    """
+    Heads up push or fold equilibrium for each stack (in big blinds, the blinds being 0.5 and 1), solved by
+    CFR+ on the exact equities. Return, by stack, the probabilities of pushing (in the small blind) and of
+    calling (in the big blind) of each class, with the exploitability left.
+    """
+    from PokerAI.cfr import CFR, push_fold_game, class_weights
+    equity, weights = equity_matrix(path), class_weights()
+    charts = dict()
+    for stack in stacks:
+        solver = CFR(push_fold_game(stack, equity, weights))
+        exploitability = solver.solve(iterations)
+        strategy = solver.average_strategy()
+        charts[stack] = {'push': strategy[0, :, 1], 'call': strategy[1, :, 1], 'exploitability': exploitability}
+    return charts
+
+
+def format_chart(probabilities):
+    """
+    The 13 x 13 grid of the classes (see preflop.py) with the probabilities as percents.
+    """
+    rows = ['     ' + ' '.join(f'{names[column * 13 + column][0]:>4}' for column in range(13))]
+    for row in range(13):
+        cells = ' '.join(f'{100 * probabilities[row * 13 + column]:4.0f}' for column in range(13))
+        rows.append(f'{names[row * 13 + row][0]:>4} {cells}')
+    return '\n'.join(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the heads up equities of the classes or print push or '
+                                                 'fold charts')
+    parser.add_argument('command', choices=['build', 'chart'])
+    parser.add_argument('--stacks', type=float, nargs='+', default=[10.], help='in big blinds')
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None, help='processes used, all the cores by default')
+    parser.add_argument('--path', default=matrix_path)
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_matrix(workers=args.workers, path=args.path)
+    else:
+        for stack, chart in push_fold(args.stacks, iterations=args.iterations, path=args.path).items():
+            print(f"{stack:g} big blinds (exploitability {chart['exploitability']:.5f} big blinds per hand)")
+            print('push\n' + format_chart(chart['push']))
+            print('call\n' + format_chart(chart['call']))
@@ -0,0 +1,187 @@
+import inspect
+import logging
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from PokerAI import hand, deck, equity, evaluator
+
+"""
+Opt-in instrumentation of the hot paths. Nothing is changed until enable is called: it then replaces the
+functions of the stages below, wherever the package imported them, with wrappers counting their calls and
+cumulated time (inclusive: the time of best_five contains the time of the detect functions it calls), and
+disable puts the original functions back. Besides the stages, it histograms the category of each best_five and
+the number of detect functions it tried before resolving (the cascade of best_five is fixed, so it only depends
+on the category), and counts the simulated deals to give simulations per second.
+"""
+
+logger = logging.getLogger(__name__)
+
+functions = {
+    'suit_to_numbers_number_to_suits': (hand, 'suit_to_numbers_number_to_suits'),
+    'detect_flush': (hand, 'detect_flush'),
+    'detect_straight': (hand, 'detect_straight'),
+    'detect_four_of_a_kind': (hand, 'detect_four_of_a_kind'),
+    'detect_full_house': (hand, 'detect_full_house'),
+    'detect_three_of_a_kind': (hand, 'detect_three_of_a_kind'),
+    'detect_two_pairs': (hand, 'detect_two_pairs'),
+    'detect_pair': (hand, 'detect_pair'),
+    'detect_highest_five': (hand, 'detect_highest_five'),
+    'best_five': (hand, 'best_five'),
+    'is_better': (hand, 'is_better'),
+    'evaluate': (evaluator, 'evaluate'),
+    'evaluate_batch': (evaluator, 'evaluate_batch'),
+    'sample_deals': (equity, 'sample_deals'),
+    'enumerate_deals': (equity, 'enumerate_deals'),
+    'showdown': (equity, 'showdown'),
+}
+methods = {
+    'Deck.deal': (deck.Deck, 'deal'),
+    'Deck.deal_many': (deck.Deck, 'deal_many'),
+    'ShuffledDeck.__init__': (deck.ShuffledDeck, '__init__'),
+    'Round.simulate_blindly': (deck.Round, 'simulate_blindly'),
+    'Round.simulate_strengths': (deck.Round, 'simulate_strengths'),
+}
+
+# number of detect functions best_five calls before returning each category
+detectors_tried = {'straight_flush': 2, 'flush': 2, 'four_of_a_kind': 2, 'full_house': 3, 'straight': 4,
+                   'three_of_a_kind': 5, 'two_pairs': 6, 'pair': 7, 'highest_cards': 8}
+
+
+class Stats:
+    def __init__(self, log_interval=None):
+        self.start = time.perf_counter()
+        self.calls = Counter()
+        self.times = Counter()
+        self.categories = Counter()
+        self.detectors = Counter()
+        self.simulations = 0
+        self.stop = None
+        self.log_interval = log_interval
+        self.last_log = self.start
+
+
+# showdown may be called with keyword arguments: its deals are found by binding them
+showdown_signature = inspect.signature(equity.showdown)
+
+_stats = None
+_enabled = False
+_originals = dict()
+
+
+def _record(name, elapsed, result, args, kwargs):
+    _stats.calls[name] += 1
+    _stats.times[name] += elapsed
+    if name == 'best_five':
+        _stats.categories[result[0]] += 1
+        _stats.detectors[detectors_tried[result[0]]] += 1
+    elif name == 'showdown':
+        _stats.simulations += len(showdown_signature.bind(*args, **kwargs).arguments['deals'])
+    elif name in ('Round.simulate_blindly', 'Round.simulate_strengths'):
+        _stats.simulations += 1
+    if _stats.log_interval is not None and time.perf_counter() - _stats.last_log >= _stats.log_interval:
+        _stats.last_log = time.perf_counter()
+        logger.info(log_line())
+
+
+def _wrap(name, function):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        _record(name, time.perf_counter() - start, result, args, kwargs)
+        return result
+    return wrapper
+
+
+def enabled():
+    return _enabled
+
+
+def enable(log_interval=None):
+    """
+    Start recording, from scratch. Given log_interval, a summary line is logged (see log_line) at most every
+    log_interval seconds.
+    """
+    global _stats, _enabled
+    if _enabled:
+        disable()
+    _stats, _enabled = Stats(log_interval), True
+    for name, (owner, attribute) in functions.items():
+        original = getattr(owner, attribute)
+        wrapper = _wrap(name, original)
+        # the package modules importing the function by name hold their own reference to it
+        for module_name, module in list(sys.modules.items()):
+            if module_name.startswith('PokerAI') and module is not None:
+                for key, value in list(vars(module).items()):
+                    if value is original:
+                        _originals[module, key] = original
+                        setattr(module, key, wrapper)
+    for name, (owner, attribute) in methods.items():
+        original = vars(owner)[attribute]
+        _originals[owner, attribute] = original
+        setattr(owner, attribute, _wrap(name, original))
+
+
+def disable():
+    """
+    Stop recording and put the original functions back. The last snapshot stays available.
+    """
+    global _enabled
+    for (owner, attribute), original in _originals.items():
+        setattr(owner, attribute, original)
+    _originals.clear()
+    if _enabled:
+        _stats.stop = time.perf_counter()
+    _enabled = False
+
+
+def snapshot():
+    """
+    The statistics recorded so far as a dictionary: the elapsed seconds, the calls and cumulated seconds of each
+    stage, the histograms of the best_five categories and of the number of detect functions tried, and the
+    simulated deals with their rate.
+    """
+    stats = _stats
+    if stats is None:
+        return None
+    elapsed = (stats.stop or time.perf_counter()) - stats.start
+    return {
+        'elapsed': elapsed,
+        'stages': {name: {'calls': stats.calls[name], 'time': stats.times[name]} for name in stats.calls},
+        'categories': dict(stats.categories),
+        'detectors_tried': dict(sorted(stats.detectors.items())),
+        'simulations': stats.simulations,
+        'simulations_per_second': stats.simulations / elapsed if elapsed > 0 else 0.,
+    }
+
+
+def log_line():
+    """
+    A one line summary of the snapshot: the rate of simulations and the stages taking the most time.
+    """
+    report = snapshot()
+    stages = sorted(report['stages'].items(), key=lambda item: -item[1]['time'])[:5]
+    return (f"{report['simulations_per_second']:,.0f} simulations/s, " +
+            ', '.join(f"{name} {stage['calls']:,} calls {stage['time']:.3f}s" for name, stage in stages))
+
+
+@contextmanager
+def instrumented(log_interval=None):
+    """
+    Record within a with block.
+
+    >>> with instrumented():
+    ...     result = hand.best_five([('D', 14), ('D', 10), ('H', 14), ('S', 2), ('D', 11), ('C', 9), ('S', 7)])
+    >>> report = snapshot()
+    >>> report['stages']['best_five']['calls'], report['categories'], report['detectors_tried']
+    (1, {'pair': 1}, {7: 1})
+    >>> hasattr(hand.best_five, '__wrapped__'), enabled()
+    (False, False)
+    """
+    enable(log_interval)
+    try:
+        yield
+    finally:
+        disable()
@@ -0,0 +1,124 @@
+from itertools import combinations
+import numpy as np
+from PokerAI.cards import hand_to_ints, ints_to_hand
+from PokerAI.evaluator import evaluate_with_board, categories, categories_batch
+from PokerAI.equity import remaining_cards
+from PokerAI.ranges import combos, n_combos, to_weights, remove_cards
+
+"""
+Outs and hand potential on the flop or the turn. Every next card, and on the flop every runout of turn and
+river, is evaluated at once for hero and for each combo of the opponent range (every combo by default), on top
+of the board which is only summed once (see evaluator.evaluate_with_board). Hero being ahead means winning
+against more than half of the weight of the range, a tie counting as half a win.
+
+The potentials are those of Billings et al.: positive potential is the probability of ending ahead at the river
+when behind now, negative potential the probability of ending behind when ahead now.
+"""
+
+
+def _win_rates(hero_strengths, opponent_strengths, weights):
+    # weighted rate of wins (ties counting half) of hero against the combos, over the last axis
+    score = (hero_strengths[..., None] > opponent_strengths) + 0.5 * (hero_strengths[..., None] == opponent_strengths)
+    return (score * weights).sum(axis=-1) / weights.sum(axis=-1)
+
+
+def _compare(hero_strengths, opponent_strengths):
+    # 0 when hero is ahead, 1 when tied and 2 when behind
+    return 1 - np.sign(hero_strengths[..., None] - opponent_strengths)
+
+
+def hand_potential(hero_now, opponents_now, hero_final, opponents_final, weights):
+    """
+    Positive and negative potentials from the strengths now (hero a scalar, opponents an array of the combos)
+    and at the river (hero an array of the runouts, opponents an array runouts x combos), with the weights of
+    the combos for each runout (0 for the combos holding a card of the runout).
+    """
+    now = _compare(np.asarray(hero_now), opponents_now)
+    final = _compare(hero_final, opponents_final)
+    transitions = np.bincount((3 * now + final).ravel(), weights=np.broadcast_to(weights, final.shape).ravel(),
+                              minlength=9).reshape(3, 3)
+    totals = transitions.sum(axis=1)
+    ahead, tied, behind = 0, 1, 2
+
+    behind_mass = totals[behind] + totals[tied] / 2
+    ahead_mass = totals[ahead] + totals[tied] / 2
+    positive = ((transitions[behind, ahead] + transitions[behind, tied] / 2 + transitions[tied, ahead] / 2)
+                / behind_mass if behind_mass else 0.)
+    negative = ((transitions[ahead, behind] + transitions[ahead, tied] / 2 + transitions[tied, behind] / 2)
+                / ahead_mass if ahead_mass else 0.)
+    return float(positive), float(negative)
+
+
+def _evaluate_runouts(board, opponent_combos, weights, runouts):
+    # strengths of the combos with each runout (an array runouts x cards) and their weights, the combos holding a
+    # card of the runout being left out with a weight of 0
+    valid = ~(opponent_combos[None, :, :, None] == runouts[:, None, None, :]).any(axis=(2, 3))
+    rows, columns = np.nonzero(valid)
+    strengths = np.zeros(valid.shape, dtype=np.int16)
+    strengths[rows, columns] = evaluate_with_board(board, np.hstack([opponent_combos[columns], runouts[rows]]))
+    return strengths, weights * valid
+
+
+def outs(my_hand, board, opponent_range=None, dead=None, max_runouts=None, rng=None):
+    """
+    Analyse the next cards for my_hand on a board of 3 or 4 cards, against an opponent range (in the notation
+    of ranges.py, as weights or as a single hand; every combo by default). Return a dictionary with:
+    * 'cards': the possible next cards
+    * 'categories': the category of the best hand of hero with each of them
+    * 'win_rates': the rate of wins of hero against the range with each of them, and 'win_rate' now
+    * 'outs': the next cards putting hero ahead while behind now, and 'improving': those improving the category
+    * 'positive_potential' and 'negative_potential' of the hand up to the river
+    * 'river_win_rates': the rate of wins of hero at the river for each runout
+    On the flop, at most max_runouts of the 1081 runouts are drawn at random (with rng, a numpy.random.Generator)
+    to bound the time taken.
+
+    >>> result = outs([('S', 14), ('S', 13)], [('S', 2), ('S', 7), ('H', 9)], opponent_range='99, 77, 22')
+    >>> len(result['cards']), len(result['outs']), result['categories'][result['cards'].index(('S', 5))]
+    (47, 8, 'flush')
+    """
+    assert len(board) in (3, 4), "Outs are computed on the flop or the turn"
+    hero, board_cards = hand_to_ints(my_hand), hand_to_ints(board)
+    known = hero + board_cards + hand_to_ints(dead or [])
+    remaining = remaining_cards(my_hand, board, dead)
+
+    weights = remove_cards(np.ones(n_combos) if opponent_range is None else to_weights(opponent_range), known)
+    if weights.sum() == 0:
+        raise ValueError("The opponent range is empty once the known cards are removed")
+    kept = np.flatnonzero(weights)
+    opponent_combos, weights = combos[kept], weights[kept]
+
+    hero_now = int(evaluate_with_board(board_cards, np.array(hero)))
+    opponents_now = evaluate_with_board(board_cards, opponent_combos)
+    win_rate = float(_win_rates(np.asarray(hero_now), opponents_now, weights))
+
+    # every next card, with the weights of the combos not holding it
+    next_cards = remaining[:, None]
+    hero_next = evaluate_with_board(board_cards + hero, next_cards)
+    opponents_next, next_weights = _evaluate_runouts(board_cards, opponent_combos, weights, next_cards)
+    win_rates = _win_rates(hero_next, opponents_next, next_weights)
+
+    if len(board) == 4:
+        hero_final, opponents_final, final_weights = hero_next, opponents_next, next_weights
+    else:
+        runouts = np.array(list(combinations(remaining, 2)), dtype=np.int64)
+        if max_runouts is not None and max_runouts < len(runouts):
+            rng = rng or np.random.default_rng()
+            runouts = runouts[rng.choice(len(runouts), max_runouts, replace=False)]
+        hero_final = evaluate_with_board(board_cards + hero, runouts)
+        opponents_final, final_weights = _evaluate_runouts(board_cards, opponent_combos, weights, runouts)
+    positive, negative = hand_potential(hero_now, opponents_now, hero_final, opponents_final, final_weights)
+
+    cards = ints_to_hand(remaining)
+    now_category = categories_batch(np.array([hero_now]))[0]
+    next_categories = categories_batch(hero_next)
+    return {
+        'cards': cards,
+        'categories': [categories[index] for index in next_categories],
+        'win_rates': win_rates,
+        'win_rate': win_rate,
+        'outs': [card for card, rate in zip(cards, win_rates.tolist()) if rate > 0.5 >= win_rate],
+        'improving': [card for card, index in zip(cards, next_categories.tolist()) if index > now_category],
+        'positive_potential': positive,
+        'negative_potential': negative,
+        'river_win_rates': _win_rates(hero_final, opponents_final, final_weights),
+    }
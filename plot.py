@@ -1,16 +1,21 @@
-from PokerAI.deck import suits, faces_values
+from PokerAI.cards import suits, faces_values, n_cards, card_to_int
 
 import os
 from itertools import product
-import matplotlib.image as mpimg
-import matplotlib.pyplot as plt
-
+import numpy as np
 
+"""
+The card pictures are only read when a card is first drawn. The 52 pictures are then decoded once and saved as
+a single sprite sheet, an array of shape (52, height, width, 4) of uint8 indexed by the integer cards of cards.py,
+which later runs memory map instead of decoding the pictures again. matplotlib is imported when plotting only.
+"""
 
 pic_folder = os.path.dirname(os.path.realpath(__file__)) + '/card_pics/'
+sprites_path = os.path.dirname(os.path.realpath(__file__)) + '/tables/card_sprites.npy'
 
 
 def make_image_dict(pic_folder=pic_folder):
+    import matplotlib.image as mpimg
     image_dict = dict()
     for card in product(suits, faces_values):
         card_filename = f'({card[0]}, {card[1]})'
@@ -19,16 +24,109 @@ def make_image_dict(pic_folder=pic_folder):
     return image_dict
 
 
+def build_sprites(pic_folder=pic_folder, path=sprites_path):
+    """
+    Decode the 52 pictures into one uint8 array and save it to path.
+    """
+    sprites = None
+    for card, image in make_image_dict(pic_folder).items():
+        if sprites is None:
+            sprites = np.zeros((n_cards,) + image.shape, dtype=np.uint8)
+        sprites[card_to_int(card)] = np.round(image * 255) if image.dtype.kind == 'f' else image
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = path + '.tmp.npy'
+    np.save(temporary_path, sprites)
+    os.replace(temporary_path, path)
+    return sprites
+
+
+_sprites = dict()
+
+
+def load_sprites(path=sprites_path):
+    """
+    The memory mapped sprite sheet, built on first use.
+    """
+    if path not in _sprites:
+        if not os.path.exists(path):
+            build_sprites(path=path)
+        _sprites[path] = np.load(path, mmap_mode='r')
+    return _sprites[path]
+
+
+def card_image(card):
+    """
+    The picture of a (suit, number) card, the number 1 being read as an ace.
+    """
+    suit, number = card
+    return load_sprites()[card_to_int((suit, 14 if number == 1 else number))]
+
+
+def __getattr__(name):
+    # image_dict used to be built at import time, it is now read from the sprite sheet when asked for
+    if name == 'image_dict':
+        return {card: card_image(card) for card in product(suits, faces_values)}
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def plot_image(image):
+    import matplotlib.pyplot as plt
     plt.imshow(image.astype('uint8'))
 
-    
-image_dict = make_image_dict()
 
 def plot_hand(hand):
+    import matplotlib.pyplot as plt
     n_cards = len(hand)
     _, axs = plt.subplots(1, n_cards)
-    for ax, card in zip(axs, hand):
-        ax.imshow(image_dict[card])
+    for ax, card in zip(np.atleast_1d(axs), hand):
+        ax.imshow(card_image(card))
         ax.axis('off')
-    
+
+
+def hands_grid(hands, columns=None, step=8, gap=2):
+    """
+    One image of the hands laid out on a grid of columns hands per row (about square by default), each hand
+    being its cards side by side. The pictures are subsampled by step in both directions and gap pixels are
+    left between the hands.
+
+    >>> grid = hands_grid([[('S', 14), ('H', 14)], [('D', 2), ('C', 7), ('S', 9)]], columns=2, step=10)
+    >>> grid.shape, grid.dtype
+    ((73, 302, 4), dtype('uint8'))
+    """
+    sprites = load_sprites()[:, ::step, ::step]
+    height, width = sprites.shape[1:3]
+    n_hands = len(hands)
+    columns = columns or max(1, int(np.ceil(np.sqrt(n_hands))))
+    rows = -(-n_hands // columns)
+    hand_width = max(len(hand) for hand in hands) * width
+
+    grid = np.zeros((rows * (height + gap) - gap, columns * (hand_width + gap) - gap, 4), dtype=np.uint8)
+    for index, hand in enumerate(hands):
+        top = index // columns * (height + gap)
+        left = index % columns * (hand_width + gap)
+        cards = [card_to_int((suit, 14 if number == 1 else number)) for suit, number in hand]
+        grid[top:top + height, left:left + len(cards) * width] = np.hstack(sprites[cards])
+    return grid
+
+
+def plot_hands(hands, titles=None, columns=None, step=8, path=None):
+    """
+    Draw many hands at once, as a single image (see hands_grid) shown at one pixel per pixel, with an optional
+    title in the corner of each hand. The figure is saved to path if given, and returned.
+    """
+    import matplotlib.pyplot as plt
+    grid = hands_grid(hands, columns=columns, step=step)
+    columns = columns or max(1, int(np.ceil(np.sqrt(len(hands)))))
+    rows = -(-len(hands) // columns)
+    height, width = (grid.shape[0] + 2) / rows, (grid.shape[1] + 2) / columns
+
+    figure = plt.figure(figsize=(grid.shape[1] / 100, grid.shape[0] / 100), dpi=100)
+    ax = figure.add_axes([0, 0, 1, 1])
+    ax.imshow(grid, interpolation='none')
+    ax.axis('off')
+    for index, title in enumerate(titles or []):
+        ax.text(index % columns * width, index // columns * height, title, ha='left', va='top', fontsize=7,
+                bbox=dict(facecolor='white', edgecolor='none', pad=1))
+    if path is not None:
+        figure.savefig(path)
+    return figure
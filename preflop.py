@@ -0,0 +1,153 @@
+import argparse
+import os
+from multiprocessing import Pool
+import numpy as np
+from PokerAI.cards import faces
+from PokerAI.equity import equity, Equity
+
+"""
+Before the flop, the probabilities of winning only depend on the class of the two cards in hand: their
+numbers and whether they are suited. There are 169 such classes, laid out on a 13 x 13 grid with the aces
+first: pairs on the diagonal, suited hands above it (row of the highest card) and offsuit hands below it
+(row of the lowest card). The class of index row * 13 + column is thus 'AKs' for (0, 1) and 'AKo' for (1, 0).
+
+The table of the win/draw/loss probabilities of every class against 1 to 9 random opponents is built once
+(see build_table and the command line at the bottom) and saved as a .npy file which is memory mapped when
+looking it up.
+"""
+
+n_classes = 169
+max_opponents = 9
+outcomes = (1, 0, -1)
+
+table_folder = os.path.dirname(os.path.realpath(__file__)) + '/tables/'
+table_path = os.path.join(table_folder, 'preflop_equity.npy')
+
+_faces = [face.replace('10', 'T') for face in faces[::-1]]
+names = [_faces[min(row, column)] + _faces[max(row, column)] + ('' if row == column else 's' if row < column else 'o')
+         for row in range(13) for column in range(13)]
+
+
+def class_index(my_hand):
+    """
+    >>> names[class_index([('S', 14), ('S', 13)])], names[class_index([('H', 13), ('S', 14)])]
+    ('AKs', 'AKo')
+    >>> names[class_index([('H', 10), ('C', 10)])], names[class_index([('D', 2), ('D', 7)])]
+    ('TT', '72s')
+    """
+    (suit_1, number_1), (suit_2, number_2) = my_hand
+    high, low = 14 - max(number_1, number_2), 14 - min(number_1, number_2)
+    if suit_1 == suit_2:
+        return high * 13 + low
+    return low * 13 + high
+
+
+def class_indices(cards):
+    """
+    Vectorized class_index, for integer cards given as an array of shape (..., 2).
+
+    >>> [names[index] for index in class_indices(np.array([[48, 44], [45, 48], [34, 33]]))]
+    ['AKs', 'AKo', 'TT']
+    """
+    cards = np.asarray(cards)
+    numbers = cards >> 2
+    high, low = 12 - numbers.max(axis=-1), 12 - numbers.min(axis=-1)
+    suited = (cards[..., 0] & 3) == (cards[..., 1] & 3)
+    return np.where(suited, high * 13 + low, low * 13 + high)
+
+
+def class_hand(index):
+    """
+    A hand of the class of the given index.
+
+    >>> class_hand(1), class_hand(13), class_hand(0)
+    ([('S', 14), ('S', 13)], [('S', 13), ('H', 14)], [('S', 14), ('H', 14)])
+    """
+    row, column = divmod(index, 13)
+    suit = 'S' if row < column else 'H'
+    return [('S', 14 - row), (suit, 14 - column)]
+
+
+def _simulate_class(task):
+    # win/draw/loss of a class against n_opponents, in chunks to bound the memory used by the deals
+    index, n_opponents, n_runs, seed, chunk_size = task
+    rng = np.random.default_rng([seed, index, n_opponents])
+    counts = np.zeros(len(outcomes))
+    for start in range(0, n_runs, chunk_size):
+        n_chunk = min(chunk_size, n_runs - start)
+        p = equity(class_hand(index), n_opponents + 1, n_runs=n_chunk, rng=rng)
+        counts += [p[outcome] * n_chunk for outcome in outcomes]
+    return index, n_opponents, counts / n_runs
+
+
+def _save_checkpoint(probas, done, path):
+    temporary_path = path + '.tmp.npz'
+    np.savez(temporary_path, probas=probas, done=done)
+    os.replace(temporary_path, path)
+
+
+def build_table(n_runs=1_000_000, workers=None, seed=0, chunk_size=100_000, path=table_path, checkpoint=None):
+    """
+    Simulate n_runs rounds for every class and number of opponents, over a pool of workers processes (all the
+    cores by default). The results are checkpointed after each class and number of opponents (beside path by
+    default), so that an interrupted build started again with the same arguments resumes where it stopped.
+    The table has shape (n_classes, max_opponents, 3), the last axis following outcomes.
+    """
+    checkpoint = checkpoint or os.path.splitext(path)[0] + '.ckpt.npz'
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    probas = np.zeros((n_classes, max_opponents, len(outcomes)))
+    done = np.zeros((n_classes, max_opponents), dtype=bool)
+    if os.path.exists(checkpoint):
+        with np.load(checkpoint) as saved:
+            probas, done = saved['probas'], saved['done']
+
+    tasks = [(index, n_opponents, n_runs, seed, chunk_size)
+             for index in range(n_classes) for n_opponents in range(1, max_opponents + 1)
+             if not done[index, n_opponents - 1]]
+    with Pool(workers) as pool:
+        for index, n_opponents, p in pool.imap_unordered(_simulate_class, tasks):
+            probas[index, n_opponents - 1] = p
+            done[index, n_opponents - 1] = True
+            _save_checkpoint(probas, done, checkpoint)
+
+    with open(path, 'wb') as outfile:
+        np.save(outfile, probas.astype(np.float32))
+    os.remove(checkpoint)
+    _tables.pop(path, None)
+    return probas
+
+
+_tables = dict()
+
+
+def load_table(path=table_path):
+    """
+    The memory mapped table, or None if it was not built (yet: a table built later is then loaded).
+    """
+    if path not in _tables:
+        if not os.path.exists(path):
+            return None
+        _tables[path] = np.load(path, mmap_mode='r')
+    return _tables[path]
+
+
+def lookup(my_hand, n_players, path=table_path):
+    """
+    Probabilities of winning, drawing or losing before the flop, read from the table. Return None if the
+    table was not built or does not cover that number of players.
+    """
+    table = load_table(path)
+    if table is None or not 1 <= n_players - 1 <= table.shape[1]:
+        return None
+    p = table[class_index(my_hand), n_players - 2]
+    return Equity({outcome: float(proba) for outcome, proba in zip(outcomes, p) if proba > 0}, method='table')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the table of the preflop probabilities of winning')
+    parser.add_argument('--runs', type=int, default=1_000_000, help='simulations per class and number of players')
+    parser.add_argument('--workers', type=int, default=None, help='processes used, all the cores by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--path', default=table_path)
+    args = parser.parse_args()
+    build_table(n_runs=args.runs, workers=args.workers, seed=args.seed, path=args.path)
@@ -0,0 +1,214 @@
+from collections import Counter
+from itertools import combinations
+import re
+import numpy as np
+from PokerAI.cards import n_cards, hand_to_ints
+from PokerAI.evaluator import evaluate_batch
+from PokerAI.equity import Equity, chunk_size, my_hands_win, wilson_interval
+
+"""
+Ranges of hands, that is weights over the 1326 possible pairs of cards (the combos). A range is written in the
+usual notation, a comma separated list of:
+* pairs 'QQ', classes 'AKs' (suited), 'AKo' (offsuit) or 'AK' (both)
+* 'QQ+' for QQ and the higher pairs, 'ATs+' for ATs, AJs, AQs and AKs
+* '22-55' for the pairs from 22 to 55, 'AJo-ATo' for the classes from ATo to AJo
+* specific combos such as 'AsKs'
+each optionally followed by ':weight' (1 by default), later entries overriding the earlier ones:
+
+>>> weights = parse_range('QQ+, AKs, AJo-ATo, KQs:0.5')
+>>> int((weights > 0).sum()), float(weights.sum())
+(50, 48.0)
+"""
+
+combos = np.array(list(combinations(range(n_cards), 2)), dtype=np.int64)
+n_combos = len(combos)
+combo_index = np.full((n_cards, n_cards), -1, dtype=np.int64)
+combo_index[combos[:, 0], combos[:, 1]] = np.arange(n_combos)
+combo_index[combos[:, 1], combos[:, 0]] = np.arange(n_combos)
+
+_numbers = {face: number for number, face in enumerate('23456789TJQKA', start=2)}
+_class = re.compile(r'^([2-9TJQKA])([2-9TJQKA])([so]?)$')
+_specific = re.compile(r'^([2-9TJQKA])([shdc])([2-9TJQKA])([shdc])$')
+
+# numbers and suits of the cards of every combo
+_combo_numbers = (combos >> 2) + 2
+_combo_suited = (combos[:, 0] & 3) == (combos[:, 1] & 3)
+
+
+def _parse_class(text):
+    match = _class.match(text)
+    if match is None:
+        raise ValueError(f"Can't parse the hand class {text}")
+    high, low = sorted([_numbers[match.group(1)], _numbers[match.group(2)]], reverse=True)
+    if high == low and match.group(3):
+        raise ValueError(f"A pair can't be suited or offsuit: {text}")
+    return high, low, match.group(3)
+
+
+def class_combos(high, low, suitedness=''):
+    """
+    Indices of the combos of a class, suitedness being 's', 'o' or '' for both.
+
+    >>> len(class_combos(14, 14)), len(class_combos(14, 13, 's')), len(class_combos(14, 13, 'o'))
+    (6, 4, 12)
+    """
+    selected = (_combo_numbers.max(axis=1) == high) & (_combo_numbers.min(axis=1) == low)
+    if suitedness == 's':
+        selected &= _combo_suited
+    elif suitedness == 'o':
+        selected &= ~_combo_suited
+    return np.flatnonzero(selected)
+
+
+def _combo_of(cards):
+    # the index of the combo of two different (suit, number) cards
+    ints = hand_to_ints(cards)
+    if len(ints) != 2 or combo_index[ints[0], ints[1]] < 0:
+        raise ValueError(f"A combo should have two different cards: {cards}")
+    return combo_index[ints[0], ints[1]]
+
+
+def _expand(token):
+    # the classes (high, low, suitedness) or combo indices described by a token
+    specific = _specific.match(token)
+    if specific:
+        cards = [(specific.group(2).upper(), _numbers[specific.group(1)]),
+                 (specific.group(4).upper(), _numbers[specific.group(3)])]
+        return [_combo_of(cards)]
+
+    if token.endswith('+'):
+        high, low, suitedness = _parse_class(token[:-1])
+        if high == low:
+            return np.concatenate([class_combos(number, number) for number in range(low, 15)])
+        return np.concatenate([class_combos(high, kicker, suitedness) for kicker in range(low, high)])
+
+    if '-' in token:
+        (high_1, low_1, suitedness_1), (high_2, low_2, suitedness_2) = map(_parse_class, token.split('-'))
+        if high_1 == low_1 and high_2 == low_2:
+            lowest, highest = sorted([high_1, high_2])
+            return np.concatenate([class_combos(number, number) for number in range(lowest, highest + 1)])
+        if high_1 != high_2 or suitedness_1 != suitedness_2:
+            raise ValueError(f"Can't parse the range {token}: both ends should share their highest card and suits")
+        lowest, highest = sorted([low_1, low_2])
+        return np.concatenate([class_combos(high_1, kicker, suitedness_1) for kicker in range(lowest, highest + 1)])
+
+    return class_combos(*_parse_class(token))
+
+
+def parse_range(text):
+    """
+    The weights of the 1326 combos described by a range in the usual notation (see the top of the module).
+
+    >>> weights = parse_range('22-44, A2s+, AsKs:0.25')
+    >>> int((weights == 1).sum()), float(weights[combo_index[51, 47]]), float(weights[combo_index[48, 44]])
+    (65, 1.0, 0.25)
+    """
+    weights = np.zeros(n_combos)
+    for token in text.replace(' ', '').split(','):
+        if not token:
+            continue
+        weight = 1.
+        if ':' in token:
+            token, weight = token.split(':')
+            weight = float(weight)
+        weights[_expand(token)] = weight
+    return weights
+
+
+def to_weights(hand_or_range):
+    """
+    The weights of the combos for a range given in the usual notation, as weights, or as a single hand of
+    (suit, number) cards.
+
+    >>> to_weights([('S', 14), ('S', 13)]).nonzero()[0].tolist() == [combo_index[48, 44]]
+    True
+    >>> to_weights('AsAs')
+    Traceback (most recent call last):
+    ...
+    ValueError: A combo should have two different cards: [('S', 14), ('S', 14)]
+    """
+    if isinstance(hand_or_range, str):
+        return parse_range(hand_or_range)
+    if isinstance(hand_or_range, np.ndarray):
+        assert hand_or_range.shape == (n_combos,), "Weights should be given for each of the 1326 combos"
+        return hand_or_range.astype(float)
+    weights = np.zeros(n_combos)
+    weights[_combo_of(hand_or_range)] = 1.
+    return weights
+
+
+def remove_cards(weights, cards):
+    """
+    The weights with the combos holding any of the integer cards set to 0.
+
+    >>> int((remove_cards(np.ones(n_combos), [0, 1, 2]) > 0).sum())
+    1176
+    """
+    weights = weights.copy()
+    weights[np.isin(combos, cards).any(axis=1)] = 0
+    return weights
+
+
+def sample_combos(weights, n, rng):
+    """
+    n combo indices drawn with probabilities proportional to the weights.
+    """
+    cumulated = np.cumsum(weights)
+    return np.searchsorted(cumulated, rng.random(n) * cumulated[-1], side='right')
+
+
+def sample_hands(weights_list, n_runs, rng, max_rounds=1000):
+    """
+    For each of n_runs runs, one hand per range of weights_list such that no card is held twice: the combos of
+    all players are drawn independently from their ranges and the runs where hands collide are drawn again, which
+    gives each run the probability proportional to the product of the weights of its hands (card removal).
+    Return an (n_runs, n_players, 2) array of integer cards.
+    """
+    hands = np.zeros((n_runs, len(weights_list), 2), dtype=np.int64)
+    todo = np.arange(n_runs)
+    for _ in range(max_rounds):
+        for player, weights in enumerate(weights_list):
+            hands[todo, player] = combos[sample_combos(weights, len(todo), rng)]
+        held = np.sort(hands[todo].reshape(len(todo), -1), axis=1)
+        todo = todo[(held[:, 1:] == held[:, :-1]).any(axis=1)]
+        if len(todo) == 0:
+            return hands
+    raise ValueError("The ranges can hardly be dealt together, they mostly hold the same cards")
+
+
+def range_equity(hero, opponents, board=None, dead=None, n_runs=10_000, seed=None, chunk_size=chunk_size):
+    """
+    Probabilities of winning, drawing or losing for hero against the opponents, each of them being a range in
+    the usual notation, an array of 1326 weights or a single hand. The combos holding a card of the board or a
+    dead card are removed from all the ranges, and the hands of the different players never share a card. The
+    runs are simulated chunk_size at a time, to bound the memory taken.
+
+    >>> p = range_equity([('S', 14), ('H', 14)], ['QQ+, AKs'], n_runs=20_000, seed=0)
+    >>> round(p[1], 1), p.n_deals
+    (0.8, 20000)
+    """
+    rng = np.random.default_rng(seed)
+    board = hand_to_ints(board or [])
+    known = board + hand_to_ints(dead or [])
+    weights_list = [remove_cards(to_weights(player), known) for player in [hero] + list(opponents)]
+    if any(weights.sum() == 0 for weights in weights_list):
+        raise ValueError("A range is empty once the known cards are removed")
+    c, n_players = Counter(), len(weights_list)
+    for start in range(0, n_runs, chunk_size):
+        size = min(chunk_size, n_runs - start)
+        hands = sample_hands(weights_list, size, rng)
+
+        # the missing common cards are drawn among the cards neither known nor held
+        keys = rng.random((size, n_cards))
+        keys[:, known] = 2
+        keys[np.arange(size)[:, None], hands.reshape(size, -1)] = 2
+        missing = keys.argsort(axis=1)[:, :5 - len(board)]
+        common_cards = np.hstack([np.broadcast_to(np.array(board, dtype=np.int64), (size, len(board))), missing])
+
+        strengths = evaluate_batch(np.concatenate(
+            [hands, np.broadcast_to(common_cards[:, None], (size, n_players, 5))], axis=2))
+        c.update(my_hands_win(np.sign(strengths[:, :1] - strengths[:, 1:])).tolist())
+
+    p = {k: v / n_runs for k, v in c.items()}
+    intervals = {outcome: wilson_interval(c[outcome], n_runs) for outcome in (1, 0, -1)}
+    return Equity(p, method='simulate', n_deals=n_runs, n_evaluations=n_runs * n_players, intervals=intervals)
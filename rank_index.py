@@ -0,0 +1,152 @@
+import argparse
+import os
+import sys
+from itertools import combinations
+from math import comb
+from multiprocessing import Pool
+import numpy as np
+from PokerAI.cards import n_cards, ints_to_hand, deal_many
+from PokerAI.evaluator import evaluate_batch, categories, categories_batch
+from PokerAI.hand import best_five_of_fives, is_better
+
+"""
+Strength (see evaluator.py) of every one of the 133,784,560 hands of 7 cards, stored at the position of the
+hand in the colexicographic order of the 7 cards subsets: the hand of sorted integer cards c_0 < ... < c_6 is at
+index C(c_0, 1) + C(c_1, 2) + ... + C(c_6, 7). Once the table is built, evaluating a hand is sorting its cards,
+summing 7 binomial coefficients read from a small table and reading the strength from the memory mapped file.
+
+The build splits the hands by their two highest cards c_5 < c_6: the hands sharing them fill the contiguous
+block of C(c_5, 5) indices starting at C(c_5, 6) + C(c_6, 7), which a worker computes and writes directly to
+the memory mapped file. The blocks done are saved in a progress file, so that an interrupted build resumes.
+"""
+
+n_hands = comb(n_cards, 7)
+
+table_folder = os.path.dirname(os.path.realpath(__file__)) + '/tables/'
+index_path = os.path.join(table_folder, 'rank_index.npy')
+
+binomials = np.array([[comb(n, k) for k in range(8)] for n in range(n_cards + 1)], dtype=np.int64)
+
+
+def hand_indices(cards):
+    """
+    Positions of the hands of 7 integer cards, given as an array of shape (..., 7), in the colexicographic order.
+
+    >>> hand_indices(np.array([[0, 1, 2, 3, 4, 5, 6], [51, 50, 49, 48, 47, 46, 45]])).tolist() == [0, n_hands - 1]
+    True
+    """
+    cards = np.sort(cards, axis=-1)
+    return binomials[cards, np.arange(1, 8)].sum(axis=-1)
+
+
+def _progress_path(path):
+    return os.path.splitext(path)[0] + '.done.npy'
+
+
+def _fill_block(task):
+    path, low, high = task
+    lows = np.array(list(combinations(range(low), 5)), dtype=np.int64)
+    cards = np.hstack([lows, np.full((len(lows), 1), low), np.full((len(lows), 1), high)])
+    start = binomials[high, 7] + binomials[low, 6]
+    block = np.zeros(len(lows), dtype=np.uint16)
+    block[hand_indices(cards) - start] = evaluate_batch(cards)
+
+    table = np.load(path, mmap_mode='r+')
+    table[start:start + len(lows)] = block
+    table.flush()
+    return low, high
+
+
+def build_index(workers=None, path=index_path):
+    """
+    Compute the strengths of all the hands of 7 cards over a pool of workers processes (all the cores by
+    default) and write them to path. An interrupted build called again with the same path resumes where it
+    stopped.
+    """
+    progress_path = _progress_path(path)
+    if os.path.exists(path) and not os.path.exists(progress_path):
+        return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(progress_path):
+        done = np.load(progress_path)
+    else:
+        np.lib.format.open_memmap(path, mode='w+', dtype=np.uint16, shape=(n_hands,)).flush()
+        done = np.zeros((n_cards, n_cards), dtype=bool)
+        np.save(progress_path, done)
+
+    tasks = [(path, low, high) for high in range(6, n_cards) for low in range(5, high) if not done[low, high]]
+    with Pool(workers) as pool:
+        for low, high in pool.imap_unordered(_fill_block, tasks):
+            done[low, high] = True
+            temporary_path = progress_path + '.tmp.npy'
+            np.save(temporary_path, done)
+            os.replace(temporary_path, progress_path)
+
+    os.remove(progress_path)
+    _indices.pop(path, None)
+
+
+_indices = dict()
+
+
+def load_index(path=index_path):
+    """
+    The memory mapped table of the strengths of all the hands of 7 cards.
+    """
+    if path not in _indices:
+        if not os.path.exists(path) or os.path.exists(_progress_path(path)):
+            raise FileNotFoundError(f"{path} is not built yet, run python -m PokerAI.rank_index build")
+        _indices[path] = np.load(path, mmap_mode='r')
+    return _indices[path]
+
+
+def evaluate_7(cards, path=index_path):
+    """
+    Strengths of the hands of 7 integer cards given as an array of shape (..., 7), read from the table.
+    """
+    return load_index(path)[hand_indices(np.asarray(cards))]
+
+
+def verify(n_hands=10_000, seed=0, path=index_path):
+    """
+    Check the table on n_hands random hands: their strengths should be those given by the evaluator, their
+    categories those of hand.best_five_of_fives, and each consecutive pair of hands should be ordered as
+    hand.is_better orders them. Return the number of hands which failed each check and a few examples.
+    """
+    cards = deal_many(np.arange(n_cards), n_hands, 7, rng=np.random.default_rng(seed))
+    strengths = evaluate_7(cards, path=path)
+    references = [best_five_of_fives(ints_to_hand(hand)) for hand in cards.tolist()]
+
+    report = {'n_hands': n_hands, 'evaluator': 0, 'category': 0, 'order': 0, 'examples': []}
+    expected = evaluate_batch(cards)
+    found_categories = categories_batch(strengths)
+    for i, hand in enumerate(cards.tolist()):
+        failed = []
+        if strengths[i] != expected[i]:
+            failed.append('evaluator')
+        if categories[found_categories[i]] != references[i][0]:
+            failed.append('category')
+        if i > 0:
+            order = int(np.sign(int(strengths[i]) - int(strengths[i - 1])))
+            if order != is_better(references[i], references[i - 1]):
+                failed.append('order')
+        for check in failed:
+            report[check] += 1
+        if failed and len(report['examples']) < 10:
+            report['examples'].append((ints_to_hand(hand), failed, references[i]))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or verify the table of the strengths of all 7 cards hands')
+    parser.add_argument('command', choices=['build', 'verify'])
+    parser.add_argument('--workers', type=int, default=None, help='processes used, all the cores by default')
+    parser.add_argument('--hands', type=int, default=10_000, help='hands checked by verify')
+    parser.add_argument('--path', default=index_path)
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_index(workers=args.workers, path=args.path)
+    report = verify(n_hands=args.hands, path=args.path)
+    print(report)
+    sys.exit(int(any(report[check] for check in ('evaluator', 'category', 'order'))))
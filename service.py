@@ -0,0 +1,460 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+import numpy as np
+from PokerAI.cards import hand_to_ints
+from PokerAI.evaluator import evaluate_batch, categories, categories_batch
+from PokerAI.equity import Equity, chunk_size, equity_from_counts, my_hands_win, remaining_cards, sample_deals
+from PokerAI.canonical import cached_equity, cached_outs, equity_cache, equity_key, outs_cache
+
+"""
+Long running local service answering equity, outs and hand evaluation queries, so that many bots share one
+process, one copy of the tables and one cache of the results instead of each computing its own.
+
+The protocol is one JSON object per line both ways, over localhost TCP or a Unix socket. A request has a type
+('equity', 'outs', 'evaluate' or 'stats'), an optional id echoed in its response, and the arguments of the
+function answering it, cards being [suit, number] pairs:
+
+    {"id": 7, "type": "equity", "my_hand": [["S", 14], ["S", 13]], "n_players": 3, "n_runs": 2000}
+
+and the response holds either a result or an error:
+
+    {"id": 7, "result": {"probabilities": {"1": 0.52, "0": 0.01, "-1": 0.47}, "method": "simulate", ...}}
+
+Requests are answered by batches: the first request waiting opens a window of window_ms milliseconds (or until
+max_batch requests are waiting), and all the requests gathered are answered together. The simulated equities
+missing from the cache (see canonical.cached_equity, whose cache is shared) are simulated with a single
+evaluation of all their hands (see simulate_many), and queries equal up to the suits are simulated once; the
+hands to evaluate are evaluated in one call per number of cards. The other queries (exact, seeded or
+stratified equities, outs) go through the caches of canonical.py one by one. The batches are computed in a
+worker thread, so that the requests keep being read meanwhile, and the responses are sent back on the
+connection of each request, in the order they are ready. A 'stats' request is answered at once with the
+number of requests waiting, the sizes of the batches, the percentiles of the latencies and the statistics of
+the caches.
+"""
+
+logger = logging.getLogger(__name__)
+
+default_port = 8765
+equity_options = ('n_runs', 'method', 'max_deals', 'seed', 'ci_halfwidth', 'deadline_ms', 'max_runs', 'sampling')
+# options of equity which make a query be answered on its own rather than simulated with the batch, as do
+# the methods other than 'simulate' and the sampling other than 'random'
+_unbatched_options = ('seed', 'ci_halfwidth', 'deadline_ms')
+
+
+def _cards(cards):
+    # (suit, number) tuples from the [suit, number] pairs of JSON
+    return None if cards is None else [(suit, number) for suit, number in cards]
+
+
+def _to_json(value):
+    if isinstance(value, dict):
+        return {str(key): _to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def equity_to_json(p):
+    return {'probabilities': _to_json(dict(p)), 'method': p.method, 'n_deals': p.n_deals,
+            'n_evaluations': p.n_evaluations, 'intervals': _to_json(p.intervals), 'n_effective': p.n_effective}
+
+
+def equity_from_json(result):
+    """
+    The Equity of the result of an equity request.
+
+    >>> p = equity_from_json(equity_to_json(Equity({1: 0.25, -1: 0.75}, method='exact', n_deals=4)))
+    >>> p[1], p[0], p.method, p.n_deals
+    (0.25, 0, 'exact', 4)
+    """
+    intervals = result['intervals']
+    if intervals is not None:
+        intervals = {int(outcome): tuple(interval) for outcome, interval in intervals.items()}
+    return Equity({int(outcome): p for outcome, p in result['probabilities'].items()}, method=result['method'],
+                  n_deals=result['n_deals'], n_evaluations=result['n_evaluations'], intervals=intervals,
+                  n_effective=result.get('n_effective'))
+
+
+def _deal_rows(hero, board, opponents, remaining, n_unknown, n_runs, rng):
+    # the hands of 7 cards of all the players on n_runs deals, a row per player and deal
+    n_missing = 5 - len(board)
+    deals = sample_deals(remaining, n_missing, n_unknown, n_runs, rng=rng)
+    boards = np.hstack([np.broadcast_to(board, (n_runs, len(board))), deals[:, :n_missing]])
+    hands = np.concatenate([np.broadcast_to(np.asarray(hero, dtype=np.int64), (n_runs, 1, 2)),
+                            np.broadcast_to(np.array(opponents, dtype=np.int64).reshape(1, -1, 2),
+                                            (n_runs, len(opponents), 2)),
+                            deals[:, n_missing:].reshape(n_runs, n_unknown, 2)], axis=1)
+    return np.concatenate([hands, np.broadcast_to(boards[:, None], (n_runs, hands.shape[1], 5))],
+                          axis=2).reshape(-1, 7)
+
+
+def _count_pending(pending, counts):
+    # evaluate the rows of the pending pieces of queries at once and add their results to the counts
+    strengths = evaluate_batch(np.concatenate([rows for _, _, rows in pending]))
+    start = 0
+    for index, n_runs, rows in pending:
+        block = strengths[start:start + len(rows)].reshape(n_runs, -1)
+        start += len(rows)
+        counts[index][0].update(my_hands_win(np.sign(block[:, :1] - block[:, 1:])).tolist())
+        counts[index][1] += block.size
+    pending.clear()
+
+
+def simulate_many(queries, rng=None, chunk_size=chunk_size):
+    """
+    Simulate the deals of several equity queries with few evaluations of all their hands. A query is a tuple
+    (hero, board, opponents, remaining, n_unknown, n_runs) as the arguments of equity.simulate, all cards being
+    integers. The deals are evaluated together about chunk_size at a time, a large query being split over several
+    evaluations, to bound the memory taken. Return the counts of the results and the number of hands evaluated
+    of each query.
+
+    >>> hero, board = np.array([48, 49]), np.array([0, 5, 10], dtype=np.int64)
+    >>> queries = [(hero, board, [], np.setdiff1d(np.arange(52), [0, 5, 10, 48, 49]), 1, 100),
+    ...            (np.array([0, 1]), np.zeros(0, dtype=np.int64), [[48, 49]], np.arange(2, 48), 0, 50)]
+    >>> [(sum(counts.values()), n_evaluations) for counts, n_evaluations in simulate_many(queries)]
+    [(100, 200), (50, 100)]
+    """
+    rng = rng or np.random.default_rng()
+    counts = [[Counter(), 0] for _ in queries]
+    pending, n_pending = [], 0
+    for index, (*query, n_runs) in enumerate(queries):
+        for start in range(0, n_runs, chunk_size):
+            size = min(chunk_size, n_runs - start)
+            pending.append((index, size, _deal_rows(*query, size, rng)))
+            n_pending += size
+            if n_pending >= chunk_size:
+                _count_pending(pending, counts)
+                n_pending = 0
+    if pending:
+        _count_pending(pending, counts)
+    return [tuple(query_counts) for query_counts in counts]
+
+
+class EquityService:
+    """
+    The server side: requests are queued by the connections and answered by batches (see answer) in a single
+    worker thread, which is thus the only one to touch the caches. Requests asking for more than max_runs runs,
+    deals or hands to evaluate are refused, so that one client can not take all the memory of the service.
+    """
+
+    def __init__(self, window_ms=2., max_batch=256, seed=None, n_latencies=10_000, max_runs=1_000_000):
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.max_runs = max_runs
+        self.rng = np.random.default_rng(seed)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+        self.server = None
+        self.batcher = None
+        self.n_requests = 0
+        self.n_coalesced = 0
+        self.in_flight = 0
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=n_latencies)
+
+    def _equity_query(self, request):
+        my_hand, board, dead = _cards(request['my_hand']), _cards(request.get('board')), _cards(request.get('dead'))
+        opponent_hands = [_cards(hand) for hand in request.get('opponent_hands') or []]
+        options = {name: request[name] for name in equity_options if name in request}
+        for name in ('n_runs', 'max_runs', 'max_deals'):
+            if name in options and not (isinstance(options[name], int) and 0 < options[name] <= self.max_runs):
+                raise ValueError(f"{name} should be a positive integer of at most {self.max_runs}")
+        if options.get('ci_halfwidth') is not None:
+            options.setdefault('max_runs', self.max_runs)
+        return my_hand, request['n_players'], board, dead, opponent_hands, options
+
+    def _simulation_task(self, my_hand, n_players, board, dead, opponent_hands, options):
+        n_unknown = n_players - 1 - len(opponent_hands)
+        if not isinstance(n_players, int) or n_unknown < 0:
+            raise ValueError("n_players should be an integer, at least one more than the opponent hands")
+        known = hand_to_ints(my_hand) + hand_to_ints(board or []) + [card for hand in opponent_hands
+                                                                      for card in hand_to_ints(hand)]
+        if len(set(known)) < len(known) or len(my_hand) != 2 or len(board or []) > 5:
+            raise ValueError("The cards of a query should be different, with two cards in hand and at most five "
+                             "on the board")
+        remaining, n_runs = remaining_cards(my_hand, board, dead, *opponent_hands), options.get('n_runs', 100)
+        if 5 - len(board or []) + 2 * n_unknown > len(remaining):
+            raise ValueError(f"Not enough cards left to deal the board and {n_unknown} hands")
+        if not isinstance(n_runs, int) or n_runs < 1:
+            raise ValueError("n_runs should be a positive integer")
+        return (np.array(hand_to_ints(my_hand)), np.array(hand_to_ints(board or []), dtype=np.int64),
+                [hand_to_ints(hand) for hand in opponent_hands], remaining, n_unknown, n_runs)
+
+    def answer(self, requests):
+        """
+        The responses to a batch of requests, in the same order: a dictionary with the result, or the error
+        raised by the request.
+        """
+        responses = [None] * len(requests)
+        simulations = dict()
+        evaluations = []
+        for index, request in enumerate(requests):
+            try:
+                kind = request.get('type')
+                if kind == 'equity':
+                    query = self._equity_query(request)
+                    options = query[-1]
+                    unbatched = options.get('method', 'simulate') != 'simulate' or any(
+                        options.get(name) is not None for name in _unbatched_options)
+                    if unbatched or options.get('sampling', 'random') != 'random':
+                        responses[index] = {'result': equity_to_json(cached_equity(*query[:5], **options))}
+                        continue
+                    key = equity_key(*query[:5], **options)
+                    p = equity_cache.get(key)
+                    if p is not None:
+                        responses[index] = {'result': equity_to_json(p)}
+                    elif key in simulations:
+                        simulations[key][1].append(index)
+                        self.n_coalesced += 1
+                    else:
+                        simulations[key] = (self._simulation_task(*query), [index])
+                elif kind == 'outs':
+                    result = cached_outs(_cards(request['my_hand']), _cards(request['board']),
+                                         opponent_range=request.get('opponent_range'), dead=_cards(request.get('dead')),
+                                         max_runouts=request.get('max_runouts'))
+                    responses[index] = {'result': _to_json(result)}
+                elif kind == 'evaluate':
+                    if len(request['hands']) > self.max_runs:
+                        raise ValueError(f"At most {self.max_runs} hands can be evaluated by a request")
+                    hands = [hand_to_ints(_cards(hand)) for hand in request['hands']]
+                    if any(not 5 <= len(hand) <= 7 or len(set(hand)) < len(hand) for hand in hands):
+                        raise ValueError("A hand should have 5 to 7 different cards")
+                    evaluations.append((index, hands))
+                else:
+                    raise ValueError(f"Unknown request type {kind}, should be 'equity', 'outs', 'evaluate' or "
+                                     f"'stats'")
+            except Exception as error:
+                responses[index] = {'error': f'{type(error).__name__}: {error}'}
+
+        outputs = simulate_many([task for task, _ in simulations.values()], rng=self.rng)
+        for (key, (_, indices)), (counts, n_evaluations) in zip(simulations.items(), outputs):
+            p = equity_from_counts(counts, 'simulate', n_evaluations)
+            equity_cache.put(key, p)
+            for index in indices:
+                responses[index] = {'result': equity_to_json(p)}
+
+        hands = [hand for _, request_hands in evaluations for hand in request_hands]
+        strengths = np.zeros(len(hands), dtype=np.int64)
+        for size in set(len(hand) for hand in hands):
+            rows = [row for row, hand in enumerate(hands) if len(hand) == size]
+            strengths[rows] = evaluate_batch(np.array([hands[row] for row in rows]))
+        start = 0
+        for index, request_hands in evaluations:
+            request_strengths = strengths[start:start + len(request_hands)]
+            start += len(request_hands)
+            responses[index] = {'result': {'strengths': request_strengths.tolist(), 'categories': [
+                categories[category] for category in categories_batch(request_strengths).tolist()]}}
+        return responses
+
+    async def _batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window_ms / 1000
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), max(deadline - loop.time(), 0)))
+                except asyncio.TimeoutError:
+                    break
+            self.in_flight = len(batch)
+            try:
+                responses = await loop.run_in_executor(self.executor, self.answer, [item[0] for item in batch])
+            except Exception as error:
+                responses = [{'error': f'{type(error).__name__}: {error}'} for _ in batch]
+            self.in_flight = 0
+            self.batch_sizes[len(batch)] += 1
+            now = time.perf_counter()
+            for (_, future, arrival), response in zip(batch, responses):
+                self.latencies.append(1000 * (now - arrival))
+                if not future.done():
+                    future.set_result(response)
+
+    def stats(self):
+        """
+        The requests waiting and being answered, the number of requests (and of those simulated along with an
+        identical one of their batch) and of batches with the mean and largest batch size, the percentiles 50,
+        90 and 99 of the latencies of the last requests (from their arrival to their response, in milliseconds)
+        and the statistics of the shared caches.
+        """
+        n_batches = sum(self.batch_sizes.values())
+        percentiles = np.percentile(self.latencies, [50, 90, 99]).tolist() if self.latencies else [0., 0., 0.]
+        return {
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'in_flight': self.in_flight,
+            'requests': self.n_requests,
+            'coalesced': self.n_coalesced,
+            'batches': n_batches,
+            'mean_batch_size': sum(size * n for size, n in self.batch_sizes.items()) / n_batches if n_batches else 0.,
+            'max_batch_size': max(self.batch_sizes, default=0),
+            'latency_ms': dict(zip(('p50', 'p90', 'p99'), percentiles)),
+            'caches': {'equity': equity_cache.stats(), 'outs': outs_cache.stats()},
+        }
+
+    async def _respond(self, request, writer, lock):
+        if not isinstance(request, dict):
+            response, request = {'error': 'Invalid request, not a JSON object'}, dict()
+        elif request.get('type') == 'stats':
+            response = {'result': self.stats()}
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.n_requests += 1
+            await self.queue.put((request, future, time.perf_counter()))
+            response = await future
+        response = dict(response, id=request.get('id'))
+        async with lock:
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+
+    async def _handle(self, reader, writer):
+        lock, tasks = asyncio.Lock(), set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    request = None
+                task = asyncio.ensure_future(self._respond(request, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=default_port, path=None):
+        """
+        Listen on the Unix socket at path if given, on host and port (0 for any free port) otherwise, and start
+        answering. Return the asyncio server.
+        """
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.ensure_future(self._batches())
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self._handle, path=path)
+        else:
+            self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        self.executor.shutdown(wait=False)
+
+
+class EquityClient:
+    """
+    Connection to an EquityService. Requests can be sent concurrently from several tasks on one connection,
+    each waiting for its own response.
+    """
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.pending = dict()
+        self.ids = count()
+        self.receiver = None
+
+    async def connect(self, host='127.0.0.1', port=default_port, path=None):
+        if path is not None:
+            self.reader, self.writer = await asyncio.open_unix_connection(path)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.receiver = asyncio.ensure_future(self._receive())
+        return self
+
+    async def _receive(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.pending.pop(response.get('id'), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("The connection to the service was closed"))
+            self.pending.clear()
+
+    async def request(self, kind, **arguments):
+        """
+        Send a request of the given type and return its result, raising RuntimeError if it failed.
+        """
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(json.dumps({'id': request_id, 'type': kind, **arguments}).encode() + b'\n')
+        await self.writer.drain()
+        response = await future
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    async def equity(self, my_hand, n_players, **kwargs):
+        return equity_from_json(await self.request('equity', my_hand=my_hand, n_players=n_players, **kwargs))
+
+    async def outs(self, my_hand, board, **kwargs):
+        result = await self.request('outs', my_hand=my_hand, board=board, **kwargs)
+        for name in ('cards', 'outs', 'improving'):
+            result[name] = _cards(result[name])
+        return result
+
+    async def evaluate(self, hands):
+        """
+        Strengths (see evaluator.py) and categories of hands of 5 to 7 (suit, number) cards.
+        """
+        return await self.request('evaluate', hands=hands)
+
+    async def stats(self):
+        return await self.request('stats')
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.receiver.cancel()
+
+
+async def _serve(args):
+    service = EquityService(window_ms=args.window_ms, max_batch=args.max_batch, max_runs=args.max_runs)
+    server = await service.start(host=args.host, port=args.port, path=args.socket)
+    logger.info(f'Listening on {args.socket or service.address}')
+    async with server:
+        if args.log_interval is None:
+            await server.serve_forever()
+        while True:
+            await asyncio.sleep(args.log_interval)
+            logger.info(json.dumps(service.stats()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve equity, outs and hand evaluation requests')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=default_port)
+    parser.add_argument('--socket', default=None, help='path of a Unix socket to listen on instead of TCP')
+    parser.add_argument('--window-ms', type=float, default=2., help='time gathering the requests of a batch')
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-runs', type=int, default=1_000_000, help='runs, deals or hands allowed per request')
+    parser.add_argument('--log-interval', type=float, default=None, help='seconds between logs of the statistics')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    asyncio.run(_serve(args))
@@ -1,2 +1,107 @@
-def test():
-  print(2)
\ No newline at end of file
+import numpy as np
+from PokerAI.evaluator import evaluate_batch, categories_batch
+from PokerAI.game import fold, call, bet
+from PokerAI.preflop import class_indices
+from PokerAI.cfr import StrategyTable
+
+"""
+Strategies for the tables of game.py. A strategy decides for many tables at once: its act method gets the
+observation of game.Tables.observe, a dictionary of arrays with one row per table, and returns the array of
+the actions (game.fold, game.call or game.bet), or a tuple of the actions and of the totals to raise to.
+"""
+
+
+def made_categories(hands, boards):
+    """
+    Index in evaluator.categories of the best hand of the hole cards with the common cards shown (-1 for the
+    cards not shown yet), for boards of at least 3 cards.
+
+    >>> made_categories(np.array([[48, 49], [0, 5]]), np.array([[50, 20, 30, -1, -1], [50, 20, 30, 40, -1]])).tolist()
+    [3, 0]
+    """
+    categories = np.zeros(len(hands), dtype=np.int64)
+    sizes = (boards >= 0).sum(axis=1)
+    for size in np.unique(sizes).tolist():
+        rows = np.flatnonzero(sizes == size)
+        categories[rows] = categories_batch(evaluate_batch(np.hstack([hands[rows], boards[rows, :size]])))
+    return categories
+
+
+class CallingStation:
+    """
+    Always calls, never raises.
+    """
+    name = 'CallingStation'
+
+    def act(self, observation):
+        return np.full(len(observation['hands']), call)
+
+
+class RandomStrategy:
+    """
+    Folds, calls or raises the pot at random with the given probabilities.
+    """
+    name = 'RandomStrategy'
+
+    def __init__(self, p_fold=0.2, p_bet=0.2, rng=None):
+        self.p_fold = p_fold
+        self.p_bet = p_bet
+        self.rng = rng or np.random.default_rng()
+
+    def act(self, observation):
+        draws = self.rng.random(len(observation['hands']))
+        actions = np.where(draws < self.p_fold, fold, np.where(draws < self.p_fold + self.p_bet, bet, call))
+        return actions, observation['pot'] + 2 * observation['to_call']
+
+
+class HandStrength:
+    """
+    Before the flop, raises the pairs of 9 and more and the aces with a king or a queen, calls with the pairs, two
+    cards of 10 or more or a suited ace, and folds the rest. After the flop, raises the pot with two pairs or
+    better, calls with a pair and folds otherwise, checking whenever it is free.
+    """
+    name = 'HandStrength'
+
+    def act(self, observation):
+        hands, boards = observation['hands'], observation['board']
+        numbers = hands >> 2
+        high, low = numbers.max(axis=1), numbers.min(axis=1)
+        pair, suited = high == low, (hands[:, 0] & 3) == (hands[:, 1] & 3)
+        strong = pair & (low >= 7) | (high == 12) & (low >= 10)
+        playable = pair | (low >= 8) | (high == 12) & suited
+
+        preflop = observation['street'] == 0
+        made = np.zeros(len(hands), dtype=np.int64)
+        if not preflop.all():
+            made[~preflop] = made_categories(hands[~preflop], boards[~preflop])
+        raising = np.where(preflop, strong, made >= 2)
+        calling = np.where(preflop, playable, made >= 1)
+
+        actions = np.where(raising, bet, np.where(calling | (observation['to_call'] == 0), call, fold))
+        pot_raise = observation['pot'] + 2 * observation['to_call']
+        return actions, np.where(preflop, 3 * observation['min_raise_to'], pot_raise)
+
+
+class PushFold:
+    """
+    Heads up push or fold strategy solved by cfr.py and exported to path, for tables of the stack it was solved
+    for: as the small blind, goes all in or folds; facing a bet, calls or folds as against an all in; checks
+    otherwise.
+    """
+    name = 'PushFold'
+
+    def __init__(self, path, rng=None):
+        self.table = StrategyTable(path)
+        self.rng = rng or np.random.default_rng()
+
+    def act(self, observation):
+        classes = class_indices(observation['hands'])
+        facing = observation['to_call'] > 0
+        # the small blind (the button heads up) facing only the big blind
+        opening = (observation['street'] == 0) & (observation['seat'] == observation['button'])
+        opening &= np.isclose(observation['pot'], 3 * observation['to_call'])
+        draws = self.rng.random(len(classes))
+        pushing = draws < self.table.probabilities('', classes)[:, 1]
+        calling = draws < self.table.probabilities('all in', classes)[:, 1]
+        actions = np.where(opening, np.where(pushing, bet, fold), np.where(facing & ~calling, fold, call))
+        return actions, np.full(len(classes), np.inf)
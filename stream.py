@@ -0,0 +1,192 @@
+import glob
+import os
+import numpy as np
+from PokerAI.cards import hand_to_ints, deal_many
+from PokerAI.evaluator import evaluate_batch
+from PokerAI.equity import Equity, remaining_cards, split_pot, wilson_interval
+from PokerAI.preflop import class_indices, names, n_classes
+
+"""
+Simulation of many rounds as a stream of fixed size batches, each a numpy structured array with one record per
+round: the hands of the players, the board, the strength of the best hand of each player (see evaluator.py),
+its result against the others (1, 0 or -1 as deck.my_hand_wins) and its fraction of the pot.
+
+The batches are appended to a folder of compressed .npz chunks, one array per field, so that writing tens of
+millions of rounds takes the memory of a single batch, and reading back only loads the fields needed.
+"""
+
+outcomes = (1, 0, -1)
+
+suitedness = ['rainbow', 'two_tone', 'suited']
+texture_names = [f'{suits} {paired} {connected}' for suits in suitedness for paired in ('unpaired', 'paired')
+                 for connected in ('disconnected', 'connected')]
+
+# bits of the numbers of the windows of 5 consecutive numbers, the ace counting as 1 (bit 0) and 14 (bit 13)
+_windows = [0b11111 << shift for shift in range(10)]
+_bit_counts = np.array([bin(mask).count('1') for mask in range(1 << 14)], dtype=np.int8)
+
+
+def round_dtype(n_players):
+    return np.dtype([('hands', np.int8, (n_players, 2)), ('board', np.int8, 5), ('strengths', np.int16, n_players),
+                     ('results', np.int8, n_players), ('shares', np.float32, n_players)])
+
+
+def results_of(strengths):
+    """
+    Result of every player against all the others, as deck.my_hand_wins: -1 if any other hand is better, 0 if
+    all of them are as good, 1 otherwise.
+
+    >>> results_of(np.array([[5, 9, 9], [7, 3, 1], [4, 4, 4]])).tolist()
+    [[-1, 1, 1], [1, -1, -1], [0, 0, 0]]
+    """
+    losing = strengths < strengths.max(axis=-1, keepdims=True)
+    all_tied = (strengths == strengths[..., :1]).all(axis=-1, keepdims=True)
+    return np.where(losing, -1, np.where(all_tied, 0, 1)).astype(np.int8)
+
+
+def simulate_stream(n_players, n_rounds, batch_size=100_000, my_hand=None, board=None, seed=None):
+    """
+    Generate n_rounds rounds by batches of batch_size. The first player holds my_hand and the board starts with
+    the given common cards when they are given, the other cards are dealt at random.
+    """
+    rng = np.random.default_rng(seed)
+    hero = hand_to_ints(my_hand or [])
+    remaining = remaining_cards(my_hand, board)
+    board = hand_to_ints(board or [])
+    n_missing = 5 - len(board)
+    dtype = round_dtype(n_players)
+
+    for start in range(0, n_rounds, batch_size):
+        n = min(batch_size, n_rounds - start)
+        dealt = deal_many(remaining, n, n_missing + 2 * n_players - len(hero), rng=rng)
+        boards = np.hstack([np.broadcast_to(np.array(board, dtype=np.int64), (n, len(board))), dealt[:, :n_missing]])
+        hands = np.hstack([np.broadcast_to(np.array(hero, dtype=np.int64), (n, len(hero))), dealt[:, n_missing:]])
+        hands = hands.reshape(n, n_players, 2)
+        strengths = evaluate_batch(np.concatenate([hands, np.broadcast_to(boards[:, None], (n, n_players, 5))], axis=2))
+
+        batch = np.empty(n, dtype=dtype)
+        batch['hands'] = hands
+        batch['board'] = boards
+        batch['strengths'] = strengths
+        batch['results'] = results_of(strengths)
+        batch['shares'] = split_pot(strengths)[1]
+        yield batch
+
+
+class StreamWriter:
+    """
+    Append batches of rounds to a folder of compressed .npz chunks, one array per field. Writing to an existing
+    folder adds chunks after the ones already there.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.n_chunks = len(chunk_paths(path))
+        self.n_rounds = 0
+
+    def write(self, batch):
+        chunk_path = os.path.join(self.path, f'chunk_{self.n_chunks:06d}.npz')
+        temporary_path = chunk_path + '.tmp.npz'
+        np.savez_compressed(temporary_path, **{field: batch[field] for field in batch.dtype.names})
+        os.replace(temporary_path, chunk_path)
+        self.n_chunks += 1
+        self.n_rounds += len(batch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+def write_stream(batches, path):
+    """
+    Write all the batches to path and return the number of rounds written.
+    """
+    with StreamWriter(path) as writer:
+        for batch in batches:
+            writer.write(batch)
+    return writer.n_rounds
+
+
+def chunk_paths(path):
+    return sorted(glob.glob(os.path.join(path, 'chunk_*[0-9].npz')))
+
+
+def read_stream(path, fields=None):
+    """
+    Generate the chunks written to path as dictionaries of arrays, loading only the given fields (all of them
+    by default).
+    """
+    for chunk_path in chunk_paths(path):
+        with np.load(chunk_path) as chunk:
+            yield {field: chunk[field] for field in (fields or chunk.files)}
+
+
+def board_textures(boards):
+    """
+    Index in texture_names of the texture of boards of integer cards, given as an array of shape (N, k): how
+    many cards share a suit (rainbow, two tone or 3 and more), whether a number appears twice, and whether 3
+    of the numbers fit in a straight.
+
+    >>> [texture_names[index] for index in board_textures(np.array([[0, 5, 10], [48, 49, 44], [48, 0, 4]]))]
+    ['rainbow unpaired connected', 'two_tone paired disconnected', 'suited unpaired connected']
+    """
+    numbers, suits = boards >> 2, boards & 3
+    max_suit = (suits[:, :, None] == np.arange(4)).sum(axis=1).max(axis=1)
+    suit_index = np.minimum(max_suit, 3) - 1
+    sorted_numbers = np.sort(numbers, axis=1)
+    paired = (sorted_numbers[:, 1:] == sorted_numbers[:, :-1]).any(axis=1)
+
+    masks = np.bitwise_or.reduce(1 << (numbers + 1), axis=1)
+    masks |= (masks >> 13) & 1
+    connected = np.zeros(len(boards), dtype=bool)
+    for window in _windows:
+        connected |= _bit_counts[masks & window] >= 3
+    return suit_index * 4 + paired * 2 + connected
+
+
+def aggregate(path, by='class', street=3, players=None):
+    """
+    Probabilities of winning, drawing or losing read from the rounds written to path, grouped by the class of
+    the hand (see preflop.py) or by the texture of the board (its first street cards, see board_textures).
+    The rounds of all the players are counted, or only those of the given players indices.
+    Return a dictionary of Equity by class or texture name, for the groups seen at least once.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'rounds')
+    >>> write_stream(simulate_stream(3, 5000, batch_size=2000, seed=0), path)
+    5000
+    >>> p = aggregate(path, by='class')['AA']
+    >>> p.n_deals > 0, round(sum(p.values()), 6)
+    (True, 1.0)
+    """
+    if by == 'class':
+        group_names, n_groups = names, n_classes
+    elif by == 'texture':
+        group_names, n_groups = texture_names, len(texture_names)
+    else:
+        raise ValueError(f"Unknown grouping {by}, should be 'class' or 'texture'")
+
+    counts = np.zeros((n_groups, len(outcomes)), dtype=np.int64)
+    for chunk in read_stream(path, ['hands', 'board', 'results']):
+        selected = slice(None) if players is None else list(players)
+        results = chunk['results'][:, selected].astype(np.int64)
+        if by == 'class':
+            groups = class_indices(chunk['hands'][:, selected].astype(np.int64))
+        else:
+            textures = board_textures(chunk['board'][:, :street].astype(np.int64))
+            groups = np.broadcast_to(textures[:, None], results.shape)
+        outcome_indices = 1 - results
+        counts += np.bincount((groups * len(outcomes) + outcome_indices).ravel(),
+                              minlength=n_groups * len(outcomes)).reshape(n_groups, len(outcomes))
+
+    equities = dict()
+    for index, group_counts in enumerate(counts):
+        n = int(group_counts.sum())
+        if n:
+            probas = {outcome: count / n for outcome, count in zip(outcomes, group_counts.tolist()) if count}
+            intervals = {outcome: wilson_interval(count, n) for outcome, count in zip(outcomes, group_counts.tolist())}
+            equities[group_names[index]] = Equity(probas, method='stream', n_deals=n, intervals=intervals)
+    return equities
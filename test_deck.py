@@ -0,0 +1,132 @@
+from collections import Counter
+import numpy as np
+
+from PokerAI.deck import Deck, ShuffledDeck, Round
+from PokerAI import instrument, equity
+from PokerAI.game import Tables, play, fold, call, bet
+from PokerAI.strategies import CallingStation, RandomStrategy, HandStrength, PushFold
+from PokerAI import cfr
+
+
+def test_deck_removal_and_reset():
+    deck = Deck(exclude=[3, 7, 7], rng=np.random.default_rng(0))
+    assert len(deck) == 50
+    dealt = deck.deal(10)
+    assert len(set(dealt)) == 10 and not {3, 7} & set(dealt)
+    assert sorted(deck.live.tolist() + dealt + [3, 7]) == list(range(52))
+    deck.reset(exclude=[0])
+    assert len(deck) == 51 and sorted(deck.live.tolist()) == list(range(1, 52))
+
+
+def test_deck_deals_uniformly():
+    deck = Deck(exclude=range(5, 52), rng=np.random.default_rng(1))
+    counts = Counter(tuple(deal) for deal in deck.deal_many(60_000, 2).tolist())
+    assert len(counts) == 20
+    assert max(counts.values()) / min(counts.values()) < 1.15
+    first_cards = Counter()
+    for _ in range(5_000):
+        deck.reset(exclude=range(5, 52))
+        first_cards[deck.deal(1)[0]] += 1
+    assert len(first_cards) == 5 and min(first_cards.values()) > 850
+
+
+def test_shuffled_deck_and_round():
+    sd = ShuffledDeck(exclude=[('S', 14), ('H', 14)])
+    hand = sd.deal(2)
+    assert len(sd) == 48 and ('S', 14) not in hand + sd.deck
+    round = Round(n_players=4, rng=np.random.default_rng(2))
+    cards = sum(round.dealt_hands, []) + round.flop + round.turn + round.river
+    assert len(set(cards)) == 13
+    best_hands, results = round.simulate_blindly()
+    assert len(best_hands) == 4 and set(results) <= {-1, 0, 1} and best_hands[0][0] in instrument.detectors_tried
+    strengths, results = round.simulate_strengths()
+    assert len(strengths) == 4 and all(isinstance(strength, int) for strength in strengths)
+    strengths, winners, shares = round.showdown()
+    assert sum(shares) == 1 and all(strengths[i] == max(strengths) for i in winners)
+
+
+def test_instrumented_round():
+    round = Round(n_players=3, rng=np.random.default_rng(5))
+    with instrument.instrumented():
+        for _ in range(100):
+            round.simulate_blindly()
+            round.simulate_strengths()
+    report = instrument.snapshot()
+    assert report['simulations'] == 200 and report['stages']['evaluate_batch']['calls'] == 200
+    assert not hasattr(Round.simulate_blindly, '__wrapped__')
+
+
+def test_instrumented_showdown_with_keyword_arguments():
+    # a turn, a river and the hand of one unknown opponent per deal
+    deals = np.array([[48, 44, 40, 41], [49, 45, 36, 37]])
+    with instrument.instrumented():
+        equity.showdown(np.array([0, 5]), np.array([8, 13, 18]), opponents=[], deals=deals)
+        equity.showdown(np.array([0, 5]), board=np.array([8, 13, 18]), opponents=[], deals=deals[:1])
+    assert instrument.snapshot()['simulations'] == 3
+
+
+def test_tables_blinds_side_pots_and_conservation():
+    tables = Tables(3, 3, stack=10., rng=np.random.default_rng(0))
+    tables.deal(button=0)
+    assert tables.committed.tolist() == [[0, 0.5, 1]] * 3 and tables.actor.tolist() == [0, 0, 0]
+    rows = np.arange(3)
+    # the button shoves, the small blind calls all in on the first table only, the big blind calls
+    tables.act(rows, [bet, bet, fold], raise_to=np.full(3, 10.))
+    tables.act(rows, [call, fold, fold])
+    assert tables.done.tolist() == [False, False, True]
+    tables.act(rows[:2], [call, fold])
+    assert tables.done.all() and tables.showdown.tolist() == [True, False, False]
+    won = tables.results()
+    assert np.allclose(won.sum(axis=1), 0)
+    assert won[1].tolist() == [1.5, -0.5, -1] and won[2].tolist() == [0, -0.5, 0.5]
+
+    # a short all in does not reopen the action: the raiser who acted may only call it
+    tables = Tables(1, 3, stack=10., rng=np.random.default_rng(0))
+    tables.deal(button=0)
+    tables.stacks[0, 1] = 5.
+    rows = np.arange(1)
+    tables.act(rows, [bet], raise_to=np.array([4.]))
+    tables.act(rows, [bet], raise_to=np.array([5.5]))
+    tables.act(rows, [call])
+    assert tables.actor.tolist() == [0] and tables.min_raise.tolist() == [3.]
+    tables.act(rows, [bet], raise_to=np.array([9.]))
+    assert tables.street.tolist() == [1] and tables.committed.tolist() == [[5.5, 5.5, 5.5]]
+
+    report = play([RandomStrategy(rng=np.random.default_rng(1)), CallingStation(), HandStrength()], 3000,
+                  n_tables=500, seed=0)
+    assert [result['hands'] for result in report.values()] == [3000] * 3
+    assert abs(sum(result['big_blinds_per_hand'] for result in report.values())) < 1e-9
+    low, high = report['HandStrength']['interval']
+    assert low < report['HandStrength']['big_blinds_per_hand'] < high
+
+
+def test_cfr_river_checkpoint_and_push_fold(tmp_path):
+    board = [('S', 14), ('H', 10), ('D', 7), ('C', 4), ('S', 2)]
+    game = cfr.river_game(board, ranges=('AK, 77, QJs, 98s', 'AK, 55-22, QJs'))
+    solver = cfr.CFR(game)
+    solver.iterate(20)
+    early = solver.exploitability()
+    checkpoint = str(tmp_path / 'river.npz')
+    solver.save(checkpoint)
+    solver.iterate(30)
+    resumed = cfr.CFR(game)
+    assert resumed.solve(50, checkpoint_path=checkpoint) == solver.exploitability() < early
+    assert abs(sum(solver.values())) < 1e-12
+
+    # the payoffs at the leaves are zero sum for weights not symmetric too
+    rng = np.random.default_rng(0)
+    game = cfr.push_fold_game(10, rng.random((cfr.n_classes, cfr.n_classes)), rng.random((cfr.n_classes, cfr.n_classes)))
+    solver, reaches = cfr.CFR(game), rng.random((2, cfr.n_classes))
+    for node in range(len(game.kinds)):
+        if game.kinds[node] != 'decision':
+            values = [reaches[player] @ solver._leaf(node, player, reaches[1 - player]) for player in (0, 1)]
+            assert abs(sum(values)) < 1e-9 * abs(values[0])
+
+    # with even equities the small blind pushes everything and the big blind calls everything
+    solver = cfr.CFR(cfr.push_fold_game(5, np.full((cfr.n_classes, cfr.n_classes), 0.5)))
+    solver.iterate(20)
+    path = str(tmp_path / 'push_fold.npz')
+    solver.export(path)
+    report = play([PushFold(path, rng=np.random.default_rng(0)), CallingStation()], 1000, n_tables=500, stack=5, seed=0)
+    assert report['PushFold']['hands'] == 1000
+    assert cfr.StrategyTable(path).probabilities('all in', np.arange(3)).argmax(axis=1).tolist() == [1, 1, 1]
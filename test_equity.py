@@ -0,0 +1,360 @@
+from itertools import combinations
+from math import comb
+from collections import Counter
+import asyncio
+import json
+import numpy as np
+
+from PokerAI.cards import int_to_card, hand_to_ints, ints_to_hand
+from PokerAI.deck import get_raw_proba_of_winning, Round
+from PokerAI import preflop, ranges, stream
+from PokerAI.equity import equity, chunk_size, EquityTracker
+from PokerAI.canonical import LRUCache, cached_best_five, cached_equity, cached_outs, outs_cache
+from PokerAI.outs import outs
+from PokerAI import abstraction, features, headsup
+from PokerAI.features import hand_features, HandFeatures, batch_features
+from PokerAI.hand import best_five
+from PokerAI.evaluator import evaluate_batch
+from PokerAI.service import EquityService, EquityClient, simulate_many
+from PokerAI import sampling
+
+
+flop = [('D', 2), ('C', 7), ('S', 9)]
+
+
+def test_exact_on_the_river():
+    board = flop + [('H', 13), ('S', 13)]
+    p = get_raw_proba_of_winning([('S', 14), ('H', 14)], 2, board=board, exact=True)
+    assert p.method == 'exact'
+    assert p.n_deals == 990
+    # the board is known, the hand of hero is evaluated once
+    assert p.n_evaluations == 1 + 990
+    assert abs(sum(p.values()) - 1) < 1e-12
+
+
+def test_exact_against_known_hand_on_the_flop():
+    aces, sevens = [('S', 14), ('H', 14)], [('D', 7), ('H', 7)]
+    p = equity(aces, 2, board=flop, opponent_hands=[sevens], method='exact')
+    q = equity(sevens, 2, board=flop, opponent_hands=[aces], method='exact')
+    assert p.n_deals == q.n_deals == 990
+    assert p[1] == q[-1] and p[0] == q[0]
+
+
+def test_auto_picks_the_method():
+    assert equity([('S', 14), ('H', 14)], 2, board=flop + [('H', 13)], method='auto').method == 'exact'
+    assert equity([('S', 14), ('H', 14)], 3, method='auto', n_runs=10).method == 'simulate'
+
+
+def test_simulation_close_to_exact():
+    board = flop + [('H', 13)]
+    exact = equity([('S', 10), ('S', 11)], 2, board=board, method='exact')
+    simulated = equity([('S', 10), ('S', 11)], 2, board=board, n_runs=20000)
+    for outcome in (1, 0, -1):
+        assert abs(exact[outcome] - simulated[outcome]) < 0.02
+
+
+def test_preflop_classes():
+    hands = [[int_to_card(i), int_to_card(j)] for i, j in combinations(range(52), 2)]
+    sizes = Counter(preflop.names[preflop.class_index(hand)] for hand in hands)
+    assert len(sizes) == preflop.n_classes
+    assert sizes['AA'] == 6 and sizes['AKs'] == 4 and sizes['AKo'] == 12 and sizes['72o'] == 12
+    assert all(preflop.class_index(preflop.class_hand(index)) == index for index in range(preflop.n_classes))
+
+
+def test_preflop_table_lookup(tmp_path):
+    path = str(tmp_path / 'preflop_equity.npy')
+    table = np.zeros((preflop.n_classes, preflop.max_opponents, 3), dtype=np.float32)
+    table[0, 0] = 0.85, 0.01, 0.14
+    assert preflop.lookup([('D', 14), ('C', 14)], 2, path=path) is None
+    np.save(path, table)
+    p = preflop.lookup([('D', 14), ('C', 14)], 2, path=path)
+    assert p.method == 'table' and abs(p[1] - 0.85) < 1e-6 and abs(p[0] - 0.01) < 1e-6
+    assert preflop.lookup([('D', 14), ('C', 14)], 11, path=path) is None
+
+
+def test_seeded_simulation_does_not_depend_on_workers():
+    kwargs = dict(n_runs=3 * chunk_size + 17, seed=7)
+    p = equity([('S', 14), ('H', 13)], 3, workers=1, **kwargs)
+    q = equity([('S', 14), ('H', 13)], 3, workers=2, **kwargs)
+    assert dict(p) == dict(q)
+    assert p.n_deals == kwargs['n_runs']
+    assert dict(p) != dict(equity([('S', 14), ('H', 13)], 3, workers=1, n_runs=kwargs['n_runs'], seed=8))
+
+
+def test_adaptive_simulation_stops_at_target_precision():
+    p = equity([('S', 14), ('H', 14)], 2, ci_halfwidth=0.01, seed=0, max_runs=200_000)
+    assert p.n_deals < 200_000
+    for outcome in (1, 0):
+        low, high = p.intervals[outcome]
+        assert low <= p[outcome] <= high and high - low <= 0.02
+
+
+def test_adaptive_simulation_respects_max_runs():
+    p = equity([('S', 8), ('H', 9)], 4, ci_halfwidth=1e-6, deadline_ms=10_000, max_runs=4_000, seed=0)
+    assert p.n_deals == 4_000
+
+
+def test_tracker_follows_the_streets():
+    hand = [('S', 14), ('H', 14)]
+    board = flop + [('H', 13), ('H', 9)]
+    tracker = EquityTracker(hand, 2, n_runs=20_000, seed=3)
+    for n_cards in (0, 3, 4, 5):
+        p = tracker.update(board=board[:n_cards])
+        deals = tracker.deals
+        assert p.n_deals == 20_000
+        assert (deals[:, :n_cards] == hand_to_ints(board[:n_cards])).all()
+        assert all(len(set(deal)) == deals.shape[1] for deal in deals[:100].tolist())
+    exact = equity(hand, 2, board=board, method='exact')
+    assert abs(p[1] - exact[1]) < 0.01
+
+
+def test_round_equity_uses_the_dealt_streets():
+    round = Round(n_players=2)
+    round.flop
+    round.turn
+    p = round.equity(n_runs=2_000, seed=0)
+    assert (round.trackers[tuple(round.dealt_hands[0])].deals[:, :4] == hand_to_ints(round.board)).all()
+    assert p.n_deals == 2_000
+
+
+def test_parse_range():
+    assert (ranges.parse_range('AA') > 0).sum() == 6
+    assert (ranges.parse_range('TT+, AKo') > 0).sum() == 5 * 6 + 12
+    assert (ranges.parse_range('K9s-KJs, 76') > 0).sum() == 3 * 4 + 16
+    weights = ranges.parse_range('AK, AKs:0.5')
+    assert sorted(Counter(weights[weights > 0].tolist()).items()) == [(0.5, 4), (1.0, 12)]
+    for text in ('AsAs', 'AsKs, KdKd'):
+        try:
+            ranges.parse_range(text)
+            assert False
+        except ValueError:
+            pass
+
+
+def test_uniform_range_matches_random_hands():
+    board = flop + [('H', 13)]
+    p = ranges.range_equity([('S', 10), ('S', 11)], [np.ones(ranges.n_combos)], board=board, n_runs=50_000, seed=0)
+    exact = equity([('S', 10), ('S', 11)], 2, board=board, method='exact')
+    assert abs(p[1] - exact[1]) < 0.01
+    chunked = ranges.range_equity([('S', 10), ('S', 11)], ['AA, KQs'], board=board, n_runs=50_001, seed=0,
+                                  chunk_size=7000)
+    assert chunked.n_deals == 50_001 and abs(sum(chunked.values()) - 1) < 1e-12
+
+
+def test_ranges_never_share_cards():
+    rng = np.random.default_rng(0)
+    weights = [ranges.parse_range(text) for text in ('AA, KK', 'AK', 'AA, AKs')]
+    hands = ranges.sample_hands(weights, 5_000, rng)
+    held = np.sort(hands.reshape(len(hands), -1), axis=1)
+    assert not (held[:, 1:] == held[:, :-1]).any()
+
+
+def test_canonical_cache(tmp_path):
+    rng = np.random.default_rng(4)
+    for cards in rng.random((200, 52)).argsort(axis=1)[:, :7].tolist():
+        hand = ints_to_hand(cards)
+        category, best = cached_best_five(hand)
+        # best_five gives the number 1 to the ace of a five high straight
+        assert category == best_five(hand)[0]
+        assert {(suit, 14 if number == 1 else number) for suit, number in best} <= set(hand)
+
+    path = str(tmp_path / 'equity_cache.pkl')
+    cache = LRUCache(maxsize=10, path=path)
+    p = cached_equity([('S', 14), ('S', 13)], 3, n_runs=500, seed=1, cache=cache)
+    cache.save()
+    reloaded = LRUCache(maxsize=10, path=path)
+    q = cached_equity([('D', 13), ('D', 14)], 3, n_runs=500, seed=1, cache=reloaded)
+    assert dict(p) == dict(q) and reloaded.stats()['hits'] == 1
+    q[1], q[2] = 0.5, q[2]
+    assert dict(cached_equity([('S', 14), ('S', 13)], 3, n_runs=500, seed=1, cache=reloaded)) == dict(p)
+
+
+def test_stream_round_trip(tmp_path):
+    path = str(tmp_path / 'rounds')
+    batches = list(stream.simulate_stream(4, 2500, batch_size=1000, my_hand=[('S', 14), ('H', 14)], seed=2))
+    assert [len(batch) for batch in batches] == [1000, 1000, 500]
+    stream.write_stream(batches[:2], path)
+    stream.write_stream(batches[2:], path)
+    chunks = list(stream.read_stream(path, ['strengths', 'shares']))
+    assert len(chunks) == 3 and set(chunks[0]) == {'strengths', 'shares'}
+    assert np.array_equal(np.concatenate([chunk['strengths'] for chunk in chunks]),
+                          np.concatenate([batch['strengths'] for batch in batches]))
+    assert np.allclose(np.concatenate([chunk['shares'] for chunk in chunks]).sum(axis=1), 1)
+    p = stream.aggregate(path, players=[0])
+    q = equity([('S', 14), ('H', 14)], 4, n_runs=20_000, seed=0)
+    assert list(p) == ['AA'] and p['AA'].n_deals == 2500 and abs(p['AA'][1] - q[1]) < 0.04
+
+
+def test_stream_with_a_board():
+    board = [('D', 2), ('C', 7), ('S', 9)]
+    batch, = stream.simulate_stream(2, 1000, my_hand=[('S', 14), ('H', 13)], board=board, seed=0)
+    assert (batch['board'][:, :3] == hand_to_ints(board)).all()
+    dealt = np.concatenate([batch['hands'].reshape(1000, 4), batch['board']], axis=1)
+    assert all(len(set(row)) == 9 for row in dealt.tolist())
+
+
+def test_outs_cached_and_by_turn():
+    board = [('H', 2), ('H', 7), ('S', 9), ('D', 13)]
+    result = outs([('H', 14), ('H', 12)], board, opponent_range='KK-99, AKo, KQs')
+    assert len(result['cards']) == 46
+    assert set(result['outs']) <= {card for card, category in zip(result['cards'], result['categories'])
+                                   if category != 'highest_cards'}
+    cached = cached_outs([('C', 14), ('C', 12)], [('C', 2), ('C', 7), ('S', 9), ('D', 13)],
+                         opponent_range='KK-99, AKo, KQs')
+    swap = {'H': 'C', 'C': 'H'}
+    assert sorted((swap.get(suit, suit), number) for suit, number in cached['outs']) == sorted(result['outs'])
+    assert abs(cached['positive_potential'] - result['positive_potential']) < 1e-12
+
+
+def test_features_along_a_hand(monkeypatch):
+    my_hand = [('S', 14), ('S', 13)]
+    hand = HandFeatures(my_hand, opponent_range='22+, A2s+, KTo+', n_players=2, seed=0)
+    flop_features = hand.update(flop)
+    assert hand.update(flop) is flop_features
+    assert abs(flop_features['histogram'].sum() - 1) < 1e-9
+    assert 0 <= flop_features['effective_hand_strength'] <= 1
+    assert hand.update(flop, n_players=3)['hand_strength'] <= flop_features['hand_strength']
+
+    river = flop + [('H', 14), ('C', 3)]
+    exact = equity(my_hand, 2, board=river, method='exact')
+    assert abs(hand_features(my_hand, river)['hand_strength'] - exact[1] - exact[0] / 2) < 1e-9
+    n_entries = outs_cache.stats()['size']
+    budgeted = hand_features(my_hand, flop, deadline_ms=5, seed=0)
+    assert outs_cache.stats()['size'] == n_entries
+    assert abs(budgeted['hand_strength'] - hand_features(my_hand, flop)['hand_strength']) < 1e-12
+
+    batched = batch_features([my_hand, my_hand], [flop, []], n_samples=4000, seed=0)
+    assert abs(batched['hand_strength'][0] - hand_features(my_hand, flop)['hand_strength']) < 0.03
+    assert batched['positive_potential'][1] == 0
+    budgeted = batch_features([my_hand] * 3, [flop, flop + [('H', 14)], []], deadline_ms=5, seed=0)
+    assert abs(budgeted['hand_strength'][0] - batched['hand_strength'][0]) < 0.1
+    monkeypatch.setattr(features, 'max_batch_keys', 4000 * 52)
+    chunked = batch_features([my_hand] * 3, [flop, flop, []], n_samples=4000, seed=0)
+    assert abs(chunked['hand_strength'][:2] - batched['hand_strength'][0]).max() < 0.03
+    try:
+        batch_features([my_hand], [flop[:2]])
+        assert False
+    except ValueError:
+        pass
+
+
+def test_abstraction_equities_and_buckets():
+    flop_cards, runouts = hand_to_ints(flop), np.array([[20, 30], [33, 40]])
+    holes = np.array([[48, 49], [12, 13], [20, 31]])
+    equities, valid = abstraction.flop_equities(flop_cards, holes, runouts)
+    assert valid.tolist() == [[True, True, False], [True, True, True]]
+    for r, h in zip(*np.nonzero(valid)):
+        p = equity(ints_to_hand(holes[h].tolist()), 2, board=ints_to_hand(flop_cards + runouts[r].tolist()), method='exact')
+        assert abs(equities[r, h] - p[1] - p[0] / 2) < 1e-12
+
+    swapped = abstraction.suit_permutations[5]
+    assert (abstraction.canonical_indices(holes, np.tile(flop_cards, (3, 1))) ==
+            abstraction.canonical_indices(swapped[holes], swapped[np.tile(flop_cards, (3, 1))])).all()
+
+    histograms = np.array([[9, 1, 0, 0], [0, 0, 1, 9], [8, 2, 0, 0], [0, 1, 1, 8]])
+    assert abstraction.cluster(histograms, np.ones(4), n_buckets=2).tolist() == [0, 1, 0, 1]
+
+
+def test_abstraction_histograms_built_with_other_parameters(tmp_path):
+    path = str(tmp_path / 'histograms')
+    np.save(abstraction._beside(path, '.situations.npy'), np.arange(3))
+    np.lib.format.open_memmap(path, mode='w+', dtype=np.uint16, shape=(3, 20)).flush()
+    with open(abstraction._beside(path, '.parameters.json'), 'w') as outfile:
+        json.dump({'n_runouts': 200, 'bins': 20, 'seed': 0}, outfile)
+    abstraction.build_histograms(path=path)
+    assert np.load(path).shape == (3, 20) and np.load(abstraction._beside(path, '.situations.npy')).shape == (3,)
+    try:
+        abstraction.build_histograms(bins=10, path=path)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_headsup_board_counts_and_lookups(tmp_path):
+    board = np.array([3, 17, 22, 40, 46])
+    wins, ties = headsup.board_counts(board)
+    assert 2 * wins.sum() + ties.sum() == comb(47, 2) * comb(45, 2)
+    classes = preflop.class_indices(ranges.combos)
+    for first, second in [('AKs', 'T9o'), ('77', '77'), ('QJo', 'Q8s')]:
+        a, b = preflop.names.index(first), preflop.names.index(second)
+        expected = Counter()
+        for h in np.flatnonzero(classes == a):
+            for j in np.flatnonzero(classes == b):
+                cards = set(ranges.combos[h].tolist() + ranges.combos[j].tolist())
+                if len(cards) == 4 and not cards & set(board.tolist()):
+                    strengths = evaluate_batch(np.hstack([ranges.combos[[h, j]], np.tile(board, (2, 1))]))
+                    expected[int(np.sign(strengths[0] - strengths[1]))] += 1
+        assert (wins[a, b], ties[a, b]) == (expected[1], expected[0])
+
+    path = str(tmp_path / 'headsup.npy')
+    try:
+        headsup.all_in_equity([('S', 14), ('H', 13)], path=path)
+        assert False
+    except FileNotFoundError:
+        pass
+    np.save(path, np.stack([wins, ties, wins.T], axis=2).astype(np.uint32) + 1)
+    p = headsup.all_in_equity([('S', 14), ('H', 13)], 'QQ+, AK', path=path)
+    assert abs(sum(p.values()) - 1) < 1e-12 and p.method == 'table'
+    charts = headsup.push_fold([5], iterations=20, path=path)
+    assert charts[5]['push'].shape == (preflop.n_classes,)
+
+
+def test_service_batches_and_shares_the_cache():
+    async def session():
+        service = EquityService(window_ms=20, seed=0)
+        await service.start(port=0)
+        client = await EquityClient().connect(*service.address)
+        hands = [[('S', 14), ('S', 13)], [('H', 13), ('H', 14)], [('S', 9), ('H', 9)]] * 10
+        board = [('D', 2), ('C', 7), ('D', 9)]
+        results = await asyncio.gather(*[client.equity(hand, 2, board=board, n_runs=500) for hand in hands],
+                                       client.evaluate([[('S', 14), ('S', 13), ('S', 12), ('S', 11), ('S', 10)],
+                                                        board + [('S', 7), ('H', 7)]]),
+                                       client.equity([('S', 14), ('H', 14)], 2, board=board, method='exact'),
+                                       client.request('equity', my_hand=[('S', 2), ('S', 2)], n_players=2),
+                                       client.request('equity', my_hand=[('S', 2), ('S', 3)], n_players=30),
+                                       client.request('equity', my_hand=[('S', 2), ('S', 3)], n_players=2,
+                                                      n_runs=10 ** 9),
+                                       return_exceptions=True)
+        stats = await client.stats()
+        await client.close()
+        await service.close()
+        return results, stats
+
+    results, stats = asyncio.run(session())
+    *simulated, evaluated, exact, duplicate, crowded, huge = results
+    assert simulated[0] is not simulated[1] and dict(simulated[0]) == dict(simulated[1])
+    assert simulated[2][1] > 0.8 and simulated[0].n_deals == 500
+    assert evaluated['categories'] == ['straight_flush', 'three_of_a_kind']
+    assert exact == equity([('S', 14), ('H', 14)], 2, board=[('D', 2), ('C', 7), ('D', 9)], method='exact')
+    assert all(isinstance(error, RuntimeError) for error in (duplicate, crowded, huge))
+    assert stats['requests'] == 35 and stats['batches'] < 33 and stats['coalesced'] > 0
+    assert set(stats['latency_ms']) == {'p50', 'p90', 'p99'}
+
+    hero, board_cards = np.array(hand_to_ints([('S', 14), ('S', 13)])), np.array(hand_to_ints(flop))
+    remaining = np.setdiff1d(np.arange(52), np.concatenate([hero, board_cards]))
+    queries = [(hero, board_cards, [], remaining, 1, 70), (hero, board_cards, [], remaining, 2, 45)]
+    outputs = simulate_many(queries, rng=np.random.default_rng(0), chunk_size=30)
+    assert [(sum(counts.values()), n_evaluations) for counts, n_evaluations in outputs] == [(70, 140), (45, 135)]
+
+
+def test_sampling_modes_and_common_random_numbers():
+    uniforms = sampling.sample_uniforms(50_000, 6, 'quasi', np.random.default_rng(0))
+    deals = sampling.deals_from_uniforms(uniforms, np.arange(4, 52), [], 5, 1)
+    assert all(len(set(deal)) == 7 for deal in deals[:1000].tolist())
+    frequencies = np.bincount(deals.ravel(), minlength=52)[4:] / (7 * 50_000 / 48)
+    assert np.abs(frequencies - 1).max() < 0.05
+
+    hand, board = [('H', 14), ('H', 13)], [('H', 12), ('H', 7), ('C', 2), ('S', 9)]
+    exact = equity(hand, 2, board=board, method='exact')
+    for mode in ('stratified', 'quasi'):
+        p = equity(hand, 2, board=board, n_runs=5000, sampling=mode, seed=0)
+        assert p.n_deals == 5000 and p.n_effective > 0
+        assert p.intervals[1][0] - 0.01 < exact[1] < p.intervals[1][1] + 0.01
+
+    candidates = [[('S', 12), ('D', 11)], [('S', 13), ('D', 12)]]
+    equities, differences = sampling.compare(candidates, 2, board=board[:3], n_runs=4000, seed=0)
+    exact_difference = [equity(hand, 2, board=board[:3], method='exact') for hand in candidates]
+    shares = [p[1] + p[0] / 2 for p in exact_difference]
+    low, high = differences[1]['interval']
+    assert low - 0.01 < shares[1] - shares[0] < high + 0.01
+    assert differences[1]['n_effective'] > 4000 and differences[0]['difference'] == 0
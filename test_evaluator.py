@@ -0,0 +1,136 @@
+import os
+from itertools import combinations
+from collections import Counter
+import numpy as np
+
+from PokerAI.rank_index import hand_indices, _fill_block, _progress_path, build_index, n_hands
+from PokerAI.hand import hand_key, best_five_of_fives
+from PokerAI.cards import ints_to_hand
+from PokerAI.verify import order_mismatches, reference_keys
+from PokerAI.evaluator import (
+    evaluate,
+    evaluate_hand,
+    evaluate_batch,
+    category,
+    categories_batch,
+    categories,
+    describe,
+    pack,
+    packed_keys,
+    n_strengths
+)
+from PokerAI.test_hand import pickle_load, test_file_loc
+
+
+def reference_key(cards):
+    """
+    Packed key of a 5 cards hand, computed directly from the usual poker rules
+    """
+    numbers = [(card >> 2) + 2 for card in cards]
+    counts = Counter(numbers)
+    ordered = sorted(counts, key=lambda number: (counts[number], number), reverse=True)
+    shape = sorted(counts.values(), reverse=True)
+    is_flush = len({card & 3 for card in cards}) == 1
+    straight = 0
+    if len(counts) == 5 and max(numbers) - min(numbers) == 4:
+        straight = max(numbers)
+    elif sorted(numbers) == [2, 3, 4, 5, 14]:
+        straight = 5
+
+    if straight and is_flush:
+        return pack(8, [straight])
+    if shape[0] == 4:
+        return pack(7, ordered)
+    if shape == [3, 2]:
+        return pack(6, ordered)
+    if is_flush:
+        return pack(5, ordered)
+    if straight:
+        return pack(4, [straight])
+    if shape[0] == 3:
+        return pack(3, ordered)
+    if shape[:2] == [2, 2]:
+        return pack(2, ordered)
+    if shape[0] == 2:
+        return pack(1, ordered)
+    return pack(0, ordered)
+
+
+def test_number_of_strengths():
+    assert n_strengths == 7462
+
+
+def test_evaluate_against_reference():
+    rng = np.random.default_rng(0)
+    for n_cards in (5, 6, 7):
+        for _ in range(3000):
+            cards = rng.choice(52, n_cards, replace=False).tolist()
+            expected = max(reference_key(five) for five in combinations(cards, 5))
+            assert packed_keys[evaluate(cards) - 1] == expected, f"Cards {cards} wrongly evaluated"
+
+
+def test_categories_match_best_five():
+    for hand, result in pickle_load(test_file_loc):
+        assert category(evaluate_hand(hand)) == result[0], f"Hand {hand} wasn't correctly categorized"
+
+
+def test_describe():
+    hand = [('S', 10), ('C', 10), ('D', 10), ('S', 13), ('C', 13), ('H', 2), ('H', 3)]
+    assert describe(evaluate_hand(hand)) == ('full_house', [10, 13])
+
+
+def test_evaluate_batch_matches_evaluate():
+    rng = np.random.default_rng(1)
+    cards = rng.random((20000, 52)).argsort(axis=1)[:, :7]
+    for n_cards in (5, 6, 7):
+        strengths = evaluate_batch(cards[:, :n_cards])
+        assert strengths.tolist() == [evaluate(hand) for hand in cards[:, :n_cards].tolist()]
+        assert [categories[index] for index in categories_batch(strengths)] == [category(s) for s in strengths]
+
+
+def test_rank_index_blocks(tmp_path):
+    sevens = np.array(list(combinations(range(11), 7)))
+    assert sorted(hand_indices(sevens).tolist()) == list(range(len(sevens)))
+
+    path = str(tmp_path / 'rank_index.npy')
+    np.lib.format.open_memmap(path, mode='w+', dtype=np.uint16, shape=(n_hands,)).flush()
+    _fill_block((path, 9, 10))
+    table = np.load(path, mmap_mode='r')
+    hands = sevens[(sevens[:, 5] == 9) & (sevens[:, 6] == 10)]
+    assert table[hand_indices(hands)].tolist() == evaluate_batch(hands).tolist()
+
+    # a build left with a single block to do, at a path without the .npy suffix
+    path = str(tmp_path / 'rank_index')
+    np.lib.format.open_memmap(path, mode='w+', dtype=np.uint16, shape=(n_hands,)).flush()
+    done = np.ones((52, 52), dtype=bool)
+    done[9, 10] = False
+    np.save(_progress_path(path), done)
+    build_index(workers=1, path=path)
+    assert not os.path.exists(_progress_path(path))
+    table = np.load(path, mmap_mode='r')
+    assert table.shape == (n_hands,) and table[hand_indices(hands)].tolist() == evaluate_batch(hands).tolist()
+
+
+def test_hand_keys_order_as_evaluate():
+    rng = np.random.default_rng(3)
+    cards = rng.random((300, 52)).argsort(axis=1)[:, :7]
+    keys = [hand_key(best_five_of_fives(ints_to_hand(hand))) for hand in cards.tolist()]
+    strengths = evaluate_batch(cards)
+    assert np.array_equal(np.argsort(keys, kind='stable'), np.argsort(strengths, kind='stable'))
+
+
+def test_order_mismatches():
+    hand = [0, 1, 2, 3, 4]
+    pairs = {(1, 10): hand, (1, 11): hand, (2, 11): hand, (3, 12): hand}
+    split, n_split, unordered, n_unordered = order_mismatches(pairs)
+    assert n_split == 1 and split[0][0] == 1
+    assert n_unordered == 1 and unordered[0][0][0] == 1 and unordered[0][1][0] == 2
+
+
+def test_missing_reference_is_not_built_on_lookup(tmp_path):
+    try:
+        reference_keys(np.array([[0, 1, 2, 3, 5]]), path=str(tmp_path / 'reference_5.npy'))
+        assert False
+    except FileNotFoundError:
+        pass
+    assert not os.listdir(tmp_path)
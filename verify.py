@@ -0,0 +1,285 @@
+import argparse
+import importlib
+import os
+import pickle
+import sys
+from itertools import combinations
+from multiprocessing import Pool
+import numpy as np
+from PokerAI.cards import n_cards, ints_to_hand
+from PokerAI.evaluator import evaluate, evaluate_batch, categories, categories_batch
+from PokerAI.hand import best_five, hand_key
+from PokerAI.rank_index import binomials, evaluate_7
+from PokerAI.bench import hand_corpus
+
+"""
+Differential verification of fast evaluators against the reference semantics of hand.py: the best hand of 5
+to 7 cards is the best_five of one of its 5 cards subsets, and two hands compare as is_better compares their
+best hands. The reference of a hand is thus the largest hand_key of best_five over its 5 cards subsets, read
+from a table of the 2,598,960 hands of 5 cards (built once with best_five over a process pool), and a candidate
+evaluator agrees with the reference when:
+* the category of each hand is the same
+* its strengths are an increasing function of the reference keys: hands of equal reference get equal
+  strengths, and a better reference gives a larger strength
+
+Every hand of 5 or 7 cards can be streamed, in blocks sharing their highest cards spread over a process pool
+and checkpointed, or a sample holding as many hands of each category (see bench.hand_corpus):
+
+    python -m PokerAI.verify --candidate evaluate_batch --cards 7 [--sample 1000] [--workers 8]
+
+Any mismatch is reported with the hands involved, their reference best hands and the candidate strengths.
+"""
+
+table_folder = os.path.dirname(os.path.realpath(__file__)) + '/tables/'
+reference_path = os.path.join(table_folder, 'reference_5.npy')
+
+
+def _category_of_keys(keys):
+    return np.asarray(keys) >> 28
+
+
+def _evaluate_each(cards):
+    return np.array([evaluate(hand) for hand in cards.tolist()])
+
+
+def _best_five_keys(cards):
+    # best_five itself on the whole hand: exact on 5 cards, only an approximation of the reference on 7
+    return np.array([hand_key(best_five(ints_to_hand(hand))) for hand in cards.tolist()])
+
+
+candidates = {
+    'evaluate_batch': (evaluate_batch, categories_batch),
+    'evaluate': (_evaluate_each, categories_batch),
+    'rank_index': (evaluate_7, categories_batch),
+    'best_five': (_best_five_keys, _category_of_keys),
+}
+
+
+def load_candidate(name):
+    """
+    The strengths and categories functions of a candidate evaluator, either one of candidates or a function
+    given as 'module:function' mapping an (N, k) array of integer cards to N strengths, the categories being
+    those of the evaluator (see evaluator.categories_batch).
+    """
+    if name in candidates:
+        return candidates[name]
+    module, function = name.split(':')
+    return getattr(importlib.import_module(module), function), categories_batch
+
+
+def colex_indices(cards):
+    """
+    Positions of the hands of k integer cards, an array of shape (..., k), among all the hands of k cards in
+    colexicographic order (see rank_index.py).
+
+    >>> colex_indices(np.array([[0, 1, 2, 3, 4], [51, 50, 49, 48, 47]])).tolist()
+    [0, 2598959]
+    """
+    cards = np.sort(cards, axis=-1)
+    return binomials[cards, np.arange(1, cards.shape[-1] + 1)].sum(axis=-1)
+
+
+def blocks(k):
+    """
+    The highest cards shared by each block of hands of k cards: 1 card for 5 cards hands, 2 for 6 or 7 cards.
+    """
+    if k == 5:
+        return [(high,) for high in range(4, n_cards)]
+    return [(low, high) for high in range(k - 1, n_cards) for low in range(k - 2, high)]
+
+
+def block_hands(top, k):
+    """
+    All the hands of k integer cards whose highest cards are top, as an array of shape (N, k).
+
+    >>> block_hands((5, 6), 7).tolist()
+    [[0, 1, 2, 3, 4, 5, 6]]
+    """
+    lows = np.array(list(combinations(range(top[0]), k - len(top))), dtype=np.int64).reshape(-1, k - len(top))
+    return np.hstack([lows, np.broadcast_to(np.array(top), (len(lows), len(top)))])
+
+
+def _reference_block(top):
+    hands = block_hands(top, 5)
+    return colex_indices(hands), _best_five_keys(hands)
+
+
+def build_reference(workers=None, path=reference_path):
+    """
+    Compute hand_key(best_five(hand)) of all the hands of 5 cards over a pool of workers processes and save
+    them, indexed by colex_indices.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    keys = np.zeros(binomials[n_cards, 5], dtype=np.int64)
+    with Pool(workers) as pool:
+        for indices, block_keys in pool.imap_unordered(_reference_block, blocks(5)):
+            keys[indices] = block_keys
+    temporary_path = path + '.tmp.npy'
+    np.save(temporary_path, keys)
+    os.replace(temporary_path, path)
+    _references.pop(path, None)
+    return keys
+
+
+_references = dict()
+
+
+def load_reference(path=reference_path):
+    if path not in _references:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} is not built yet, run python -m PokerAI.verify which builds it first")
+        _references[path] = np.load(path)
+    return _references[path]
+
+
+def reference_keys(cards, path=reference_path):
+    """
+    The reference keys of hands of 5 to 7 integer cards, an array of shape (N, k): the largest hand_key of
+    best_five over the 5 cards subsets of each hand.
+    """
+    table = load_reference(path)
+    # the subsets of sorted cards are sorted, their colex indices are sums of binomials of each column
+    columns = np.sort(cards, axis=1).T
+    terms = {(column, i): binomials[columns[column], i] for column in range(len(columns)) for i in range(1, 6)}
+    keys = np.zeros(len(cards), dtype=np.int64)
+    for subset in combinations(range(cards.shape[1]), 5):
+        indices = sum(terms[column, i] for i, column in enumerate(subset, start=1))
+        np.maximum(keys, table[indices], out=keys)
+    return keys
+
+
+def describe_key(key):
+    """
+    >>> describe_key(hand_key(('pair', [('C', 9), ('D', 10), ('D', 11), ('D', 14), ('H', 14)])))
+    ('pair', [14, 14, 11, 10, 9])
+    """
+    numbers = [int(key >> shift) & 15 for shift in range(24, -1, -4)]
+    return categories[int(key) >> 28], [number for number in numbers if number]
+
+
+def check_hands(cards, candidate, path=reference_path, max_examples=5):
+    """
+    Compare a candidate with the reference on the hands of the (N, k) array cards. Return the number of hands,
+    the category mismatches (a count and a few example hands) and, for each distinct pair of reference key and
+    candidate strength, one hand having them.
+    """
+    strengths_function, categories_function = load_candidate(candidate)
+    keys = reference_keys(cards, path)
+    strengths = np.asarray(strengths_function(cards)).astype(np.int64)
+
+    wrong = np.flatnonzero(categories_function(strengths) != _category_of_keys(keys))
+    examples = [(cards[i].tolist(), int(keys[i]), int(strengths[i])) for i in wrong[:max_examples]]
+
+    order = np.lexsort((strengths, keys))
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = (np.diff(keys[order]) != 0) | (np.diff(strengths[order]) != 0)
+    pairs = {(int(keys[i]), int(strengths[i])): cards[i].tolist() for i in order[new]}
+    return len(cards), len(wrong), examples, pairs
+
+
+def _check_task(task):
+    top, cards, k, candidate, path = task
+    if cards is None:
+        cards = block_hands(top, k)
+    return top, check_hands(cards, candidate, path)
+
+
+def _merge(state, result, max_examples=5):
+    n_hands, n_wrong, examples, pairs = result
+    state['n_hands'] += n_hands
+    state['category_mismatches'] += n_wrong
+    state['category_examples'] = (state['category_examples'] + examples)[:max_examples]
+    for pair, hand in pairs.items():
+        state['pairs'].setdefault(pair, hand)
+
+
+def order_mismatches(pairs, max_examples=5):
+    """
+    From the hands found for each pair of reference key and candidate strength, the reference keys given
+    several strengths and the consecutive reference keys not given increasing strengths, with example hands.
+    """
+    strengths = dict()
+    for key, strength in sorted(pairs):
+        strengths.setdefault(key, []).append(strength)
+
+    split = [(key, [(strength, pairs[key, strength]) for strength in found])
+             for key, found in strengths.items() if len(found) > 1]
+    keys = sorted(strengths)
+    unordered = [((lower, max(strengths[lower]), pairs[lower, max(strengths[lower])]),
+                  (higher, min(strengths[higher]), pairs[higher, min(strengths[higher])]))
+                 for lower, higher in zip(keys, keys[1:]) if max(strengths[lower]) >= min(strengths[higher])]
+    return split[:max_examples], len(split), unordered[:max_examples], len(unordered)
+
+
+def verify(candidate='evaluate_batch', k=7, sample=None, seed=0, workers=None, path=reference_path,
+           checkpoint=None, chunk_size=20_000):
+    """
+    Check a candidate evaluator against the reference on every hand of k cards or, given sample, on sample
+    hands of each category. The exhaustive sweep is checkpointed after each block of hands when a checkpoint
+    path is given, and resumes from it. The reference table is built first if it is missing. Return a report,
+    see format_report.
+    """
+    if not os.path.exists(path):
+        build_reference(workers=workers, path=path)
+    load_reference(path)
+    state = {'done': set(), 'n_hands': 0, 'category_mismatches': 0, 'category_examples': [], 'pairs': dict()}
+    if sample is not None:
+        corpus = hand_corpus(per_category=sample, seed=seed, n_cards=k)
+        tasks = [(start, corpus[start:start + chunk_size], k, candidate, path)
+                 for start in range(0, len(corpus), chunk_size)]
+        checkpoint = None
+    else:
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint, 'rb') as infile:
+                state = pickle.load(infile)
+        tasks = [(top, None, k, candidate, path) for top in blocks(k) if top not in state['done']]
+
+    with Pool(workers) as pool:
+        for top, result in pool.imap_unordered(_check_task, tasks):
+            _merge(state, result)
+            state['done'].add(top)
+            if checkpoint is not None:
+                temporary_path = checkpoint + '.tmp'
+                with open(temporary_path, 'wb') as outfile:
+                    pickle.dump(state, outfile)
+                os.replace(temporary_path, checkpoint)
+
+    split, n_split, unordered, n_unordered = order_mismatches(state['pairs'])
+    return {'candidate': candidate, 'cards': k, 'n_hands': state['n_hands'],
+            'category_mismatches': state['category_mismatches'], 'category_examples': state['category_examples'],
+            'split': n_split, 'split_examples': split, 'unordered': n_unordered, 'unordered_examples': unordered}
+
+
+def format_report(report):
+    """
+    The report as text: the counts of mismatches, then for each example the hand, its reference best hand and
+    the candidate strength.
+    """
+    lines = [f"{report['candidate']} on {report['n_hands']:,} hands of {report['cards']} cards: "
+             f"{report['category_mismatches']} category mismatches, {report['split']} reference hands given several "
+             f"strengths, {report['unordered']} pairs of reference hands wrongly ordered"]
+    for hand, key, strength in report['category_examples']:
+        lines.append(f"category  {ints_to_hand(hand)}: reference {describe_key(key)}, candidate {strength}")
+    for key, found in report['split_examples']:
+        lines.append(f"split     reference {describe_key(key)}: " +
+                     ', '.join(f"{strength} for {ints_to_hand(hand)}" for strength, hand in found))
+    for (lower, lower_strength, lower_hand), (higher, higher_strength, higher_hand) in report['unordered_examples']:
+        lines.append(f"order     {ints_to_hand(lower_hand)} ({describe_key(lower)}, {lower_strength}) is not "
+                     f"below {ints_to_hand(higher_hand)} ({describe_key(higher)}, {higher_strength})")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check a fast evaluator against best_five and is_better')
+    parser.add_argument('--candidate', default='evaluate_batch',
+                        help=f"one of {', '.join(candidates)} or module:function")
+    parser.add_argument('--cards', type=int, default=7, choices=[5, 6, 7])
+    parser.add_argument('--sample', type=int, default=None, help='hands of each category, all the hands by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='processes used, all the cores by default')
+    parser.add_argument('--checkpoint', default=None, help='file to checkpoint the exhaustive sweep to')
+    args = parser.parse_args()
+    report = verify(args.candidate, args.cards, sample=args.sample, seed=args.seed, workers=args.workers,
+                    checkpoint=args.checkpoint)
+    print(format_report(report))
+    sys.exit(int(any(report[name] for name in ('category_mismatches', 'split', 'unordered'))))